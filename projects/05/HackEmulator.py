@@ -0,0 +1,159 @@
+from pathlib import Path
+from argparse import ArgumentParser
+from typing import Iterable, Sequence
+import sys
+
+# packed ROMs are read with the assembler's project
+sys.path.append(str(Path(__file__).resolve().parent.parent / '06'))
+from HackRom import ROM_SUFFIX, map_rom
+
+
+# ALU output for each 6-bit comp code (zx nx zy ny f no), given D and the A/M operand y. Values are unsigned 16-bit
+ALU = {
+    0b101010: lambda d, y: 0,
+    0b111111: lambda d, y: 1,
+    0b111010: lambda d, y: 0xFFFF,
+    0b001100: lambda d, y: d,
+    0b110000: lambda d, y: y,
+    0b001101: lambda d, y: d ^ 0xFFFF,
+    0b110001: lambda d, y: y ^ 0xFFFF,
+    0b001111: lambda d, y: -d & 0xFFFF,
+    0b110011: lambda d, y: -y & 0xFFFF,
+    0b011111: lambda d, y: (d + 1) & 0xFFFF,
+    0b110111: lambda d, y: (y + 1) & 0xFFFF,
+    0b001110: lambda d, y: (d - 1) & 0xFFFF,
+    0b110010: lambda d, y: (y - 1) & 0xFFFF,
+    0b000010: lambda d, y: (d + y) & 0xFFFF,
+    0b010011: lambda d, y: (d - y) & 0xFFFF,
+    0b000111: lambda d, y: (y - d) & 0xFFFF,
+    0b000000: lambda d, y: d & y,
+    0b010101: lambda d, y: d | y,
+}
+
+# for each 3-bit jump code, whether to jump when the ALU output is zero, positive, negative
+JUMP = [
+    (False, False, False),  # null
+    (False, True, False),   # JGT
+    (True, False, False),   # JEQ
+    (True, True, False),    # JGE
+    (False, False, True),   # JLT
+    (False, True, True),    # JNE
+    (True, False, True),    # JLE
+    (True, True, True),     # JMP
+]
+
+
+class HackEmulator:
+    """
+    cycle counting emulator of the Hack computer. Each instruction takes one cycle.
+    A-instructions may load values wider than 15 bits (written as longer binary lines by the assembler), so programs
+    too large for the 32K ROM still run. That allows comparing builds that don't fit, at the cost of fidelity
+    """
+
+    def __init__(self, code: Iterable[str]):
+        # instructions are decoded once up front into (alu, dest, jump) tuples. A-instructions are (None, value, None)
+        self.rom: list[tuple] = [decode(line) for line in code]
+        self.ram = [0] * 65536
+        self.a = self.d = self.pc = 0
+        self.cycles = 0
+
+    @staticmethod
+    def load(path: Path) -> 'HackEmulator':
+        """load a program from a .hack file, or from a packed .hrom file (memory mapped while it's decoded)"""
+        if path.suffix == ROM_SUFFIX:
+            with map_rom(path) as rom:
+                return HackEmulator.from_words(rom.words, rom.wide)
+        return HackEmulator(path.read_text().split())
+
+    @staticmethod
+    def from_words(words: Sequence[int], wide: dict[int, int] = {}) -> 'HackEmulator':
+        """a program from its machine words, plus any wide A-instructions by address (as HackRom.map_rom maps them)"""
+        emulator = HackEmulator([])
+        cached = decoded_words.get
+        emulator.rom = [cached(word) or decode_word(word) for word in words]
+        for address, value in wide.items():
+            emulator.rom[address] = None, value, None
+        return emulator
+
+    def run(self, max_cycles: int, breakpoint: int | None = None, hits: int = 1, profile: list[int] | None = None) -> bool:
+        """
+        run until max_cycles have been executed in total, or until the pc has reached the breakpoint address `hits` times.
+        If profile is given (one counter per ROM address), the number of times each instruction executes is added to it.
+        Returns whether the breakpoint was reached
+        """
+        rom, ram, jump_table = self.rom, self.ram, JUMP
+        a, d, pc, cycles = self.a, self.d, self.pc, self.cycles
+        reached = False
+        breakpoint = -1 if breakpoint is None else breakpoint
+
+        while cycles < max_cycles:
+            if pc == breakpoint:
+                hits -= 1
+                if hits == 0:
+                    reached = True
+                    break
+
+            alu, dest, jump = rom[pc]
+            cycles += 1
+            if profile is not None:
+                profile[pc] += 1
+            if alu is None:
+                a = dest
+                pc += 1
+                continue
+
+            # registers update at the end of the cycle, so M writes and jumps use the A value from before this instruction
+            uses_m, alu = alu
+            out = alu(d, ram[a] if uses_m else a)
+            if jump and jump_table[jump][0 if out == 0 else 1 if out < 0x8000 else 2]:
+                pc = a
+            else:
+                pc += 1
+
+            if dest & 1:
+                ram[a] = out
+            if dest & 2:
+                d = out
+            if dest & 4:
+                a = out
+
+        self.a, self.d, self.pc, self.cycles = a, d, pc, cycles
+        return reached
+
+    def screen(self) -> list[int]:
+        return self.ram[16384:24576]
+
+
+def decode(line: str) -> tuple:
+    """decode one line of a .hack file"""
+    if line[0] == '0':
+        return None, int(line[1:], 2), None
+
+    # dest bits are A D M from high to low, i.e. M=1 D=2 A=4
+    comp, dest, jump = int(line[3:10], 2), int(line[10:13], 2), int(line[13:16], 2)
+    uses_m, comp = comp >> 6, comp & 0b111111
+    if comp not in ALU:
+        raise ValueError(f'Invalid instruction: {line}')
+    return (bool(uses_m), ALU[comp]), dest, jump
+
+
+# decoded form of every machine word seen so far. Programs only use a few thousand distinct words, so loading the same
+# (or a similar) ROM again decodes next to nothing
+decoded_words: dict[int, tuple] = {}
+
+def decode_word(word: int) -> tuple:
+    """decode one machine word"""
+    decoded = decoded_words[word] = decode(f'{word:016b}')
+    return decoded
+
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('path', type=Path, help='Path to a .hack or .hrom file')
+    parser.add_argument('--cycles', type=int, default=10_000_000, help='Number of cycles to run for')
+    args = parser.parse_args()
+
+    emulator = HackEmulator.load(args.path)
+    emulator.run(args.cycles)
+    print(f'ran {emulator.cycles} cycles. pc={emulator.pc} A={emulator.a} D={emulator.d} SP={emulator.ram[0]}')
@@ -1,34 +1,252 @@
-def assemble(path: str):
-    """assembles a .asm file into a .hack file. For input file is xxx.asm, output file will be xxx.hack"""
+from argparse import ArgumentParser
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import repeat
+from pathlib import Path
+from time import perf_counter
+from typing import Iterable
+import glob
+import json
+import sys
+
+import HackOptimizer
+from HackRom import ROM_SUFFIX, hack_lines, write_hack, write_rom
+
+# optimized programs are verified on the emulator
+sys.path.append(str(Path(__file__).resolve().parent.parent / '05'))
+from HackEmulator import HackEmulator
+
+
+def assemble(path: str, binary: bool = False, optimize: bool = False):
+    """
+    assembles a .asm file into a .hack file. For input file is xxx.asm, output file will be xxx.hack
+    If binary, the output is a packed xxx.hrom file instead (see HackRom.py)
+    If optimize, the code goes through the peephole optimizer (see HackOptimizer.py) first, and the words it saved are printed
+    """
 
     assert path.endswith('.asm'), 'Input file must be a .asm file'
-    
-    # read the raw source code
+    out_path = output_path(Path(path), binary)
+    savings = {}
+    words = assemble_file(Path(path), binary, optimize=optimize, savings=savings)
+    if optimize:
+        print(HackOptimizer.report(savings, words + sum(savings.values())))
+    print(f'wrote to {out_path}')
+
+
+def assemble_stream(path: str, binary: bool = False):
+    """
+    assembles a .asm file into a .hack (or if binary, .hrom) file like assemble(), but in a single pass over the file as it's read:
+    each instruction is encoded into a machine word straight away, and symbolic A-instructions are patched once
+    every label is known. Memory use grows with the size of the machine code rather than with several copies of the source
+    """
+
+    assert path.endswith('.asm'), 'Input file must be a .asm file'
+    out_path = output_path(Path(path), binary)
+    assemble_file(Path(path), binary, stream=True)
+    print(f'wrote to {out_path}')
+
+
+def output_path(path: Path, binary: bool = False) -> Path:
+    """the .hack (or if binary, .hrom) file a .asm file is assembled into"""
+    return path.with_suffix(ROM_SUFFIX if binary else '.hack')
+
+
+def assemble_file(path: Path, binary: bool = False, stream: bool = False, optimize: bool = False, savings: dict[str, int] | None = None) -> int:
+    """
+    assembles a .asm file into its .hack (or if binary, .hrom) file, in a single pass if stream, or peephole optimized
+    if optimize (with the words saved by each rule added to `savings`). Returns the number of instructions
+    """
+
+    assert not (stream and optimize), 'Optimizing needs the whole program in memory, so it can\'t be streamed'
     with open(path, 'r') as f:
-        src = f.read()
+        if stream:
+            code, wide = assemble_single_pass(f)
+        else:
+            code, wide = assemble_words(remove_all_whitespace(f.read().splitlines()), optimize, savings)
+
+    out_path = output_path(path, binary)
+    if binary:
+        write_rom(out_path, code, wide)
+    else:
+        with open(out_path, 'w', buffering=1 << 20) as f:
+            write_hack(f, code, wide)
+
+    return len(code)
+
+
+def assemble_single_pass(lines: Iterable[str]) -> tuple[array, dict[int, int]]:
+    """
+    assembles raw lines of assembly code (e.g. an open file, read line by line) into machine words, in one pass.
+    A-instructions with symbols are encoded as 0 and recorded in a fixup table, since a label may only be defined
+    after it's used; they're patched at the end, with variables allocated in the order they're first used, as assemble_code does.
+    A-instructions loading values that don't fit in 15 bits (e.g. addresses in programs too large for the ROM) are
+    returned separately, by address, so they can still be written as wider lines
+    """
+
+    code = array('H')
+    labels: dict[str, int] = {}
+    wide: dict[int, int] = {}
+
+    # fixup table: the address of each symbolic A-instruction, and the index of its symbol in `names`
+    fixup_addresses = array('I')
+    fixup_symbols = array('I')
+    names: list[str] = []            # every symbol used by an A-instruction, in order of first use
+    symbol_ids: dict[str, int] = {}  # index of each symbol in `names`
+
+    start = perf_counter()
+    c_words, a_words = c_instruction_words.get, a_instruction_words.get
+    a_count = c_misses = a_misses = 0
+
+    for line in lines:
+        line = remove_line_whitespace(line)
+        if not line:
+            continue
+        if line[0] == '(':
+            labels[line[1:-1]] = len(code)
+            continue
+
+        if line[0] != '@':
+            word = c_words(line)
+            if word is None:
+                word = encode_c_miss(line)
+                c_misses += 1
+            code.append(word)
+            continue
+
+        a_count += 1
+        word = a_words(line)
+        if word is None:
+            value = line[1:]
+            if not value.isdigit():
+                symbol = symbol_ids.get(value)
+                if symbol is None:
+                    symbol = symbol_ids[value] = len(names)
+                    names.append(value)
+                fixup_addresses.append(len(code))
+                fixup_symbols.append(symbol)
+                code.append(0)
+                continue
+            word = encode_a_miss(line)
+            a_misses += 1
+            if word >= 0x8000:
+                wide[len(code)] = word
+                word = 0
+        code.append(word)
+
+    # resolve every symbol: a label if one was defined anywhere in the program, otherwise the next variable
+    values = []
+    variable = first_variable_address
+    for name in names:
+        if name in labels:
+            values.append(labels[name])
+        else:
+            values.append(variable)
+            variable += 1
+
+    # backpatch the symbolic A-instructions
+    for address, symbol in zip(fixup_addresses, fixup_symbols):
+        value = values[symbol]
+        if value < 0x8000:
+            code[address] = value
+        else:
+            wide[address] = value
+
+    encoder_stats.add(len(code) - a_count, c_misses, a_count, a_misses, len(fixup_addresses), perf_counter() - start)
+    return code, wide
+
 
-    # split the source code into lines
-    lines = src.splitlines()
+def assemble_lines(lines: list[str]) -> list[str]:
+    """assembles raw lines of assembly code into lines of binary code"""
 
     # remove whitespace and comments
     lines = remove_all_whitespace(lines)
+
+    return assemble_code(lines)
+
+
+def assemble_code(lines: list[str]) -> list[str]:
+    """
+    assembles lines of assembly code into lines of binary code
+    assumes all whitespace and comments have been removed
+    """
     
+    # convert each line to its binary representation
+    return hack_lines(*assemble_words(lines))
+
+
+def assemble_words(lines: list[str], optimize: bool = False, savings: dict[str, int] | None = None) -> tuple[array, dict[int, int]]:
+    """
+    assembles lines of assembly code (without whitespace or comments) into machine words, along with any
+    A-instructions loading values that don't fit in 15 bits, by address. If optimize, the code is peephole
+    optimized first (see optimize_code)
+    """
+
     # initialize the symbol table
-    symbols = generate_symbol_table(lines)
+    if optimize:
+        lines, symbols = optimize_code(lines, savings)
+    else:
+        symbols = generate_symbol_table(lines)
 
     # remove the labels from the code
     lines = [line for line in lines if not line.startswith('(')]
 
-    # convert each line to its binary representation
-    lines = [binarize_line(line, symbols) for line in lines]
+    return encode_lines(lines, symbols)
 
-    # write the binary code to a .hack file
-    out_path = path.replace('.asm', '.hack')
-    with open(out_path, 'w') as f:
-        f.write('\n'.join(lines))
 
-    print(f'wrote to {out_path}')
-    
+def optimize_code(lines: list[str], savings: dict[str, int] | None = None) -> tuple[list[str], dict[str, int]]:
+    """
+    peephole optimize lines of assembly code (without whitespace or comments), giving the optimized lines and their symbol
+    table. Variables keep the addresses they have in the original program, even if the code that first used one is removed
+    """
+    symbols = generate_symbol_table(lines)
+    lines = HackOptimizer.optimize(lines, symbols, savings)
+    symbols.update(label_addresses(lines))
+    return lines, symbols
+
+
+def verify_optimized(lines: list[str], until: str, hits: int = 1, max_cycles: int = 100_000_000) -> list[str]:
+    """
+    check on the emulator that optimizing a program (lines without whitespace or comments) doesn't change what it does.
+    Both builds run until they reach the `until` label `hits` times, and must have reached every label equally often and
+    hold the same RAM by then. Blocks are only optimized internally, so the machine state agrees wherever a label is
+    reached, except for code addresses (e.g. return addresses on the stack): a word that holds the address of a label
+    in one build may hold the address of the same label in the other. Returns the differences found
+    """
+    builds = []
+    for optimize in False, True:
+        if optimize:
+            code_lines, symbols = optimize_code(lines)
+        else:
+            code_lines, symbols = lines, generate_symbol_table(lines)
+        labels = label_addresses(code_lines)
+        if until not in labels:
+            return [f'program has no label {until} to stop at']
+        emulator = HackEmulator.from_words(*encode_lines([line for line in code_lines if line[0] != '('], symbols))
+        profile = [0] * (len(emulator.rom) + 1)
+        if not emulator.run(max_cycles, labels[until], hits, profile):
+            return [f'{"optimized" if optimize else "original"} program didn\'t reach {until} within {max_cycles} cycles']
+        # the run stops before the instruction at the label executes, but it was reached all the same
+        profile[labels[until]] += 1
+        builds.append((labels, profile, emulator))
+    (labels, profile, original), (optimized_labels, optimized_profile, optimized) = builds
+
+    differences = []
+    for label, address in labels.items():
+        visits, optimized_visits = profile[address], optimized_profile[optimized_labels[label]]
+        if visits != optimized_visits:
+            differences.append(f'{label} reached {visits} times, {optimized_visits} times when optimized')
+
+    # label addresses in the optimized build, by their address in the original one
+    moved: dict[int, set[int]] = {}
+    for label, address in labels.items():
+        moved.setdefault(address, set()).add(optimized_labels[label])
+    for address, (value, optimized_value) in enumerate(zip(original.ram, optimized.ram)):
+        if value != optimized_value and optimized_value not in moved.get(value, ()):
+            differences.append(f'RAM[{address}] is {value}, {optimized_value} when optimized')
+
+    return differences
+
 
 def remove_all_whitespace(lines: list[str]) -> list[str]:
     """removes whitespace and comments from a list of raw assembly code lines"""
@@ -49,6 +267,21 @@ def remove_line_whitespace(line: str) -> str:
     return line
 
 
+# symbols every program can use without defining them
+predefined_symbols = {
+    'SP': 0,
+    'LCL': 1,
+    'ARG': 2,
+    'THIS': 3,
+    'THAT': 4,
+    **{f'R{i}': i for i in range(0, 16)},
+    'SCREEN': 16384,
+    'KBD': 24576,
+}
+
+# address of the first variable. Variables get consecutive addresses in the order they're first used
+first_variable_address = 16
+
 def generate_symbol_table(lines: list[str]) -> dict[str, int]:
     """
     generates a symbol table from a list of assembly code lines
@@ -56,27 +289,13 @@ def generate_symbol_table(lines: list[str]) -> dict[str, int]:
     """
 
     #default symbol table values
-    symbols = {
-        'SP': 0,
-        'LCL': 1,
-        'ARG': 2,
-        'THIS': 3,
-        'THAT': 4,
-        **{f'R{i}': i for i in range(0, 16)},
-        'SCREEN': 16384,
-        'KBD': 24576,
-    }
+    symbols = {**predefined_symbols}
 
     #add the labels to the symbol table
-    i = 0
-    for line in lines:
-        if line.startswith('(') and line.endswith(')'):
-            symbols[line[1:-1]] = i
-        else:
-            i += 1
+    symbols.update(label_addresses(lines))
 
     #add the variables to the symbol table
-    address = 16
+    address = first_variable_address
     for i, line in enumerate(lines):
         if line.startswith('@') and not line[1:].isdigit() and line[1:] not in symbols:
             symbols[line[1:]] = address
@@ -87,6 +306,18 @@ def generate_symbol_table(lines: list[str]) -> dict[str, int]:
     return symbols
 
 
+def label_addresses(lines: list[str]) -> dict[str, int]:
+    """the address of each label in lines of assembly code without whitespace or comments"""
+    labels = {}
+    i = 0
+    for line in lines:
+        if line.startswith('(') and line.endswith(')'):
+            labels[line[1:-1]] = i
+        else:
+            i += 1
+    return labels
+
+
 def binarize_line(line: str, symbols: dict[str, int]) -> str:
     """converts a line of assembly code to its binary representation"""
     if line.startswith('@'):
@@ -120,6 +351,11 @@ COMP = {
     'A-D': '0000111', 'M-D': '1000111',
     'D&A': '0000000', 'D&M': '1000000',
     'D|A': '0010101', 'D|M': '1010101',
+
+    # commuted forms of the above, as emitted by the vm translator
+    'A+D': '0000010', 'M+D': '1000010',
+    'A&D': '0000000', 'M&D': '1000000',
+    'A|D': '0010101', 'M|D': '1010101',
 }
 
 DEST = {
@@ -158,7 +394,265 @@ def binarize_c_instruction(line: str) -> str:
     return f'111{COMP[comp]}{DEST[dest]}{JUMP[jump]}'
 
 
+
+################## cached instruction encoding ##################
+
+@dataclass
+class EncoderStats:
+    """counters of the cached instruction encoder (since the module was loaded), to check cache hit rates and throughput"""
+    c_instructions: int = 0  # C-instructions encoded
+    c_misses: int = 0        # how many of them weren't in the cache (other spellings than dest=comp;jump, as it's prewarmed with all of those)
+    a_instructions: int = 0  # A-instructions encoded
+    a_misses: int = 0        # how many of them had a number that wasn't in the cache yet
+    a_symbols: int = 0       # how many of them had a label or variable, which are resolved per program rather than cached
+    seconds: float = 0.0     # time spent assembling
+
+    def add(self, c_instructions: int, c_misses: int, a_instructions: int, a_misses: int, a_symbols: int, seconds: float):
+        self.c_instructions += c_instructions
+        self.c_misses += c_misses
+        self.a_instructions += a_instructions
+        self.a_misses += a_misses
+        self.a_symbols += a_symbols
+        self.seconds += seconds
+
+    def report(self) -> str:
+        instructions = self.c_instructions + self.a_instructions
+        a_cached = self.a_instructions - self.a_symbols
+        return '\n'.join([
+            f'{instructions} instructions in {self.seconds:.3f} s ({instructions / max(self.seconds, 1e-9):.0f} lines/sec)',
+            f'C-instructions: {self.c_instructions}, cache hit rate {1 - self.c_misses / max(self.c_instructions, 1):.2%} ({self.c_misses} misses)',
+            f'A-instructions: {self.a_instructions} ({self.a_symbols} with symbols), cache hit rate {1 - self.a_misses / max(a_cached, 1):.2%} '
+            f'of the rest ({self.a_misses} misses)',
+        ])
+
+encoder_stats = EncoderStats()
+
+# machine word of every C-instruction: all legal dest=comp;jump combinations up front (dest and jump left out when null),
+# plus any other spelling binarize_c_instruction accepts once it's been seen
+c_instruction_words: dict[str, int] = {
+    ('' if dest == 'null' else f'{dest}=') + comp + ('' if jump == 'null' else f';{jump}'): int(f'111{COMP[comp]}{DEST[dest]}{JUMP[jump]}', 2)
+    for dest in DEST for comp in COMP for jump in JUMP
+}
+
+# machine word of every A-instruction with a predefined symbol, or with a number seen so far
+a_instruction_words: dict[str, int] = {f'@{name}': value for name, value in predefined_symbols.items()}
+
+def encode_c_miss(line: str) -> int:
+    """encode a C-instruction that isn't in the cache, and add it"""
+    word = c_instruction_words[line] = int(binarize_c_instruction(line), 2)
+    return word
+
+def encode_a_miss(line: str) -> int:
+    """encode an A-instruction with a number that isn't in the cache, and add it if the value fits in 15 bits"""
+    word = int(line[1:])
+    if word < 0x8000:
+        a_instruction_words[line] = word
+    return word
+
+
+def encode_lines(lines: list[str], symbols: dict[str, int]) -> tuple[array, dict[int, int]]:
+    """
+    the machine words of lines of assembly code (without whitespace, comments or labels) through the instruction caches,
+    with the program's labels and variables looked up in its symbol table. A-instructions loading values that don't fit
+    in 15 bits are returned separately, by address
+    """
+    start = perf_counter()
+    code = array('H')
+    wide: dict[int, int] = {}
+    c_words, a_words = c_instruction_words.get, a_instruction_words.get
+    a_count = c_misses = a_misses = a_symbols = 0
+
+    for line in lines:
+        if line[0] != '@':
+            word = c_words(line)
+            if word is None:
+                word = encode_c_miss(line)
+                c_misses += 1
+            code.append(word)
+            continue
+
+        a_count += 1
+        word = a_words(line)
+        if word is None:
+            value = line[1:]
+            if value.isdigit():
+                word = encode_a_miss(line)
+                a_misses += 1
+            else:
+                word = symbols[value]
+                a_symbols += 1
+            if word >= 0x8000:
+                wide[len(code)] = word
+                word = 0
+        code.append(word)
+
+    encoder_stats.add(len(code) - a_count, c_misses, a_count, a_misses, a_symbols, perf_counter() - start)
+    return code, wide
+
+
+
+################## batch assembly ##################
+
+@dataclass
+class BatchStats:
+    """what a batch run did, for its throughput summary"""
+    files: int = 0         # files assembled
+    skipped: int = 0       # files skipped because their output was up to date
+    instructions: int = 0  # instructions in the assembled files
+    seconds: float = 0.0   # wall time of the whole run
+
+    def report(self) -> str:
+        seconds = max(self.seconds, 1e-9)
+        return (f'assembled {self.files} files ({self.skipped} up to date) with {self.instructions} instructions in {self.seconds:.2f} s: '
+                f'{self.files / seconds:.1f} files/sec, {self.instructions / seconds:.0f} instructions/sec')
+
+
+def find_sources(patterns: list[str]) -> list[Path]:
+    """
+    the .asm files named by a list of paths: files, directories (every .asm file directly in them) and glob patterns
+    (`**` matches any number of directories). Each file is listed once, in the order they're named
+    """
+    paths: dict[Path, None] = {}
+    for pattern in patterns:
+        if is_glob(pattern):
+            matches = sorted(Path(match) for match in glob.glob(pattern, recursive=True))
+        elif Path(pattern).is_dir():
+            matches = sorted(Path(pattern).glob('*.asm'))
+        else:
+            matches = [Path(pattern)]
+        matches = [path for path in matches if path.suffix == '.asm']
+        if not matches:
+            raise FileNotFoundError(f'No .asm files found at {pattern}')
+        paths.update(dict.fromkeys(matches))
+    return list(paths)
+
+
+def is_glob(pattern: str) -> bool:
+    """whether a path argument is a glob pattern. Paths that exist are always taken literally, even with `*`, `?` or `[` in them"""
+    return not Path(pattern).exists() and any(char in pattern for char in '*?[')
+
+
+# options each output in a directory was last assembled with by a batch, by output file name. Each entry also
+# records the output's size and mtime, so an output written since (e.g. by assembling the file on its own) isn't trusted
+BUILD_MANIFEST = '.hackbuild.json'
+
+
+def read_build_manifest(directory: Path) -> dict[str, dict]:
+    manifest_path = directory / BUILD_MANIFEST
+    return json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+
+
+def up_to_date(path: Path, binary: bool = False, optimize: bool = False, manifest: dict[str, dict] | None = None) -> bool:
+    """
+    whether the output of a .asm file exists, is no older than it and was assembled with the same options (as recorded
+    in the build manifest next to it), so assembling it again would give the same file
+    """
+    out_path = output_path(path, binary)
+    if not out_path.exists():
+        return False
+    if manifest is None:
+        manifest = read_build_manifest(out_path.parent)
+    stat = out_path.stat()
+    return stat.st_mtime >= path.stat().st_mtime and manifest.get(out_path.name) == {'optimize': optimize, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def record_builds(paths: list[Path], binary: bool = False, optimize: bool = False):
+    """record the options the outputs of .asm files were just assembled with in the build manifests next to them"""
+    by_directory: dict[Path, list[Path]] = {}
+    for path in paths:
+        by_directory.setdefault(path.parent, []).append(output_path(path, binary))
+    for directory, out_paths in by_directory.items():
+        manifest = read_build_manifest(directory)
+        for out_path in out_paths:
+            stat = out_path.stat()
+            manifest[out_path.name] = {'optimize': optimize, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        (directory / BUILD_MANIFEST).write_text(json.dumps(manifest, indent=4, sort_keys=True))
+
+
+def assemble_batch(paths: list[Path], binary: bool = False, stream: bool = False, jobs: int = 1, force: bool = False, optimize: bool = False) -> BatchStats:
+    """
+    assembles many .asm files into their .hack (or if binary, .hrom) files, skipping those whose output is up to date
+    (including having been optimized or not as asked) unless force. Files don't share any state, so with jobs > 1
+    they're spread over worker processes, which also saves starting an interpreter per file
+    """
+    start = perf_counter()
+    manifests = {directory: read_build_manifest(directory) for directory in {path.parent for path in paths}}
+    todo = paths if force else [path for path in paths if not up_to_date(path, binary, optimize, manifests[path.parent])]
+
+    if jobs == 1:
+        counts = [assemble_file(path, binary, stream, optimize) for path in todo]
+    else:
+        # generated test programs are often small, so hand them to the workers a few at a time
+        chunksize = max(1, len(todo) // (jobs * 4))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            counts = list(executor.map(assemble_file, todo, repeat(binary), repeat(stream), repeat(optimize), chunksize=chunksize))
+    record_builds(todo, binary, optimize)
+
+    return BatchStats(len(todo), len(paths) - len(todo), sum(counts), perf_counter() - start)
+
+
+def verify_file(path: Path, until: str, max_cycles: int = 100_000_000) -> list[str]:
+    """verify_optimized for a .asm file"""
+    with open(path, 'r') as f:
+        return verify_optimized(remove_all_whitespace(f.read().splitlines()), until, max_cycles=max_cycles)
+
+
+def verify_batch(paths: list[Path], until: str, max_cycles: int = 100_000_000, jobs: int = 1) -> dict[Path, list[str]]:
+    """the differences verify_file finds in each of many .asm files, on `jobs` worker processes"""
+    if jobs == 1:
+        results = [verify_file(path, until, max_cycles) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(verify_file, paths, repeat(until), repeat(max_cycles)))
+    return dict(zip(paths, results))
+
+
+
+
 if __name__ == '__main__':
-    import sys
-    assert len(sys.argv) == 2, 'Usage: python HackAssembler.py <input file>'
-    assemble(sys.argv[1])
\ No newline at end of file
+    parser = ArgumentParser()
+    parser.add_argument('paths', nargs='+', help='Path to the .asm file. Several files, directories of .asm files or glob patterns assemble them all as a batch')
+    parser.add_argument('--stream', action='store_true', help='Assemble in a single pass as the file is read, keeping only the machine code in memory')
+    parser.add_argument('--binary', action='store_true', help='Write the packed binary .hrom format instead of the text .hack format')
+    parser.add_argument('--stats', action='store_true', help='Print the instruction cache hit rates and the encoding throughput')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='Number of worker processes used to assemble a batch')
+    parser.add_argument('--force', action='store_true', help='Assemble every file of a batch, even those whose output is newer than the source and was built with the same options')
+    parser.add_argument('--optimize', action='store_true', help='Run the peephole optimizer over the code before encoding it, and report the words it saved')
+    parser.add_argument('--verify', action='store_true', help='Instead of assembling, check on the emulator that optimizing each program doesn\'t change what it does')
+    parser.add_argument('--until', default='Sys.halt', help='Label where verification runs stop')
+    parser.add_argument('--max-cycles', type=int, default=100_000_000, help='Cycle limit for verification runs')
+    args = parser.parse_args()
+
+    if args.stats and args.jobs != 1:
+        parser.error('--stats only counts the instructions encoded by this process, so it can\'t be combined with --jobs')
+    if args.stream and (args.optimize or args.verify):
+        parser.error('--stream can\'t be combined with --optimize or --verify, which need the whole program in memory')
+
+    if args.verify:
+        try:
+            paths = find_sources(args.paths)
+        except FileNotFoundError as e:
+            parser.error(str(e))
+        results = verify_batch(paths, args.until, args.max_cycles, args.jobs)
+        for path, differences in results.items():
+            print(f'[{"Failure" if differences else "Success"}] {path}')
+            for difference in differences[:10]:
+                print(f'    {difference}')
+            if len(differences) > 10:
+                print(f'    ... and {len(differences) - 10} more differences')
+        sys.exit(1 if any(results.values()) else 0)
+
+    if len(args.paths) == 1 and Path(args.paths[0]).suffix == '.asm' and not is_glob(args.paths[0]):
+        if args.stream:
+            assemble_stream(args.paths[0], args.binary)
+        else:
+            assemble(args.paths[0], args.binary, args.optimize)
+    else:
+        try:
+            paths = find_sources(args.paths)
+        except FileNotFoundError as e:
+            parser.error(str(e))
+        print(assemble_batch(paths, args.binary, args.stream, args.jobs, args.force, args.optimize).report())
+
+    if args.stats:
+        print(encoder_stats.report())
\ No newline at end of file
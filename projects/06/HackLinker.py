@@ -0,0 +1,274 @@
+from argparse import ArgumentParser
+from array import array
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable, Sequence
+import struct
+import sys
+
+from HackAssembler import (remove_all_whitespace, predefined_symbols, first_variable_address,
+                           a_instruction_words, c_instruction_words, encode_a_miss, encode_c_miss)
+from HackRom import word_line, word_lines
+
+
+@dataclass
+class ObjectFile:
+    """
+    relocatable machine code of one translation unit (e.g. one vm file), assembled as if the unit started at address 0.
+    Every label is kept in the symbol table so other units can refer to it. Words that hold an address within the unit
+    are listed in `relocations`, and words that refer to a symbol the unit doesn't define (a label of another unit, or
+    a variable) in `references`. Both kinds of word are left as 0 in `code` until the objects are linked
+    """
+    code: array = field(default_factory=lambda: array('H'))          # one 16 bit word per instruction
+    symbols: dict[str, int] = field(default_factory=dict)            # label -> address within the unit
+    relocations: list[tuple[int, int]] = field(default_factory=list)  # (word, address within the unit it refers to)
+    references: list[tuple[int, str]] = field(default_factory=list)   # (word, symbol name), in order of the words
+    tag: str = ''  # free text set by whatever produced the object (e.g. the settings it was built with), ignored by the linker
+
+
+def assemble_object(lines: Iterable[str], tag: str = '') -> ObjectFile:
+    """assemble raw lines of assembly code into a relocatable object"""
+    emitter = Emitter(tag)
+    emitter.emit(remove_all_whitespace(lines))
+    return emitter.finish()
+
+
+class Emitter:
+    """
+    builds an object from chunks of asm lines as they're generated (e.g. the code of one vm command at a time), encoding
+    each instruction straight into its machine word. The lines must be in the form the vm translator generates them:
+    one instruction or label per line without whitespace, besides whole comment lines and blank lines, which are skipped.
+    A-instructions with symbols are left as fixups until finish(), since a label may be defined after it's used.
+    Chunks passed as tuples (the translator's shared templates) are only encoded the first time they're seen
+    """
+
+    def __init__(self, tag: str = ''):
+        self.obj = ObjectFile(tag=tag)
+        self.fixups: list[tuple[int, str]] = []  # (word, symbol) of every symbolic A-instruction, in order
+        self.chunks: dict[tuple[str, ...], tuple[array, list[tuple[int, str]], list[tuple[int, str]]]] = {}
+
+    def emit(self, lines: Sequence[str]):
+        """append the instructions of the lines, and define their labels at the addresses they end up at"""
+        if type(lines) is tuple:
+            chunk = self.chunks.get(lines)
+            if chunk is None:
+                chunk = self.chunks[lines] = encode_chunk(lines)
+        else:
+            chunk = encode_chunk(lines)
+
+        words, labels, fixups = chunk
+        code = self.obj.code
+        base = len(code)
+        code.extend(words)
+        for offset, name in labels:
+            self.obj.symbols[name] = base + offset
+        for offset, name in fixups:
+            self.fixups.append((base + offset, name))
+
+    def finish(self) -> ObjectFile:
+        """the object of everything emitted: symbols defined in it become relocations, the others references"""
+        symbols = self.obj.symbols
+        for word, name in self.fixups:
+            if name in symbols:
+                self.obj.relocations.append((word, symbols[name]))
+            else:
+                self.obj.references.append((word, name))
+        self.fixups = []
+        return self.obj
+
+
+def encode_chunk(lines: Iterable[str]) -> tuple[array, list[tuple[int, str]], list[tuple[int, str]]]:
+    """
+    the machine words of the instructions in the lines, along with the labels they define and their symbolic
+    A-instructions (both by offset into the words). Symbolic A-instructions are encoded as 0
+    """
+    words = array('H')
+    labels = []
+    fixups = []
+    for line in lines:
+        if not line or line.startswith('//'):
+            continue
+        if line[0] == '(':
+            labels.append((len(words), line[1:-1]))
+            continue
+
+        if line[0] != '@':
+            word = c_instruction_words.get(line)
+            words.append(encode_c_miss(line) if word is None else word)
+            continue
+
+        word = a_instruction_words.get(line)
+        if word is None:
+            if not line[1:].isdigit():
+                fixups.append((len(words), line[1:]))
+                words.append(0)
+                continue
+            word = encode_a_miss(line)
+        words.append(word)
+
+    return words, labels, fixups
+
+
+def link(objects: list[ObjectFile]) -> list[str]:
+    """
+    place the objects one after the other (in order) and resolve every address, giving the lines of the .hack program.
+    Symbols defined by none of the objects are variables, allocated in the order they're first used. This is the same
+    order a single pass over the whole program would give, so linking produces exactly what assembling all units together does
+    """
+
+    # global symbol table: the labels of every object, moved to where the object is placed
+    symbols = {**predefined_symbols}
+    bases = []
+    base = 0
+    for obj in objects:
+        bases.append(base)
+        for name, address in obj.symbols.items():
+            if name in symbols:
+                raise ValueError(f'Symbol {name} is defined more than once')
+            symbols[name] = base + address
+        base += len(obj.code)
+
+    # resolve the addresses of every object. A-instructions may hold addresses that don't fit in 15 bits
+    # (programs too large for the ROM), so those words are written as wider lines instead of being truncated
+    variable = first_variable_address
+    lines = []
+    cached_line = word_lines.get
+    for obj, base in zip(objects, bases):
+        unit = [cached_line(word) or word_line(word) for word in obj.code]
+        for word, address in obj.relocations:
+            unit[word] = f'0{base + address:015b}'
+        for word, name in obj.references:
+            if name not in symbols:
+                symbols[name] = variable
+                variable += 1
+            unit[word] = f'0{symbols[name]:015b}'
+        lines.extend(unit)
+
+    return lines
+
+
+
+################## object file format ##################
+# all integers are little endian
+#   magic b'HOBJ', format version (u16)
+#   tag: length (u32) + utf-8 text
+#   code: word count (u32) + words (u16 each)
+#   symbols: count (u32) + addresses (u32 each) + names
+#   relocations: count (u32) + (word, address) pairs (u32 each)
+#   references: count (u32) + words (u32 each) + names
+# where names are a length (u32) + utf-8 text of the names separated by newlines
+
+MAGIC = b'HOBJ'
+VERSION = 1
+
+
+def write_object(path: Path, obj: ObjectFile):
+    """write an object to a .hobj file"""
+    path.write_bytes(object_bytes(obj))
+
+
+def read_object(path: Path) -> ObjectFile:
+    """read an object from a .hobj file"""
+    return parse_object(path.read_bytes())
+
+
+def object_bytes(obj: ObjectFile) -> bytes:
+    """the object in the .hobj binary format"""
+    parts = [MAGIC, struct.pack('<H', VERSION), pack_text(obj.tag)]
+    parts.append(pack_words('H', obj.code))
+    parts.append(pack_words('I', obj.symbols.values()))
+    parts.append(pack_text('\n'.join(obj.symbols)))
+    parts.append(pack_words('I', [value for relocation in obj.relocations for value in relocation]))
+    parts.append(pack_words('I', [word for word, _ in obj.references]))
+    parts.append(pack_text('\n'.join(name for _, name in obj.references)))
+    return b''.join(parts)
+
+
+def parse_object(data: bytes) -> ObjectFile:
+    """parse an object from the .hobj binary format"""
+    if data[:4] != MAGIC:
+        raise ValueError('Not a Hack object file')
+    version, = struct.unpack_from('<H', data, 4)
+    if version != VERSION:
+        raise ValueError(f'Unsupported Hack object file version {version}')
+
+    try:
+        offset = 6
+        tag, offset = unpack_text(data, offset)
+        code, offset = unpack_words('H', data, offset)
+        addresses, offset = unpack_words('I', data, offset)
+        names, offset = unpack_names(data, offset)
+        relocations, offset = unpack_words('I', data, offset)
+        words, offset = unpack_words('I', data, offset)
+        references, offset = unpack_names(data, offset)
+    except struct.error:
+        raise ValueError('Truncated Hack object file') from None
+
+    return ObjectFile(
+        code=code,
+        symbols=dict(zip(names, addresses)),
+        relocations=list(zip(relocations[::2], relocations[1::2])),
+        references=list(zip(words, references)),
+        tag=tag,
+    )
+
+
+def pack_words(typecode: str, values: Iterable[int]) -> bytes:
+    words = array(typecode, values)
+    if sys.byteorder == 'big':
+        words.byteswap()
+    return struct.pack('<I', len(words)) + words.tobytes()
+
+def unpack_words(typecode: str, data: bytes, offset: int) -> tuple[array, int]:
+    count, = struct.unpack_from('<I', data, offset)
+    offset += 4
+    words = array(typecode)
+    words.frombytes(data[offset:offset + count * words.itemsize])
+    if len(words) != count:
+        raise struct.error('not enough data')
+    if sys.byteorder == 'big':
+        words.byteswap()
+    return words, offset + count * words.itemsize
+
+def pack_text(text: str) -> bytes:
+    encoded = text.encode()
+    return struct.pack('<I', len(encoded)) + encoded
+
+def unpack_text(data: bytes, offset: int) -> tuple[str, int]:
+    length, = struct.unpack_from('<I', data, offset)
+    offset += 4
+    return data[offset:offset + length].decode(), offset + length
+
+def unpack_names(data: bytes, offset: int) -> tuple[list[str], int]:
+    text, offset = unpack_text(data, offset)
+    return (text.split('\n') if text else []), offset
+
+
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Assemble .asm files into relocatable .hobj objects, and/or link objects into a .hack program')
+    parser.add_argument('inputs', type=Path, nargs='+', help='.asm files (assembled first) and/or .hobj files, in the order they are placed in the program')
+    parser.add_argument('-o', '--output', type=Path, help='Path of the linked .hack program')
+    parser.add_argument('-c', '--compile-only', action='store_true', help='Only assemble each .asm file into a .hobj next to it, without linking')
+    args = parser.parse_args()
+
+    if not args.compile_only and args.output is None:
+        parser.error('an output path (-o) is needed to link')
+
+    objects = []
+    for path in args.inputs:
+        if path.suffix == '.asm':
+            obj = assemble_object(path.read_text().splitlines())
+            if args.compile_only:
+                write_object(path.with_suffix('.hobj'), obj)
+                print(f'wrote to {path.with_suffix(".hobj")}')
+        elif path.suffix == '.hobj':
+            obj = read_object(path)
+        else:
+            parser.error(f'Invalid input file: {path}')
+        objects.append(obj)
+
+    if not args.compile_only:
+        args.output.write_text('\n'.join(link(objects)))
+        print(f'wrote to {args.output}')
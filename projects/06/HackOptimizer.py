@@ -0,0 +1,218 @@
+from typing import Iterable
+
+
+# rules of the optimizer, in the order they're reported
+rules = ['redundant A load', 'dead A load', 'dead D write', 'dead M write', 'jump to next']
+
+# what a block knows A holds: the value an A-instruction loaded, or the word at such an address
+LOAD, POINTER = range(2)
+
+
+def optimize(lines: list[str], symbols: dict[str, int], savings: dict[str, int] | None = None) -> list[str]:
+    """
+    peephole optimize assembly code (without whitespace or comments). Jumps to the very next instruction are removed,
+    then each basic block (split at labels and after jumps) is cleaned up on its own: A-instructions loading what A
+    already holds or that are overwritten before A is used, and D and M writes overwritten within the block before
+    they're read. Every register and word of memory is assumed to be used after a block, so its effects stay the same.
+    `symbols` is the program's symbol table, used to tell which A-instructions load the same address; labels are
+    compared by name, as removing code moves them. The words saved by each rule are added to `savings`
+    """
+    if savings is None:
+        savings = {}
+    labels = {line[1:-1] for line in lines if line[0] == '('}
+    values = {name: value for name, value in symbols.items() if name not in labels}
+
+    out = []
+    block = []
+    for line in remove_jumps_to_next(lines, savings):
+        if line[0] == '(':
+            out.extend(optimize_block(block, values, savings))
+            out.append(line)
+            block = []
+            continue
+        block.append(line)
+        if ';' in line:
+            out.extend(optimize_block(block, values, savings))
+            block = []
+    out.extend(optimize_block(block, values, savings))
+    return out
+
+
+def optimize_block(block: list[str], values: dict[str, int], savings: dict[str, int]) -> list[str]:
+    """apply the block rules until nothing changes, as removing one instruction can make another redundant"""
+    while True:
+        optimized = remove_dead_writes(remove_redundant_loads(block, values, savings), values, savings)
+        if optimized == block:
+            return block
+        block = optimized
+
+
+def remove_jumps_to_next(lines: Iterable[str], savings: dict[str, int]) -> list[str]:
+    """
+    `@L / comp;jump / (L)`  ->  `dest=comp` if it has a dest, or nothing. Control reaches L either way.
+    The label is only reached with A holding its address, so this is only done when the next instruction loads A
+    anyway, and `@L` is kept if the computation itself uses A
+    """
+    lines = list(lines)
+    out = []
+    for i, line in enumerate(lines):
+        if ';' not in line or not out or out[-1][0] != '@':
+            out.append(line)
+            continue
+
+        # the labels right after the jump, and the instruction after them
+        following = set()
+        next_index = i + 1
+        while next_index < len(lines) and lines[next_index][0] == '(':
+            following.add(lines[next_index][1:-1])
+            next_index += 1
+        if out[-1][1:] not in following or next_index == len(lines) or lines[next_index][0] != '@':
+            out.append(line)
+            continue
+
+        dest, comp, _ = split_c_instruction(line)
+        saved = 1
+        if 'A' not in comp and 'M' not in comp and 'M' not in dest:
+            out.pop()
+            saved += 1
+        if dest:
+            out.append(f'{dest}={comp}')
+            saved -= 1
+        savings['jump to next'] = savings.get('jump to next', 0) + saved
+    return out
+
+
+def remove_redundant_loads(block: list[str], values: dict[str, int], savings: dict[str, int]) -> list[str]:
+    """
+    A-instructions that load the value A already holds, `@X / A=M` when A already holds the word at X
+    (e.g. after `@SP / AM=M-1`), and A-instructions whose value is replaced before anything uses it
+    """
+    out = []
+    a = None  # (LOAD, value) or (POINTER, value), or None if unknown
+    skip = False
+    for i, line in enumerate(block):
+        if skip:
+            skip = False
+            continue
+        following = block[i + 1] if i + 1 < len(block) else None
+
+        if line[0] == '@':
+            value = load_value(line, values)
+            if a == (LOAD, value):
+                savings['redundant A load'] = savings.get('redundant A load', 0) + 1
+            elif following == 'A=M' and a == (POINTER, value):
+                savings['redundant A load'] = savings.get('redundant A load', 0) + 2
+                skip = True
+            elif following is not None and overwrites_a(following):
+                savings['dead A load'] = savings.get('dead A load', 0) + 1
+            else:
+                out.append(line)
+                a = LOAD, value
+            continue
+
+        out.append(line)
+        dest, comp, _ = split_c_instruction(line)
+        if 'A' in dest:
+            # A gets the word at X if it's loaded from there, or if the same value is also written there
+            a = (POINTER, a[1]) if a is not None and a[0] == LOAD and ('M' in dest or comp == 'M') else None
+        elif 'M' in dest and a is not None and a[0] == POINTER:
+            # the write may be to the very word A was loaded from
+            a = None
+    return out
+
+
+def remove_dead_writes(block: list[str], values: dict[str, int], savings: dict[str, int]) -> list[str]:
+    """
+    D writes and M writes (to an address known from an A-instruction) that are written again further down the block
+    before they're read. The rest of the instruction is kept if it has other destinations
+    """
+    # the address M refers to at each instruction, if A was loaded by an A-instruction within the block
+    addresses = []
+    a = None
+    for line in block:
+        addresses.append(a)
+        if line[0] == '@':
+            a = load_value(line, values)
+        elif 'A' in split_c_instruction(line)[0]:
+            a = None
+
+    # walk backwards, knowing what's read or written after each instruction
+    out = []
+    d_live = True
+    overwritten = set()  # addresses written further down before being read
+    for line, address in zip(reversed(block), reversed(addresses)):
+        if line[0] == '@':
+            out.append(line)
+            continue
+
+        dest, comp, jump = split_c_instruction(line)
+        kept = dest
+        if 'D' in dest and not d_live:
+            kept, rule = kept.replace('D', ''), 'dead D write'
+        if 'M' in dest and address is not None and address in overwritten:
+            kept, rule = kept.replace('M', ''), 'dead M write'
+
+        # an instruction reads its operands before it writes
+        if 'D' in kept:
+            d_live = False
+        if 'D' in comp:
+            d_live = True
+        if 'M' in kept and address is not None:
+            overwritten.add(address)
+        if 'M' in comp:
+            overwritten = {value for value in overwritten if not may_alias(value, address)} if address is not None else set()
+
+        if dest and not kept and not jump:
+            savings[rule] = savings.get(rule, 0) + 1
+        elif kept != dest:
+            out.append(join_c_instruction(kept, comp, jump))
+        else:
+            out.append(line)
+
+    out.reverse()
+    return out
+
+
+def overwrites_a(line: str) -> bool:
+    """whether an instruction replaces A without using its old value (as an operand, a memory address or a jump target)"""
+    if line[0] == '@':
+        return True
+    dest, comp, jump = split_c_instruction(line)
+    return 'A' in dest and 'M' not in dest and 'A' not in comp and 'M' not in comp and not jump
+
+
+def load_value(line: str, values: dict[str, int]) -> int | str:
+    """the value an A-instruction loads: a number (also for variables and predefined symbols), or a label's name"""
+    name = line[1:]
+    return int(name) if name.isdigit() else values.get(name, name)
+
+
+def may_alias(x: int | str, y: int | str) -> bool:
+    """whether two loaded values may be the same address. Labels are only known to equal themselves"""
+    return x == y or not (isinstance(x, int) and isinstance(y, int))
+
+
+# (dest, comp, jump) of every C-instruction split so far, with null dest and jump as ''
+split_instructions: dict[str, tuple[str, str, str]] = {}
+
+def split_c_instruction(line: str) -> tuple[str, str, str]:
+    parts = split_instructions.get(line)
+    if parts is None:
+        dest, _, rest = line.rpartition('=')
+        comp, _, jump = rest.partition(';')
+        parts = split_instructions[line] = ('' if dest == 'null' else dest, comp, '' if jump == 'null' else jump)
+    return parts
+
+def join_c_instruction(dest: str, comp: str, jump: str) -> str:
+    return (f'{dest}=' if dest else '') + comp + (f';{jump}' if jump else '')
+
+
+def report(savings: dict[str, int], words: int) -> str:
+    """table of the words saved by each rule, for a program of `words` words before optimizing"""
+    lines = [f"{'rule':<18} {'words saved':>12}"]
+    for rule in rules:
+        lines.append(f'{rule:<18} {savings.get(rule, 0):>12}')
+    saved = sum(savings.values())
+    lines.append(f"{'total':<18} {saved:>12}")
+    lines.append(f'ROM words {words} -> {words - saved} ({-100 * saved / max(words, 1):+.1f}%)')
+    return '\n'.join(lines)
@@ -0,0 +1,179 @@
+from argparse import ArgumentParser
+from array import array
+from pathlib import Path
+from typing import Iterable, Sequence, TextIO
+import mmap
+import struct
+import sys
+import zlib
+
+
+################## packed binary ROM format ##################
+# a .hrom file holds the machine code as 2 bytes per word instead of a 17 byte text line. All integers are little endian
+#   header: magic b'HROM', format version (u16), flags (u16, reserved as 0), word count (u32), wide count (u32),
+#           CRC-32 of everything after the header (u32)
+#   words: one u16 per instruction
+#   wide A-instructions: (address, value) pairs (u32 each), for A-instructions loading values that don't fit in 15 bits
+#           (see HackEmulator). Their word is 0
+# the header is 20 bytes, so the words start at an even offset and can be used in place
+
+MAGIC = b'HROM'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIII')
+ROM_SUFFIX = '.hrom'
+
+
+def write_rom(path: Path, code: Iterable[int], wide: dict[int, int] = {}):
+    """write machine words (and any wide A-instructions, by address) to a .hrom file"""
+    words = array('H', code)
+    pairs = array('I', [value for address in sorted(wide) for value in (address, wide[address])])
+    if sys.byteorder == 'big':
+        words.byteswap()
+        pairs.byteswap()
+    body = words.tobytes() + pairs.tobytes()
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(words), len(wide), zlib.crc32(body)))
+        f.write(body)
+
+
+class MappedRom:
+    """
+    the machine words and wide A-instructions (by address) of a memory mapped .hrom file. The words are a view straight
+    into the mapping (on little endian machines; big endian ones get a byteswapped copy), so they can only be used until
+    the mapping is closed, with close() or by using the ROM as a context manager
+    """
+
+    def __init__(self, data: mmap.mmap, view: memoryview, words: memoryview | array, wide: dict[int, int]):
+        self.data = data
+        self.view = view
+        self.words = words
+        self.wide = wide
+
+    def close(self):
+        # views into the mapping have to be released before the mapping itself can be closed
+        if isinstance(self.words, memoryview):
+            self.words.release()
+        self.view.release()
+        self.data.close()
+
+    def __enter__(self) -> 'MappedRom':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def map_rom(path: Path, verify: bool = True) -> MappedRom:
+    """
+    the machine words of a .hrom file, memory mapped rather than read, so loading the same ROM again costs next to nothing.
+    If verify, the checksum is checked first. The caller closes the returned ROM when done with its words
+    """
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) < HEADER.size:
+            raise ValueError(f'Not a Hack ROM file: {path}')
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(data)
+    try:
+        magic, version, _, count, wide_count, checksum = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f'Not a Hack ROM file: {path}')
+        if version != VERSION:
+            raise ValueError(f'Unsupported Hack ROM version {version}: {path}')
+        end = HEADER.size + 2 * count
+        if len(view) != end + 8 * wide_count:
+            raise ValueError(f'Truncated Hack ROM file: {path}')
+        if verify and zlib.crc32(view[HEADER.size:]) != checksum:
+            raise ValueError(f'Hack ROM checksum mismatch: {path}')
+    except ValueError:
+        view.release()
+        data.close()
+        raise
+
+    words = view[HEADER.size:end].cast('H')
+    pairs = array('I')
+    pairs.frombytes(view[end:])
+    if sys.byteorder == 'big':
+        swapped = array('H', words)
+        swapped.byteswap()
+        words.release()
+        words = swapped
+        pairs.byteswap()
+
+    return MappedRom(data, view, words, dict(zip(pairs[::2], pairs[1::2])))
+
+
+def parse_hack(lines: Iterable[str]) -> tuple[array, dict[int, int]]:
+    """the machine words of the lines of a .hack file, along with any wide A-instructions (lines longer than 16 bits) by address"""
+    code = array('H')
+    wide = {}
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if len(line) > 16:
+            wide[len(code)] = int(line[1:], 2)
+            code.append(0)
+        else:
+            code.append(int(line, 2))
+    return code, wide
+
+
+def hack_lines(code: Sequence[int], wide: dict[int, int] = {}, start: int = 0, end: int | None = None) -> list[str]:
+    """the .hack lines of the machine words from start to end (values in `wide` as wider A-instructions)"""
+    cached_line = word_lines.get
+    lines = [cached_line(word) or word_line(word) for word in code[start:end]]
+    for address, value in wide.items():
+        if start <= address < start + len(lines):
+            lines[address - start] = f'0{value:015b}'
+    return lines
+
+
+def write_hack(f: TextIO, code: Sequence[int], wide: dict[int, int] = {}, block: int = 1 << 16):
+    """write machine words to a .hack file, one line each (values in `wide` as wider A-instructions), a block of lines at a time"""
+    blocks = [(start, {}) for start in range(0, len(code), block)]
+    for address, value in wide.items():
+        blocks[address // block][1][address] = value
+    for start, block_wide in blocks:
+        if start:
+            f.write('\n')
+        f.write('\n'.join(hack_lines(code, block_wide, start, start + block)))
+
+
+# .hack line of every machine word formatted so far. Programs only use a few thousand distinct words (most of them
+# C-instructions), so nearly every line comes from here instead of being formatted again
+word_lines: dict[int, str] = {}
+
+def word_line(word: int) -> str:
+    line = word_lines[word] = f'{word:016b}'
+    return line
+
+
+def hack_to_rom(hack_path: Path, rom_path: Path):
+    """convert a text .hack file to the packed format"""
+    with open(hack_path, 'r') as f:
+        write_rom(rom_path, *parse_hack(f))
+
+
+def rom_to_hack(rom_path: Path, hack_path: Path):
+    """convert a packed .hrom file to the text format"""
+    with map_rom(rom_path) as rom, open(hack_path, 'w', buffering=1 << 20) as f:
+        write_hack(f, rom.words, rom.wide)
+
+
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Convert Hack machine code between the text .hack format and the packed .hrom format')
+    parser.add_argument('path', type=Path, help='Path to a .hack file (converted to .hrom) or a .hrom file (converted to .hack)')
+    args = parser.parse_args()
+
+    if args.path.suffix == '.hack':
+        out_path = args.path.with_suffix(ROM_SUFFIX)
+        hack_to_rom(args.path, out_path)
+    elif args.path.suffix == ROM_SUFFIX:
+        out_path = args.path.with_suffix('.hack')
+        rom_to_hack(args.path, out_path)
+    else:
+        parser.error(f'Invalid file: {args.path}')
+    print(f'wrote to {out_path}')
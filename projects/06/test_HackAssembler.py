@@ -0,0 +1,79 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import sys
+import unittest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from HackAssembler import assemble_batch, assemble_file
+
+
+# the optimizer removes the second `@5`, so the optimized build is one word shorter
+PROGRAM = '''
+    @5
+    D=M
+    @5
+    M=D+1
+(END)
+    @END
+    0;JMP
+'''
+
+
+class AssembleBatchTest(unittest.TestCase):
+    """which files a batch skips as up to date, and that their outputs are the ones asked for"""
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.source = Path(self.tmp.name) / 'Prog.asm'
+        self.source.write_text(PROGRAM)
+        self.output = self.source.with_suffix('.hack')
+
+    def batch(self, optimize: bool = False, binary: bool = False) -> tuple[int, int]:
+        """(files assembled, files skipped) by a batch run over the directory"""
+        stats = assemble_batch([self.source], binary=binary, optimize=optimize)
+        return stats.files, stats.skipped
+
+    def words(self) -> int:
+        return len(self.output.read_text().split())
+
+    def test_skips_up_to_date(self):
+        self.assertEqual(self.batch(), (1, 0))
+        self.assertEqual(self.batch(), (0, 1))
+
+    def test_optimize_rebuilds(self):
+        self.batch()
+        self.assertEqual(self.words(), 6)
+        self.assertEqual(self.batch(optimize=True), (1, 0))
+        self.assertEqual(self.words(), 5)
+        self.assertEqual(self.batch(optimize=True), (0, 1))
+
+    def test_unoptimized_rebuilds(self):
+        self.batch(optimize=True)
+        self.assertEqual(self.batch(), (1, 0))
+        self.assertEqual(self.words(), 6)
+
+    def test_binary_tracked_separately(self):
+        self.batch(optimize=True, binary=True)
+        self.assertEqual(self.batch(), (1, 0))
+        self.assertEqual(self.batch(optimize=True, binary=True), (0, 1))
+
+    def test_output_written_outside_batch(self):
+        # the manifest says unoptimized, but the output has since been replaced by an optimized build
+        self.batch()
+        assemble_file(self.source, optimize=True)
+        self.assertEqual(self.batch(), (1, 0))
+        self.assertEqual(self.words(), 6)
+
+    def test_output_without_manifest(self):
+        assemble_file(self.source)
+        self.assertEqual(self.batch(), (1, 0))
+        self.assertEqual(self.batch(), (0, 1))
+
+    def test_jobs(self):
+        self.assertEqual(assemble_batch([self.source], jobs=2, optimize=True).files, 1)
+        self.assertEqual(self.batch(optimize=True), (0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+from pathlib import Path
+import sys
+import unittest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import HackOptimizer
+from HackAssembler import generate_symbol_table, verify_optimized
+
+
+def optimize(asm: str) -> tuple[list[str], dict[str, int]]:
+    """the optimized lines of a program (one instruction or label per whitespace separated word), and the words saved by each rule"""
+    lines = asm.split()
+    savings = {}
+    return HackOptimizer.optimize(lines, generate_symbol_table(lines), savings), savings
+
+
+class HackOptimizerTest(unittest.TestCase):
+    """
+    one case per rule (and for the cases where a rule must not apply). Each gives the code to optimize, the expected
+    result and the words saved, and runs both builds on the emulator: `setup` initializes RAM in a block of its own,
+    then the code runs up to END, with D stored to R15 at the end so it's compared along with the rest of RAM
+    """
+
+    def check(self, asm: str, expected: str, savings: dict[str, int], setup: str = ''):
+        program = f'{setup} (CASE) {asm} (CHECK) @R15 M=D (END) @END 0;JMP'.split()
+        self.assertEqual(verify_optimized(program, 'END'), [])
+
+        optimized, saved = optimize(asm)
+        self.assertEqual(optimized, expected.split())
+        self.assertEqual(saved, savings)
+
+    ################## redundant A load ##################
+
+    def test_redundant_load(self):
+        self.check('@5 D=M @5 M=D+1',
+                   '@5 D=M M=D+1',
+                   {'redundant A load': 1})
+
+    def test_redundant_pointer_load(self):
+        # after `@SP / AM=M-1`, A already holds the word at SP
+        self.check('@SP AM=M-1 D=M @SP A=M M=D+1',
+                   '@SP AM=M-1 D=M M=D+1',
+                   {'redundant A load': 2},
+                   setup='@258 D=A @SP M=D @256 M=1 @257 M=1')
+
+    def test_pointer_load_after_write(self):
+        # `M=D` writes to the word at A, which is RAM[SP] itself when SP becomes 0, so SP has to be read again
+        self.check('@SP AM=M-1 M=D @SP A=M M=1',
+                   '@SP AM=M-1 M=D @SP A=M M=1',
+                   {},
+                   setup='@7 D=A @SP M=1')
+
+    ################## dead A load ##################
+
+    def test_dead_load(self):
+        self.check('@5 @6 M=1',
+                   '@6 M=1',
+                   {'dead A load': 1})
+
+    def test_load_replaced_by_c_instruction(self):
+        self.check('@5 A=1 M=1',
+                   'A=1 M=1',
+                   {'dead A load': 1})
+
+    def test_load_used_by_c_instruction(self):
+        self.check('@5 A=A+1 M=1',
+                   '@5 A=A+1 M=1',
+                   {})
+
+    ################## dead D write ##################
+
+    def test_dead_d_write(self):
+        self.check('@5 D=M D=1 @6 M=D',
+                   '@5 D=1 @6 M=D',
+                   {'dead D write': 1},
+                   setup='@9 D=A @5 M=D')
+
+    def test_dead_d_write_other_destinations(self):
+        self.check('@5 MD=1 D=0 @6 M=D',
+                   '@5 M=1 D=0 @6 M=D',
+                   {})  # the instruction stays, so no words are saved
+
+    def test_d_write_read_first(self):
+        self.check('@5 D=M D=D+1 @6 M=D',
+                   '@5 D=M D=D+1 @6 M=D',
+                   {},
+                   setup='@9 D=A @5 M=D')
+
+    ################## dead M write ##################
+
+    def test_dead_m_write(self):
+        self.check('@5 M=1 D=1 M=0',
+                   '@5 D=1 M=0',
+                   {'dead M write': 1})
+
+    def test_m_write_read_first(self):
+        self.check('@5 M=1 D=M M=0',
+                   '@5 M=1 D=M M=0',
+                   {})
+
+    def test_m_write_read_through_pointer(self):
+        # `D=M` reads the word at the popped address, which is RAM[SP] itself when SP becomes 0
+        self.check('@SP AM=M-1 D=M @SP M=D',
+                   '@SP AM=M-1 D=M @SP M=D',
+                   {},
+                   setup='@SP M=1')
+
+    def test_m_write_past_pointer_write(self):
+        # writing through the popped address doesn't read RAM[SP], so its write is still overwritten by `@SP / M=0`
+        self.check('@SP AM=M-1 M=D @SP M=0',
+                   '@SP A=M-1 M=D @SP M=0',
+                   {},
+                   setup='@7 D=A @SP M=1')
+
+    def test_pointer_write_kept(self):
+        # a write through an address that isn't known never counts as overwriting a known one
+        self.check('@5 M=1 A=D M=0',
+                   '@5 M=1 A=D M=0',
+                   {},
+                   setup='@5 D=A')
+
+    def test_m_write_read_at_label(self):
+        # labels are only compared by name, so one may be the address written
+        self.check('@5 M=1 @LOOP D=M @5 M=0 (LOOP)',
+                   '@5 M=1 @LOOP D=M @5 M=0 (LOOP)',
+                   {})
+
+    ################## jump to next ##################
+
+    def test_jump_to_next(self):
+        self.check('@NEXT 0;JMP (NEXT) @5 M=1',
+                   '(NEXT) @5 M=1',
+                   {'jump to next': 2})
+
+    def test_jump_to_next_with_dest(self):
+        self.check('@NEXT D=1;JGT (NEXT) @5 M=D',
+                   'D=1 (NEXT) @5 M=D',
+                   {'jump to next': 1})
+
+    def test_jump_to_next_using_a(self):
+        self.check('@NEXT D=A;JMP (NEXT) @5 M=D',
+                   '@NEXT D=A (NEXT) @5 M=D',
+                   {'jump to next': 0})
+
+    def test_jump_to_next_without_load(self):
+        # the label is reached with A holding its address, which the instruction after it uses
+        self.check('@NEXT 0;JMP (NEXT) D=A @5 M=D',
+                   '@NEXT 0;JMP (NEXT) D=A @5 M=D',
+                   {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+
+
+# opcodes of the vm commands. Values index into `commands`
+PUSH, POP, ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT, LABEL, GOTO, IF_GOTO, FUNCTION, CALL, RETURN = range(17)
+
+# fused commands produced by the optimizer (VMOptimizer.py). They only exist in memory: they have a text form for
+# listings, but are never written to or parsed from .vm files
+MOVE, ARRAY_LOAD, ARRAY_STORE, NOT_IF_GOTO, IF_EQ_GOTO, IF_NE_GOTO, IF_GT_GOTO, IF_LE_GOTO, IF_LT_GOTO, IF_GE_GOTO = range(17, 27)
+
+commands = ['push', 'pop', 'add', 'sub', 'neg', 'eq', 'gt', 'lt', 'and', 'or', 'not', 'label', 'goto', 'if-goto', 'function', 'call', 'return',
+            'move', 'array-load', 'array-store', 'not-if-goto', 'if-eq-goto', 'if-ne-goto', 'if-gt-goto', 'if-le-goto', 'if-lt-goto', 'if-ge-goto']
+opcodes = {name: op for op, name in enumerate(commands[:RETURN + 1])}
+
+# memory segments of push/pop commands. Values index into `segments`
+CONSTANT, ARGUMENT, LOCAL, STATIC, THIS, THAT, POINTER, TEMP = range(8)
+segments = ['constant', 'argument', 'local', 'static', 'this', 'that', 'pointer', 'temp']
+segment_codes = {name: code for code, name in enumerate(segments)}
+
+# opcodes that take a name (label or function name) as their first argument
+named_ops = {LABEL, GOTO, IF_GOTO, FUNCTION, CALL, NOT_IF_GOTO, IF_EQ_GOTO, IF_NE_GOTO, IF_GT_GOTO, IF_LE_GOTO, IF_LT_GOTO, IF_GE_GOTO}
+
+# arguments of each command, for error messages
+usage = [''] * len(commands)
+usage[PUSH] = usage[POP] = ' <segment> <index>'
+usage[LABEL] = usage[GOTO] = usage[IF_GOTO] = ' <labelname>'
+usage[FUNCTION] = ' <functionname> <localcount>'
+usage[CALL] = ' <functionname> <argcount>'
+
+
+@dataclass(slots=True)
+class VMCommand:
+    """
+    one vm command. `segment` is only meaningful for push/pop, `name` for label/goto/if-goto/function/call,
+    and `index` holds the push/pop index or the function's local/argument count.
+    Fused commands also use `from_segment`/`from_index` for the source of the value they store
+    """
+    op: int
+    segment: int = 0
+    index: int = 0
+    name: str | None = None
+    from_segment: int = 0
+    from_index: int = 0
+
+    def __str__(self) -> str:
+        """the command in vm text form"""
+        if self.op in (PUSH, POP):
+            return f'{commands[self.op]} {segments[self.segment]} {self.index}'
+        if self.op in (FUNCTION, CALL):
+            return f'{commands[self.op]} {self.name} {self.index}'
+        if self.op in named_ops:
+            return f'{commands[self.op]} {self.name}'
+        if self.op == MOVE:
+            return f'move {segments[self.from_segment]} {self.from_index} -> {segments[self.segment]} {self.index}'
+        if self.op == ARRAY_LOAD:
+            return f'array-load {self.index}'
+        if self.op == ARRAY_STORE:
+            return f'array-store {segments[self.from_segment]} {self.from_index}'
+        return commands[self.op]
+
+    def __reduce__(self):
+        """pickle as a plain tuple of the fields, which is about half the size of the default, so programs are cheaper to send to worker processes"""
+        return VMCommand, (self.op, self.segment, self.index, self.name, self.from_segment, self.from_index)
+
+
+def parse(line:str) -> VMCommand:
+    """parse a single vm command (without comments or surrounding whitespace)"""
+    command, *args = line.split()
+    op = opcodes.get(command)
+    if op is None:
+        raise ValueError(f"Invalid vm command: \"{line}\"")
+
+    try:
+        if op in (PUSH, POP):
+            segment, index = args
+            return VMCommand(op, segment_codes[segment], int(index))
+        if op in (FUNCTION, CALL):
+            name, count = args
+            return VMCommand(op, index=int(count), name=name)
+        if op in named_ops:
+            name, = args
+            return VMCommand(op, name=name)
+        assert not args
+        return VMCommand(op)
+    except (ValueError, KeyError, AssertionError):
+        raise ValueError(f"Invalid vm command: \"{line}\". expected `{command}{usage[op]}`") from None
+
+
+def parse_lines(lines:Iterable[str]) -> list[VMCommand]:
+    """parse the raw lines of a vm file, skipping whitespace and comments"""
+    return list(parse_stream(lines))
+
+
+def parse_stream(lines:Iterable[str]) -> Iterator[VMCommand]:
+    """parse the raw lines of a vm file one at a time as they're read (e.g. from an open file), skipping whitespace and comments"""
+    for line in lines:
+        # drop any comment, then skip what's left if it's empty
+        line = line.split('//', 1)[0].strip()
+        if line:
+            yield parse(line)
+
+
+def serialize(program:Iterable[VMCommand]) -> str:
+    """vm text for a list of commands, one per line"""
+    return '\n'.join(map(str, program))
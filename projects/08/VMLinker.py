@@ -0,0 +1,71 @@
+from dataclasses import dataclass
+
+from VMCode import VMCommand, FUNCTION, CALL
+
+
+@dataclass
+class RemovedFunction:
+    """a function dropped from the program because nothing reachable calls it"""
+    name: str
+    file: str  # name of the vm file (class) it was defined in
+    commands: list[VMCommand]
+
+
+def split_functions(program: list[VMCommand]) -> tuple[list[VMCommand], dict[str, list[VMCommand]]]:
+    """split a vm file into the commands before its first function (if any) and the commands of each function, in order"""
+    preamble: list[VMCommand] = []
+    functions: dict[str, list[VMCommand]] = {}
+    body = preamble
+    for command in program:
+        if command.op == FUNCTION:
+            body = functions[command.name] = []
+        body.append(command)
+    return preamble, functions
+
+
+def call_graph(programs: dict[str, list[VMCommand]]) -> dict[str, set[str]]:
+    """for every function in the program, the functions it calls"""
+    graph: dict[str, set[str]] = {}
+    for program in programs.values():
+        _, functions = split_functions(program)
+        for name, body in functions.items():
+            graph[name] = {command.name for command in body if command.op == CALL}
+    return graph
+
+
+def reachable(graph: dict[str, set[str]], roots: list[str]) -> set[str]:
+    """every function that can be called, directly or indirectly, from the roots"""
+    seen = set()
+    stack = [root for root in roots if root in graph]
+    while stack:
+        name = stack.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        stack.extend(callee for callee in graph[name] if callee in graph and callee not in seen)
+    return seen
+
+
+def remove_unused_functions(programs: dict[str, list[VMCommand]], roots: list[str] = ['Sys.init']) -> tuple[dict[str, list[VMCommand]], list[RemovedFunction]]:
+    """
+    whole program link step: drop every function that can't be reached from the roots (by default Sys.init, which the
+    bootstrap code calls). Commands before a file's first function are always kept. If none of the roots is defined,
+    there's nothing to measure reachability from, so the program is returned unchanged
+    """
+    graph = call_graph(programs)
+    if not any(root in graph for root in roots):
+        return programs, []
+
+    live = reachable(graph, roots)
+    linked: dict[str, list[VMCommand]] = {}
+    removed: list[RemovedFunction] = []
+    for file, program in programs.items():
+        preamble, functions = split_functions(program)
+        linked[file] = [*preamble]
+        for name, body in functions.items():
+            if name in live:
+                linked[file].extend(body)
+            else:
+                removed.append(RemovedFunction(name, file, body))
+
+    return linked, removed
@@ -0,0 +1,155 @@
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator
+
+from VMCode import (VMCommand, commands, PUSH, POP, NEG, EQ, GT, LT, NOT, IF_GOTO, CONSTANT, POINTER, THAT,
+                    MOVE, ARRAY_LOAD, ARRAY_STORE, NOT_IF_GOTO, IF_EQ_GOTO, IF_NE_GOTO, IF_GT_GOTO, IF_LE_GOTO, IF_LT_GOTO, IF_GE_GOTO)
+
+
+@dataclass
+class Site:
+    """a place where the optimizer replaced a window of commands with a fused one"""
+    pattern: str
+    start: int   # index of the first replaced command in the original program
+    length: int  # number of original commands replaced
+    index: int   # index of the fused command in the optimized program
+
+
+def optimize(program: Iterable[VMCommand], sites: list[Site] | None = None) -> list[VMCommand]:
+    """
+    peephole optimize a vm program. Windows of commands at the end of the output are matched against the patterns
+    after each command is added, so fused commands can in turn be part of a longer pattern (e.g. a folded constant
+    that is then moved). If `sites` is given, every rewrite left in the final program is appended to it
+    """
+    out: list[VMCommand] = []
+    for command, start, length, pattern in rewrite(program):
+        if sites is not None and pattern is not None:
+            sites.append(Site(pattern, start, length, len(out)))
+        out.append(command)
+    return out
+
+
+def optimize_stream(program: Iterable[VMCommand]) -> Iterator[VMCommand]:
+    """like optimize, but reads the program and yields optimized commands as it goes, holding only a few commands at a time"""
+    for command, _, _, _ in rewrite(program):
+        yield command
+
+
+def rewrite(program: Iterable[VMCommand]) -> Iterator[tuple[VMCommand, int, int, str | None]]:
+    """
+    the optimized program, as (command, first original index, original length, pattern) for each command. The pattern is
+    None for commands that were left alone.
+    A rewritten window always ends with the newest command, since no pattern ends with a fused command (a folded constant
+    is a push constant, which doesn't end any pattern). So only the last (longest window - 1) commands can ever be part
+    of a later rewrite, and anything older is final and yielded right away
+    """
+    window = max(length for _, length, _ in patterns) - 1
+    out: list[VMCommand] = []
+    spans: list[tuple[int, int, str | None]] = []  # for each pending command: (first original index, original length, pattern)
+
+    for i, command in enumerate(program):
+        out.append(command)
+        spans.append((i, 1, None))
+
+        matched = True
+        while matched:
+            matched = False
+            for name, length, rewrite_ in patterns_ending_with[out[-1].op]:
+                if len(out) < length:
+                    continue
+                fused = rewrite_(*out[-length:])
+                if fused is None:
+                    continue
+
+                start = spans[-length][0]
+                end = spans[-1][0] + spans[-1][1]
+                del out[-length:], spans[-length:]
+                out.append(fused)
+                spans.append((start, end - start, name))
+                matched = True
+                break
+
+        while len(out) > window:
+            yield out.pop(0), *spans.pop(0)
+
+    for command, span in zip(out, spans):
+        yield command, *span
+
+
+def is_push(command: VMCommand, segment: int | None = None, index: int | None = None) -> bool:
+    return command.op == PUSH and (segment is None or command.segment == segment) and (index is None or command.index == index)
+
+def is_pop(command: VMCommand, segment: int | None = None, index: int | None = None) -> bool:
+    return command.op == POP and (segment is None or command.segment == segment) and (index is None or command.index == index)
+
+
+def to_signed(value: int) -> int:
+    """wrap a value to the signed 16-bit range"""
+    return ((value + 0x8000) & 0xFFFF) - 0x8000
+
+
+################## patterns ##################
+# each takes the commands of a window and returns the fused command that replaces them, or None if they don't match
+
+def fold_constant(push: VMCommand, op: VMCommand) -> VMCommand | None:
+    """push constant c / neg|not  ->  push constant -c|~c (constants may then be negative)"""
+    if is_push(push, CONSTANT) and op.op in (NEG, NOT):
+        return VMCommand(PUSH, CONSTANT, to_signed(-push.index if op.op == NEG else ~push.index))
+
+def move(push: VMCommand, pop: VMCommand) -> VMCommand | None:
+    """push S i / pop T j  ->  memory to memory move without touching the stack"""
+    if is_push(push) and is_pop(pop):
+        return VMCommand(MOVE, pop.segment, pop.index, from_segment=push.segment, from_index=push.index)
+
+def array_load(pop: VMCommand, push: VMCommand) -> VMCommand | None:
+    """pop pointer 1 / push that j  ->  replace the address on top of the stack with the value at address + j"""
+    if is_pop(pop, POINTER, 1) and is_push(push, THAT):
+        return VMCommand(ARRAY_LOAD, THAT, push.index)
+
+def array_store(pop_address: VMCommand, push: VMCommand, pop: VMCommand) -> VMCommand | None:
+    """pop pointer 1 / push S i / pop that 0  ->  store S i at the address popped from the stack"""
+    if is_pop(pop_address, POINTER, 1) and is_push(push) and is_pop(pop, THAT, 0):
+        return VMCommand(ARRAY_STORE, THAT, 0, from_segment=push.segment, from_index=push.index)
+
+# comparison -> branch that jumps when it's true, and when it's false
+compare_branches = {EQ: (IF_EQ_GOTO, IF_NE_GOTO), GT: (IF_GT_GOTO, IF_LE_GOTO), LT: (IF_LT_GOTO, IF_GE_GOTO)}
+
+def compare_branch(compare: VMCommand, branch: VMCommand) -> VMCommand | None:
+    """eq|gt|lt / if-goto L  ->  compare the top two values and branch directly"""
+    if compare.op in compare_branches and branch.op == IF_GOTO:
+        return VMCommand(compare_branches[compare.op][0], name=branch.name)
+
+def negated_compare_branch(compare: VMCommand, not_: VMCommand, branch: VMCommand) -> VMCommand | None:
+    """eq|gt|lt / not / if-goto L  ->  compare the top two values and branch directly on the opposite condition"""
+    if compare.op in compare_branches and not_.op == NOT and branch.op == IF_GOTO:
+        return VMCommand(compare_branches[compare.op][1], name=branch.name)
+
+def not_branch(not_: VMCommand, branch: VMCommand) -> VMCommand | None:
+    """not / if-goto L  ->  branch if the top value isn't -1, without computing its complement on the stack"""
+    if not_.op == NOT and branch.op == IF_GOTO:
+        return VMCommand(NOT_IF_GOTO, name=branch.name)
+
+
+# (name, window length, rewrite), longest windows first so e.g. `lt / not / if-goto` isn't split up by `not / if-goto`
+patterns: list[tuple[str, int, Callable[..., VMCommand | None]]] = [
+    ('array store', 3, array_store),
+    ('negated compare branch', 3, negated_compare_branch),
+    ('compare branch', 2, compare_branch),
+    ('not branch', 2, not_branch),
+    ('fold constant', 2, fold_constant),
+    ('array load', 2, array_load),
+    ('move', 2, move),
+]
+
+# opcodes each pattern's window can end with
+pattern_last_ops = {
+    'array store': {POP},
+    'negated compare branch': {IF_GOTO},
+    'compare branch': {IF_GOTO},
+    'not branch': {IF_GOTO},
+    'fold constant': {NEG, NOT},
+    'array load': {PUSH},
+    'move': {POP},
+}
+
+# the patterns that can match a window ending with each opcode (in the same order), so only those are tried after each command
+patterns_ending_with = [[pattern for pattern in patterns if op in pattern_last_ops[pattern[0]]] for op in range(len(commands))]
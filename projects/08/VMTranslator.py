@@ -1,42 +1,69 @@
-import sys
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from itertools import repeat
 from pathlib import Path
-from typing import Literal
-
-
-
-# hidden global variables. Access via functions
-_function_name: str = None    # name of the current function being translated
-_counter = 0                 # counter for generating unique labels
-
-def get_current_function_name() -> str:
-    """return the name of the current function"""
-    if _function_name is not None:
-        return _function_name
-    else:
-        return 'global'
-
-def set_current_function_name(name: str):
-    """set the name of the current function"""
-    global _function_name
-    _function_name = name
-
-def get_next_counter() -> int:
-    """return the next value of the counter"""
-    global _counter
-    _counter += 1
-    return _counter
+from typing import Callable, Iterable, Iterator, Literal, Sequence
+import hashlib
+import sys
 
-def main():
-    """main entrypoint for the vm translator"""
+from VMCode import (VMCommand, commands, parse_lines, parse_stream, PUSH, POP, ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT, LABEL, GOTO, IF_GOTO, FUNCTION, CALL, RETURN,
+                    MOVE, ARRAY_LOAD, ARRAY_STORE, NOT_IF_GOTO, IF_EQ_GOTO, IF_NE_GOTO, IF_GT_GOTO, IF_LE_GOTO, IF_LT_GOTO, IF_GE_GOTO,
+                    CONSTANT, ARGUMENT, LOCAL, STATIC, THIS, THAT, POINTER, TEMP)
+from VMOptimizer import optimize_stream
+from VMLinker import RemovedFunction, remove_unused_functions
+
+# object files (separate compilation) are assembled and linked by the assembler's project
+sys.path.append(str(Path(__file__).resolve().parent.parent / '06'))
+from HackLinker import Emitter, ObjectFile, assemble_object, link, read_object, write_object
+
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    code generation options. They describe how the whole program is built, so every file of a program must be translated
+    with the same settings (e.g. shared runtime call sites only work if the program includes the shared routines)
+    """
+    # call, return and eq/gt/lt are translated into jumps to single global routines ($CALL, $RETURN, $EQ, $GT, $LT)
+    # rather than being inlined at every site, trading a few cycles per use for a much smaller program.
+    # The routines themselves must be added to the program via shared_runtime()
+    shared_runtime: bool = False
+
+    # programs go through the peephole optimizer (VMOptimizer.py) before translation
+    optimize: bool = False
+
+    # the value on top of the stack is kept in D (rather than written to RAM) between consecutive commands of a basic block,
+    # and is only spilled to the stack at labels, jumps, calls and commands that need the whole stack in RAM
+    cache_tos: bool = False
+
+    # release profile: leave out the comments and blank lines of the listing (e.g. the vm command before its code), for
+    # a compact output. Doesn't change the code itself
+    strip_comments: bool = False
+
+    # where code can be made smaller at the cost of cycles or the other way around, which way the translator goes:
+    # 'speed', 'size' or 'balanced' in between (see opt_level_weights). For now this picks how functions initialise their locals
+    opt_level: Literal['speed', 'balanced', 'size'] = 'speed'
+
+
+def main(filepath:Path, settings:Settings=Settings(), remove_unused:bool=False, jobs:int=1, stream:bool=False, objects:bool=False, hack:bool=False, listing:bool=False):
+    """
+    main entrypoint for the vm translator. If remove_unused, functions that can't be reached from Sys.init are left out.
+    The files of a directory are translated on `jobs` worker processes.
+    If stream, each command is translated and written out as soon as it's read instead, so memory use doesn't grow with
+    the size of the program (this rules out remove_unused and jobs, which need every file in memory).
+    If objects, each file is translated and assembled into a relocatable .hobj next to it (only if it changed since its
+    object was built), and the objects are linked straight into the .hack program.
+    If hack, the translator's code is encoded straight into a .hack program instead of writing it out as .asm to be
+    assembled, and the .asm is only written as a listing if listing
+    """
 
     # get the file or list of files to translate and the output asm filepath
-    assert len(sys.argv) == 2, "Usage: python vm.py <filename.vm> or <directory>"
-    filepath = Path(sys.argv[1])
     assert filepath.exists(), f"Invalid path: \"{filepath}\" does not exist"
-    
-    
+
+
     if filepath.is_dir():
-        files = [*filepath.glob('*.vm')] # get all .vm files in the directory
+        files = sorted(filepath.glob('*.vm')) # get all .vm files in the directory, in a fixed order so builds are reproducible
         outpath = filepath / f'{filepath.name}.asm'
         INCLUDE_BOOTSTRAP = True # for directory programs, don't skip the bootstrap code
     else:
@@ -45,111 +72,248 @@ def main():
         INCLUDE_BOOTSTRAP = False # for single file programs, skip the bootstrap code
 
 
-    # array to save the translated asm lines
-    asm_lines = []
+    if stream:
+        assert not remove_unused and jobs == 1, "Streaming translates one command at a time, so it can't remove unused functions or use multiple jobs"
+        write_stream(outpath, stream_program(files, settings, INCLUDE_BOOTSTRAP))
+        return
+
+    if objects:
+        assert not remove_unused, "Objects are built one file at a time, so unused functions (which depend on every file) can't be removed"
+        units, rebuilt = build_objects(files, settings, jobs)
+        if INCLUDE_BOOTSTRAP:
+            units.insert(0, assemble_object(bootstrap(settings)))
+        units.append(assemble_object(shared_runtime(settings)))
+        with open(outpath.with_suffix('.hack'), 'w') as f:
+            f.write('\n'.join(link(units)))
+        print(f'rebuilt {len(rebuilt)} of {len(files)} objects')
+        return
 
 
+    # read in the lines of each vm file
+    programs = {}
+    for file in files:
+        with open(file, 'r') as f:
+            programs[file.stem] = parse_lines(f.readlines())
 
-    # add the bootstrap code to the beginning of the program
-    if INCLUDE_BOOTSTRAP:
-        asm_lines.extend(['// bootstrap code', *bootstrap(), ''])
+    # drop functions nothing reachable calls
+    removed = []
+    if remove_unused:
+        programs, removed = remove_unused_functions(programs)
 
 
-    # translate each vm file and insert into the output asm file
-    for file in files:
-        # save the base filename for use in generating unique labels
-        global basename
-        basename = file.stem
+    if hack:
+        # encode the program straight into machine code, along with the listing if wanted
+        hack_lines, asm_lines = emit_hack(programs, settings, jobs, INCLUDE_BOOTSTRAP, listing)
+        with open(outpath.with_suffix('.hack'), 'w') as f:
+            f.write('\n'.join(hack_lines))
+        if listing:
+            with open(outpath, 'w') as f:
+                f.write('\n'.join(asm_lines))
 
-        # read in the lines of the program
+    else:
+        # array to save the translated asm lines
+        asm_lines = []
+
+        # add the bootstrap code to the beginning of the program
+        if INCLUDE_BOOTSTRAP:
+            asm_lines.extend(bootstrap_section(settings))
+
+        # translate each vm file and insert into the output asm file
+        asm_lines.extend(translate_programs(programs, settings, jobs))
+
+        # add the shared routines (if enabled) after the program, where they are only ever reached by jumps
+        asm_lines.extend(shared_runtime(settings))
+
+        # write the final program to the output file
+        with open(outpath, 'w') as f:
+            f.write('\n'.join(asm_lines))
+
+    if remove_unused:
+        print(removal_report(removed, settings))
+
+
+def stream_program(files:list[Path], settings:Settings=Settings(), include_bootstrap:bool=True) -> Iterator[Sequence[str]]:
+    """the asm of the program in chunks (the code of one command at a time), reading each file line by line as the chunks are consumed"""
+    if include_bootstrap:
+        yield bootstrap_section(settings)
+    for file in files:
         with open(file, 'r') as f:
-            lines = f.readlines()
-
-        # filter out whitespace and comments
-        vm_lines = filter_whitespace(lines)
-
-        # translate the file into assembly
-        for line in vm_lines:
-            asm_lines.extend([f'// {line}', *translate(line), ''])
-
-
-    # write the final program to the output file
-    with open(outpath, 'w') as f:
-        f.write('\n'.join(asm_lines))
-
-
-def filter_whitespace(lines:list[str]) -> list[str]:
-    """filter out whitespace and comments from the vm program"""
-    prog_lines = []
-
-    for line in lines:
-        # remove leading/trailing whitespace
-        line = line.strip()
-
-        # skip empty lines and comments
-        if line == '' or line.startswith('//'):
-            continue
-
-        # split code from any trailing comments
-        line = line.split('//')[0].strip()
-
-        # add to list of program lines
-        prog_lines.append(line)
-
-    return prog_lines
-
-
-def translate(line:str) -> list[str]:
-    """translate a vm line into one or more asm lines"""
-
-    if line.startswith('push'):
-        return push(line)
-    elif line.startswith('pop'):
-        return pop(line)
-    elif line.startswith('label'):
-        return label(line)
-    elif line.startswith('goto'):
-        return goto(line)
-    elif line.startswith('if-goto'):
-        return if_goto(line)
-    elif line.startswith('function'):
-        return function_(line)
-    elif line.startswith('call'):
-        return call(line)
-    elif line == 'return':
-        return return_()
-    elif line == 'add':
-        return add()
-    elif line == 'sub':
-        return sub()
-    elif line == 'neg':
-        return neg()
-    elif line == 'eq':
-        return eq()
-    elif line == 'gt':
-        return gt()
-    elif line == 'lt':
-        return lt()
-    elif line == 'and':
-        return and_()
-    elif line == 'or':
-        return or_()
-    elif line == 'not':
-        return not_()
+            yield from Translator(file.stem, settings).translate_stream(parse_stream(f))
+    yield shared_runtime(settings)
+
+
+def write_stream(outpath:Path, chunks:Iterable[Sequence[str]]):
+    """write chunks of asm lines to the output file as they're produced, through a large write buffer"""
+    with open(outpath, 'w', buffering=1 << 20) as f:
+        separator = ''
+        for chunk in chunks:
+            if chunk:
+                f.write(separator)
+                f.write('\n'.join(chunk))
+                separator = '\n'
+
+
+def translate_file(name:str, lines:Iterable[str], settings:Settings=Settings()) -> list[str]:
+    """translate the raw lines of one vm file into asm lines. `name` is the file's base name, used to scope static variables and labels"""
+    return translate_program(name, parse_lines(lines), settings)
+
+
+def translate_program(name:str, program:Iterable[VMCommand], settings:Settings=Settings()) -> list[str]:
+    """translate the parsed commands of one vm file (e.g. straight from the compiler) into asm lines"""
+    return Translator(name, settings).translate_program(program)
+
+
+def translate_programs(programs:dict[str, list[VMCommand]], settings:Settings=Settings(), jobs:int=1) -> list[str]:
+    """
+    translate every file of a program (parsed commands by file name) and concatenate the asm in the order of `programs`.
+    Files don't share any translation state, so with jobs > 1 they are spread over worker processes, with the same output
+    """
+    if jobs == 1:
+        fragments = [translate_program(name, program, settings) for name, program in programs.items()]
     else:
-        raise ValueError(f"Invalid vm command: \"{line}\"")
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            fragments = list(executor.map(translate_program, programs.keys(), programs.values(), repeat(settings)))
 
+    return [line for fragment in fragments for line in fragment]
 
-def bootstrap() -> list[str]:
+
+def emit_program(name:str, program:Iterable[VMCommand], settings:Settings=Settings(), listing:bool=False, tag:str='') -> tuple[ObjectFile, list[str]]:
+    """
+    translate the commands of one vm file straight into a relocatable object: the code of each command is encoded into
+    machine words as it's generated, rather than written out as asm text to be parsed again by the assembler.
+    If listing, the asm lines are returned too (otherwise the list is empty)
+    """
+    if not listing:
+        settings = replace(settings, strip_comments=True)  # comments would only be skipped again
+
+    emitter = Emitter(tag)
+    asm_lines = []
+    for code in Translator(name, settings).translate_stream(program):
+        emitter.emit(code)
+        if listing:
+            asm_lines.extend(code)
+    return emitter.finish(), asm_lines
+
+
+def emit_programs(programs:dict[str, list[VMCommand]], settings:Settings=Settings(), jobs:int=1, listing:bool=False) -> tuple[list[ObjectFile], list[str]]:
+    """emit every file of a program into an object (on `jobs` worker processes), in the order of `programs`, along with their concatenated listing"""
+    if jobs == 1:
+        results = [emit_program(name, program, settings, listing) for name, program in programs.items()]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(emit_program, programs.keys(), programs.values(), repeat(settings), repeat(listing)))
+
+    return [obj for obj, _ in results], [line for _, asm_lines in results for line in asm_lines]
+
+
+def emit_hack(programs:dict[str, list[VMCommand]], settings:Settings=Settings(), jobs:int=1, include_bootstrap:bool=True, listing:bool=False) -> tuple[list[str], list[str]]:
+    """
+    the lines of the .hack program for every file of a program, together with the bootstrap code (if include_bootstrap)
+    and the shared routines. If listing, the asm lines of the whole program are returned too (otherwise the list is empty)
+    """
+    objects, asm_lines = emit_programs(programs, settings, jobs, listing)
+
+    runtime = shared_runtime(settings)
+    objects.append(assemble_object(runtime))
+    if listing:
+        asm_lines.extend(runtime)
+
+    if include_bootstrap:
+        bootstrap_lines = bootstrap_section(settings)
+        objects.insert(0, assemble_object(bootstrap_lines))
+        if listing:
+            asm_lines[:0] = bootstrap_lines
+
+    return link(objects), asm_lines
+
+
+def object_tag(settings:Settings=Settings()) -> str:
+    """
+    what an object file was built by: the settings and a hash of the translator's and assembler's sources, so objects
+    built with other settings or by an older version of the code are rebuilt rather than linked
+    """
+    digest = hashlib.sha1()
+    for source in [__file__, *(sys.modules[module].__file__ for module in ['VMCode', 'VMOptimizer', 'HackAssembler', 'HackLinker'])]:
+        digest.update(Path(source).read_bytes())
+    return f'{settings} {digest.hexdigest()}'
+
+
+def build_object(file:Path, settings:Settings=Settings(), tag:str='') -> ObjectFile:
+    """translate one vm file into a relocatable object"""
+    with open(file, 'r') as f:
+        return emit_program(file.stem, parse_stream(f), settings, tag=tag)[0]
+
+
+def build_objects(files:list[Path], settings:Settings=Settings(), jobs:int=1) -> tuple[list[ObjectFile], list[Path]]:
+    """
+    the object of every vm file, in order. The .hobj next to a file is reused if it's newer than the file and was built by
+    the same code with the same settings, and the others are rebuilt (on `jobs` worker processes) and saved.
+    Also returns the files that were rebuilt
+    """
+    tag = object_tag(settings)
+    objects: dict[Path, ObjectFile] = {}
+    for file in files:
+        path = file.with_suffix('.hobj')
+        if path.exists() and path.stat().st_mtime_ns >= file.stat().st_mtime_ns:
+            try:
+                obj = read_object(path)
+            except ValueError:
+                continue
+            if obj.tag == tag:
+                objects[file] = obj
+
+    stale = [file for file in files if file not in objects]
+    if jobs == 1:
+        rebuilt = [build_object(file, settings, tag) for file in stale]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            rebuilt = list(executor.map(build_object, stale, repeat(settings), repeat(tag)))
+
+    for file, obj in zip(stale, rebuilt):
+        write_object(file.with_suffix('.hobj'), obj)
+        objects[file] = obj
+
+    return [objects[file] for file in files], stale
+
+
+def count_instructions(asm_lines:Iterable[str]) -> int:
+    """number of ROM words the asm lines assemble to (everything but labels, comments and blank lines)"""
+    return sum(1 for line in asm_lines if line and not line.startswith(('(', '//')))
+
+
+def removal_report(removed:list[RemovedFunction], settings:Settings=Settings()) -> str:
+    """size of each function removed by the link step (translated with the given settings), largest first"""
+    sizes = [(count_instructions(translate_program(function.file, function.commands, settings)), function) for function in removed]
+    sizes.sort(key=lambda item: item[0], reverse=True)
+
+    lines = [f'removed {len(removed)} unused functions ({sum(len(function.commands) for function in removed)} vm commands, {sum(size for size, _ in sizes)} ROM words)']
+    if removed:
+        lines.append(f'{"function":<32} {"vm commands":>11} {"ROM words":>10}')
+    for size, function in sizes:
+        lines.append(f'{function.name:<32} {len(function.commands):>11} {size:>10}')
+    return '\n'.join(lines)
+
+
+def bootstrap_section(settings:Settings=Settings()) -> list[str]:
+    """the bootstrap code as the first section of the output"""
+    if settings.strip_comments:
+        return bootstrap(settings)
+    return ['// bootstrap code', *bootstrap(settings), '']
+
+
+def bootstrap(settings:Settings=Settings()) -> list[str]:
     """bootstrap code to initialize the vm"""
 
-    return [
+    # the call to Sys.init gets a translator of its own. File names don't start with '$', so its labels can't clash with any file's
+    translator = Translator('$bootstrap', settings)
+
+    code = [
         '//set SP=256',
         '@256',
         'D=A',
         '@SP',
         'M=D',
-        
+
         '// For easier debugging: set pointers to known illegal values: LCL=-4242, ARG=-4243, THIS=-4244, THAT=-4245',
         '@4242',
         'D=A',
@@ -173,99 +337,685 @@ def bootstrap() -> list[str]:
         'M=M-D',
 
         '//call Sys.init',
-        *call('call Sys.init 0')
+        *translator.call(VMCommand(CALL, index=0, name='Sys.init'))
     ]
+    return without_comments(code) if settings.strip_comments else code
+
+
+def without_comments(asm_lines:list[str]) -> list[str]:
+    """the asm lines without comment and blank lines"""
+    return [line for line in asm_lines if line and not line.startswith('//')]
+
+
+
+class Translator:
+    """
+    translator for the commands of one vm file. It holds all the state that changes while translating (the current function,
+    the counter for unique labels and the top of stack cache), so any number of files can be translated independently,
+    in any order or in parallel. Labels the translator generates itself are namespaced by the file name instead of a
+    program-wide counter, so the asm of a file doesn't depend on what else was translated before it
+    """
+
+    def __init__(self, name:str, settings:Settings=Settings()):
+        self.name = name                       # base name of the vm file, used to scope static variables and generated labels
+        self.settings = settings
+        self.function_name: str | None = None  # name of the current function being translated
+        self.counter = 0                       # counter for generating unique labels within the file
+        self.tos_cached = False                # while translating with cache_tos: whether D currently holds the top of the stack
+
+        # how to translate each opcode with these settings: the method generating its code, or for commands without
+        # parameters, a fixed template of the code (and of the code listed under its comment)
+        self.command_handlers = self.build_command_handlers()
+        self.handlers = self.build_cached_handlers() if settings.cache_tos else self.command_handlers
+        self.templates: dict[int, tuple[tuple[str, ...], tuple[str, ...]]] = {}
+        if not settings.cache_tos:
+            for op, code in [*arithmetic_templates.items(), (RETURN, tuple(self.return_()))]:
+                self.templates[op] = code, (f'// {commands[op]}', *code, '')
+
+        # code of the commands in memoized_ops, by their fields, the cache state and whether it's listed with a comment.
+        # Each entry also records the cache state after the command
+        self.memo: dict[tuple, tuple[tuple[str, ...], bool]] = {}
+
+    def get_current_function_name(self) -> str:
+        """return the name of the current function"""
+        if self.function_name is not None:
+            return self.function_name
+        else:
+            return 'global'
+
+    def get_next_counter(self) -> int:
+        """return the next value of the counter"""
+        self.counter += 1
+        return self.counter
+
+    def unique_label(self, kind:str, counter:int) -> str:
+        """
+        a label for code generated by the translator itself (e.g. return addresses). vm names never contain '$', so
+        starting with it keeps these apart from every function and label of the program, and the file name keeps them
+        apart from those of other files
+        """
+        return f'${self.name}.{kind}_{counter}'
+
+    def translate_program(self, program:Iterable[VMCommand]) -> list[str]:
+        """translate the commands of the file into asm lines"""
+        asm_lines = []
+        for code in self.translate_stream(program):
+            asm_lines.extend(code)
+        return asm_lines
+
+    def translate_stream(self, program:Iterable[VMCommand]) -> Iterator[Sequence[str]]:
+        """
+        translate the commands of the file one at a time as they're read from `program`, yielding the asm of each.
+        Nothing is held on to between commands (the optimizer only keeps a window of a few), so memory use doesn't grow with the file
+        """
+
+        if self.settings.optimize:
+            program = optimize_stream(program)
+
+        comment = not self.settings.strip_comments
+        translate = self.translate
+        for command in program:
+            yield translate(command, comment)
+
+        # don't leave the top of the stack cached across files
+        if self.tos_cached:
+            yield ['// spill', *self.spill(), ''] if comment else self.spill()
+
+    def translate(self, command:VMCommand, comment:bool=False) -> Sequence[str]:
+        """
+        translate a vm command into one or more asm lines. If comment, the lines are listed under a comment with the
+        vm command, followed by a blank line. The returned lines may be shared templates, so they must not be modified
+        """
+
+        op = command.op
+        template = self.templates.get(op)
+        if template is not None:
+            return template[comment]
+
+        if op in memoized_ops:
+            key = (op, command.segment, command.index, command.from_segment, command.from_index, self.tos_cached, comment)
+            entry = self.memo.get(key)
+            if entry is None:
+                code = self.handlers[op](command)
+                entry = self.memo[key] = tuple([f'// {command}', *code, ''] if comment else code), self.tos_cached
+            self.tos_cached = entry[1]
+            return entry[0]
+
+        handler = self.handlers.get(op)
+        if handler is None:
+            raise ValueError(f"Invalid vm command: \"{command}\"")
+        code = handler(command)
+        return [f'// {command}', *code, ''] if comment else code
+
+    def translate_command(self, command:VMCommand) -> Sequence[str]:
+        """translate a vm command into one or more asm lines, without top of stack caching"""
+        handler = self.command_handlers.get(command.op)
+        if handler is None:
+            raise ValueError(f"Invalid vm command: \"{command}\"")
+        return handler(command)
+
+    def build_command_handlers(self) -> dict[int, Callable[[VMCommand], Sequence[str]]]:
+        """the method translating each opcode, without top of stack caching"""
+        return {
+            PUSH: self.push,
+            POP: self.pop,
+            LABEL: self.label,
+            GOTO: self.goto,
+            IF_GOTO: self.if_goto,
+            FUNCTION: self.function_,
+            CALL: self.call,
+            RETURN: lambda command: self.return_(),
+            ADD: lambda command: arithmetic_templates[ADD],
+            SUB: lambda command: arithmetic_templates[SUB],
+            NEG: lambda command: arithmetic_templates[NEG],
+            EQ: lambda command: self.eq(),
+            GT: lambda command: self.gt(),
+            LT: lambda command: self.lt(),
+            AND: lambda command: arithmetic_templates[AND],
+            OR: lambda command: arithmetic_templates[OR],
+            NOT: lambda command: arithmetic_templates[NOT],
+            MOVE: self.move,
+            ARRAY_LOAD: array_load,
+            ARRAY_STORE: self.array_store,
+            NOT_IF_GOTO: self.not_if_goto,
+            **{op: self.compare_branch for op in compare_branch_jumps},
+        }
+
+    def push(self, command:VMCommand) -> list[str]:
+        """translate a push command into one or more asm lines"""
+
+        segment, index = command.segment, command.index
+
+        # handle the constant segment. Negative constants only come from the optimizer folding neg/not into a constant
+        if segment == CONSTANT:
+            if index < 0:
+                return [*constant_D(index), *push_D()]
+            return push_constant(index)
+        elif segment == LOCAL:
+            return push_from_variable('LCL', index)
+        elif segment == ARGUMENT:
+            return push_from_variable('ARG', index)
+        elif segment == THIS:
+            return push_from_variable('THIS', index)
+        elif segment == THAT:
+            return push_from_variable('THAT', index)
+        elif segment == TEMP:
+            assert index in range(8), f"Invalid push command: \"{command}\". Temp index must be in range 0-7"
+            return [
+                f'@{5+index}',
+                'D=M',
+                *push_D(),
+            ]
+        elif segment == STATIC:
+            return [
+                f'@{self.name}.{index}',
+                'D=M',
+                *push_D(),
+            ]
+        elif segment == POINTER:
+            assert index in (0, 1), f"Invalid push command: \"{command}\". Pointer index must be 0 or 1"
+            return [
+                f'@{3+index}',
+                'D=M',
+                *push_D(),
+            ]
+        else:
+            raise ValueError(f"Invalid push command: \"{command}\". Unknown segment")
+
+    def pop(self, command:VMCommand) -> list[str]:
+        """translate a pop command into one or more asm lines"""
+
+        segment, index = command.segment, command.index
+
+        assert segment != CONSTANT, f"Invalid pop command: \"{command}\". Cannot pop to constant segment"
+
+        if segment == LOCAL:
+            return pop_to_variable('LCL', index)
+        elif segment == ARGUMENT:
+            return pop_to_variable('ARG', index)
+        elif segment == THIS:
+            return pop_to_variable('THIS', index)
+        elif segment == THAT:
+            return pop_to_variable('THAT', index)
+        elif segment == TEMP:
+            assert index in range(8), f"Invalid pop command: \"{command}\". Temp index must be in range 0-7"
+            return [
+                *pop_D(),
+                f'@{5+index}',
+                'M=D',
+            ]
+        elif segment == STATIC:
+            return [
+                *pop_D(),
+                f'@{self.name}.{index}',
+                'M=D',
+            ]
+        elif segment == POINTER:
+            assert index in (0, 1), f"Invalid pop command: \"{command}\". Pointer index must be 0 or 1"
+            return [
+                *pop_D(),
+                f'@{3+index}',
+                'M=D',
+            ]
+        else:
+            raise ValueError(f"Invalid pop command: \"{command}\". Unknown segment")
+
+    def label(self, command:VMCommand) -> list[str]:
+        """translate a label command into one or more asm lines"""
+
+        label_name = command.name
 
-def push(line:str) -> list[str]:
-    """translate a push command into one or more asm lines"""
-
-    # verify the command starts with push and has a segment and index
-    assert line.startswith('push'), f"Invalid push command: \"{line}\". expected `push <segment> <index>`"
-
-    # separate out the segment/index and convert index to int
-    _, segment, index = line.split()
-    index = int(index)
-
-    # handle the constant segment
-    if segment == 'constant':
-        return push_constant(index)
-    elif segment == 'local':
-        return push_from_variable('LCL', index)
-    elif segment == 'argument':
-        return push_from_variable('ARG', index)
-    elif segment == 'this':
-        return push_from_variable('THIS', index)
-    elif segment == 'that':
-        return push_from_variable('THAT', index)
-    elif segment == 'temp':
-        assert index in range(8), f"Invalid push command: \"{line}\". Temp index must be in range 0-7"
         return [
-            f'@{5+index}',
-            'D=M',
-            *push_D(),
+            f'({self.get_current_function_name()}${label_name})',
         ]
-    elif segment == 'static':
+
+    def goto(self, command:VMCommand) -> list[str]:
+        """translate a goto command into one or more asm lines"""
+
+        label_name = command.name
+
         return [
-            f'@{basename}.{index}',
-            'D=M',
-            *push_D(),
+            f'@{self.get_current_function_name()}${label_name}',
+            '0;JMP',
         ]
-    elif segment == 'pointer':
-        assert index in (0, 1), f"Invalid push command: \"{line}\". Pointer index must be 0 or 1"
+
+    def if_goto(self, command:VMCommand) -> list[str]:
+        """translate an if-goto command into one or more asm lines"""
+
+        label_name = command.name
+
         return [
-            f'@{3+index}',
-            'D=M',
-            *push_D(),
+            *pop_D(),
+            f'@{self.get_current_function_name()}${label_name}',
+            'D;JNE',
         ]
-    else:
-        raise ValueError(f"Invalid push command: \"{line}\". Unknown segment: \"{segment}\"")
-
 
+    def function_(self, command:VMCommand) -> list[str]:
+        """translate a function command into one or more asm lines"""
 
-def pop(line:str) -> list[str]:
-    """translate a pop command into one or more asm lines"""
+        function_name, local_count = command.name, command.index
 
-    # verify the command starts with pop and has a segment and index
-    assert line.startswith('pop'), f"Invalid pop command: \"{line}\". expected `pop <segment> <index>`"
+        # save the function name for use in label/goto/if-goto commands
+        self.function_name = function_name
 
-    # separate out the segment/index and convert index to int
-    _, segment, index = line.split()
-    index = int(index)
+        # return the asm lines
+        return [
+            f'({function_name})',
+            *self.init_locals(local_count),
+        ]
 
-    assert segment != 'constant', f"Invalid pop command: \"{line}\". Cannot pop to constant segment"
+    def init_locals(self, local_count:int) -> list[str]:
+        """push a 0 for each local of the function, in whichever way is cheapest at the optimization level (see prologue_options)"""
+
+        if local_count == 0:
+            return []
+
+        prologue = choose_prologue(local_count, self.settings)
+
+        if prologue == 'shared':
+            # the $LOCALS routine doesn't touch D, so it returns through it
+            return_address = self.unique_label('ret', self.get_next_counter())
+            return [
+                f'@{return_address}',
+                'D=A',
+                f'@$LOCALS_{local_count}',
+                '0;JMP',
+                f'({return_address})',
+            ]
+
+        if prologue == 'loop':
+            # count D down from local_count, pushing a 0 each time
+            loop = self.unique_label('LOCALS', self.get_next_counter())
+            return [
+                f'@{local_count}',
+                'D=A',
+                f'({loop})',
+                *push_zero(),
+                f'@{loop}',
+                'D=D-1;JGT',
+            ]
+
+        # unrolled: a single local only needs SP bumped. Otherwise the locals are zeroed with A walking over them,
+        # and SP is moved past them once at the end
+        if local_count == 1:
+            return push_zero()
+        return [
+            '@SP',
+            'A=M',
+            'M=0',
+            *(['A=A+1', 'M=0'] * (local_count - 1)),
+            'D=A+1',
+            '@SP',
+            'M=D',
+        ]
 
-    if segment == 'local':
-        return pop_to_variable('LCL', index)
-    elif segment == 'argument':
-        return pop_to_variable('ARG', index)
-    elif segment == 'this':
-        return pop_to_variable('THIS', index)
-    elif segment == 'that':
-        return pop_to_variable('THAT', index)
-    elif segment == 'temp':
-        assert index in range(8), f"Invalid pop command: \"{line}\". Temp index must be in range 0-7"
+    def call(self, command:VMCommand) -> list[str]:
+        """translate a call command into one or more asm lines"""
+
+        function_name, arg_count = command.name, command.index
+
+        # generate a unique return address label
+        return_address = self.unique_label('ret', self.get_next_counter())
+
+        if self.settings.shared_runtime:
+            return [
+                # R13 = arg_count + 5, the distance from the new ARG to SP once the frame is pushed
+                f'@{arg_count + 5}',
+                'D=A',
+                '@R13',
+                'M=D',
+                # R14 = function address
+                f'@{function_name}',
+                'D=A',
+                '@R14',
+                'M=D',
+                # D = return address
+                f'@{return_address}',
+                'D=A',
+                '@$CALL',
+                '0;JMP',
+                f'({return_address})',
+            ]
+
+        # push the return address
         return [
-            *pop_D(),
-            f'@{5+index}',
+            *push_constant(return_address),
+            *push_named_variable('LCL'),
+            *push_named_variable('ARG'),
+            *push_named_variable('THIS'),
+            *push_named_variable('THAT'),
+            # ARG = SP - arg_count - 5
+            '@SP',
+            'D=M',
+            f'@{arg_count}',
+            'D=D-A',
+            '@5',
+            'D=D-A',
+            '@ARG',
+            'M=D',
+            # LCL = SP
+            '@SP',
+            'D=M',
+            '@LCL',
             'M=D',
+            # goto function
+            f'@{function_name}',
+            '0;JMP',
+            # return address label
+            f'({return_address})',
         ]
-    elif segment == 'static':
+
+    def return_(self) -> list[str]:
+        """translate a return command into one or more asm lines"""
+
+        if self.settings.shared_runtime:
+            return [
+                '@$RETURN',
+                '0;JMP',
+            ]
+
+        return return_body()
+
+    def compare(self, op:Literal['LT', 'GT', 'EQ']) -> list[str]:
+        """compare the top two values on the stack according to the given operator (LT, GT, EQ). 0 if false, -1 if true"""
+        counter = self.get_next_counter()
+
+        if self.settings.shared_runtime:
+            return_address = self.unique_label('ret', counter)
+            return [
+                f'@{return_address}',
+                'D=A',
+                f'@${op}',
+                '0;JMP',
+                f'({return_address})',
+            ]
+
+        true_label, end_label = self.unique_label(op, counter), self.unique_label('END', counter)
         return [
             *pop_D(),
-            f'@{basename}.{index}',
+            'A=A-1',
+            'D=M-D',
+            f'@{true_label}',
+            f'D;J{op}',
+            '@SP',
+            'A=M-1',
+            'M=0',
+            f'@{end_label}',
+            '0;JMP',
+            f'({true_label})',
+            '@SP',
+            'A=M-1',
+            'M=-1',
+            f'({end_label})',
+        ]
+
+    def eq(self) -> list[str]:
+        """compare the top two values on the stack for equality. 0 if false, -1 if true"""
+        return self.compare('EQ')
+
+    def gt(self) -> list[str]:
+        """compare the top two values on the stack for greater than. 0 if false, -1 if true"""
+        return self.compare('GT')
+
+    def lt(self) -> list[str]:
+        """compare the top two values on the stack for less than. 0 if false, -1 if true"""
+        return self.compare('LT')
+
+
+    ################## fused commands from the optimizer ##################
+
+    def load_D(self, segment:int, index:int) -> list[str]:
+        """load segment[index] into D"""
+        if segment == CONSTANT:
+            return constant_D(index)
+        if segment in segment_pointers:
+            varname = segment_pointers[segment]
+            if index == 0:
+                return [f'@{varname}', 'A=M', 'D=M']
+            if index == 1:
+                return [f'@{varname}', 'A=M+1', 'D=M']
+            return [f'@{varname}', 'D=M', f'@{index}', 'A=D+A', 'D=M']
+        return [f'@{self.fixed_address(segment, index)}', 'D=M']
+
+    def store_D(self, segment:int, index:int) -> tuple[list[str], list[str]]:
+        """
+        store D into segment[index]. Returns the asm to run before D is loaded (computing the target address into R13,
+        only needed for larger offsets into pointer-based segments) and the asm that does the store
+        """
+        assert segment != CONSTANT, "Cannot store to the constant segment"
+        if segment in segment_pointers:
+            varname = segment_pointers[segment]
+            if index <= 5:
+                return [], [f'@{varname}', 'A=M', *(['A=A+1'] * index), 'M=D']
+            return [f'@{varname}', 'D=M', f'@{index}', 'D=D+A', '@R13', 'M=D'], ['@R13', 'A=M', 'M=D']
+        return [], [f'@{self.fixed_address(segment, index)}', 'M=D']
+
+    def fixed_address(self, segment:int, index:int) -> str:
+        """address (or symbol) of an entry of the temp, pointer or static segments"""
+        if segment == TEMP:
+            assert index in range(8), f"Temp index must be in range 0-7, got {index}"
+            return f'{5+index}'
+        if segment == POINTER:
+            assert index in (0, 1), f"Pointer index must be 0 or 1, got {index}"
+            return f'{3+index}'
+        if segment == STATIC:
+            return f'{self.name}.{index}'
+        raise ValueError(f"Unknown segment: {segment}")
+
+    def move(self, command:VMCommand) -> list[str]:
+        """copy from_segment[from_index] to segment[index] directly (push then pop)"""
+        setup, store = self.store_D(command.segment, command.index)
+        return [
+            *setup,
+            *self.load_D(command.from_segment, command.from_index),
+            *store,
+        ]
+
+    def array_store(self, command:VMCommand) -> list[str]:
+        """pop an address into THAT and store from_segment[from_index] there (pop pointer 1, push from, pop that 0)"""
+        return [
+            '@SP',
+            'AM=M-1',
+            'D=M',
+            '@THAT',
+            'M=D',
+            *self.load_D(command.from_segment, command.from_index),
+            '@THAT',
+            'A=M',
             'M=D',
         ]
-    elif segment == 'pointer':
-        assert index in (0, 1), f"Invalid pop command: \"{line}\". Pointer index must be 0 or 1"
+
+    def not_if_goto(self, command:VMCommand) -> list[str]:
+        """pop the top value and jump if its complement is nonzero, i.e. if it isn't -1 (not, if-goto)"""
         return [
-            *pop_D(),
-            f'@{3+index}',
+            '@SP',
+            'AM=M-1',
+            'D=M+1',
+            f'@{self.get_current_function_name()}${command.name}',
+            'D;JNE',
+        ]
+
+    def compare_branch(self, command:VMCommand) -> list[str]:
+        """pop the top two values and jump if they compare according to the command's condition (eq/gt/lt, [not,] if-goto)"""
+        return [
+            '@SP',
+            'AM=M-1',
+            'D=M',
+            'A=A-1',
+            'D=M-D',
+            '@SP',
+            'M=M-1',
+            f'@{self.get_current_function_name()}${command.name}',
+            f'D;{compare_branch_jumps[command.op]}',
+        ]
+
+
+    ################## top of stack caching ##################
+
+    def build_cached_handlers(self) -> dict[int, Callable[[VMCommand], Sequence[str]]]:
+        """the method translating each opcode when top of stack caching is on"""
+
+        # labels start a new basic block, and the commands without a cached form expect the whole stack in RAM,
+        # so by default the top of the stack is spilled and the command translated as usual
+        handlers = {op: self.spill_before(handler) for op, handler in self.command_handlers.items()}
+        handlers.update({
+            PUSH: self.cached_push,
+            POP: self.cached_pop,
+            NEG: self.cached_unary,
+            NOT: self.cached_unary,
+            IF_GOTO: self.cached_if_goto,
+            NOT_IF_GOTO: self.cached_not_if_goto,
+            ARRAY_LOAD: self.cached_array_load,
+            ARRAY_STORE: self.cached_array_store,
+            **{op: self.cached_binary for op in cached_binary_ops},
+            **{op: self.cached_compare_branch for op in compare_branch_jumps},
+        })
+        # the shared routines expect the whole stack in RAM
+        if not self.settings.shared_runtime:
+            handlers.update({EQ: self.cached_compare, GT: self.cached_compare, LT: self.cached_compare, RETURN: self.cached_return})
+        return handlers
+
+    def spill_before(self, handler:Callable[[VMCommand], Sequence[str]]) -> Callable[[VMCommand], list[str]]:
+        """handler that spills the top of the stack, then translates the command with the given handler"""
+        return lambda command: [*self.spill(), *handler(command)]
+
+    def cached_push(self, command:VMCommand) -> list[str]:
+        """spill the cached value, and load the pushed one into D"""
+        code = [*self.spill(), *self.load_D(command.segment, command.index)]
+        self.tos_cached = True
+        return code
+
+    def cached_pop(self, command:VMCommand) -> list[str]:
+        """store the cached value (or the top of the stack, if nothing is cached)"""
+        if not self.tos_cached:
+            return self.pop(command)
+        self.tos_cached = False
+        return self.store_cached(command.segment, command.index)
+
+    def cached_binary(self, command:VMCommand) -> list[str]:
+        """combine the cached value with the one below it on the stack, leaving the result in D"""
+        code = [*self.fill(), '@SP', 'AM=M-1', f'D={cached_binary_ops[command.op]}']
+        self.tos_cached = True
+        return code
+
+    def cached_unary(self, command:VMCommand) -> Sequence[str]:
+        """negate or complement the cached value in D (or the top of the stack, if nothing is cached)"""
+        if not self.tos_cached:
+            return arithmetic_templates[command.op]
+        return ['D=-D' if command.op == NEG else 'D=!D']
+
+    def cached_compare(self, command:VMCommand) -> list[str]:
+        """compare the cached value with the one below it on the stack, leaving -1 (true) or 0 (false) in D"""
+        code = [*self.fill(), *self.compare_cached(commands_jumps[command.op])]
+        self.tos_cached = True
+        return code
+
+    def cached_if_goto(self, command:VMCommand) -> list[str]:
+        """jump if the cached value is nonzero"""
+        code = [*self.fill(), f'@{self.get_current_function_name()}${command.name}', 'D;JNE']
+        self.tos_cached = False
+        return code
+
+    def cached_return(self, command:VMCommand) -> list[str]:
+        """return with the cached value (or the top of the stack, if nothing is cached) as the return value"""
+        code = return_body(value_in_D=self.tos_cached)
+        self.tos_cached = False
+        return code
+
+    def cached_not_if_goto(self, command:VMCommand) -> list[str]:
+        """jump if the cached value isn't -1 (not, if-goto)"""
+        code = [*self.fill(), 'D=D+1', f'@{self.get_current_function_name()}${command.name}', 'D;JNE']
+        self.tos_cached = False
+        return code
+
+    def cached_compare_branch(self, command:VMCommand) -> list[str]:
+        """compare the cached value with the one below it and jump according to the command's condition"""
+        code = [*self.fill(), '@SP', 'AM=M-1', 'D=M-D', f'@{self.get_current_function_name()}${command.name}', f'D;{compare_branch_jumps[command.op]}']
+        self.tos_cached = False
+        return code
+
+    def cached_array_load(self, command:VMCommand) -> list[str]:
+        """replace the cached address with the value at address + index, setting THAT"""
+        index = command.index
+        code = [*self.fill(), '@THAT', 'M=D', *(['A=D'] if index == 0 else [f'@{index}', 'A=D+A']), 'D=M']
+        self.tos_cached = True
+        return code
+
+    def cached_array_store(self, command:VMCommand) -> list[str]:
+        """pop the cached address into THAT and store from_segment[from_index] there"""
+        code = [*self.fill(), '@THAT', 'M=D', *self.load_D(command.from_segment, command.from_index), '@THAT', 'A=M', 'M=D']
+        self.tos_cached = False
+        return code
+
+    def spill(self) -> list[str]:
+        """if the top of the stack is cached in D, write it to the stack"""
+        if not self.tos_cached:
+            return []
+        self.tos_cached = False
+        return [
+            '@SP',
+            'M=M+1',
+            'A=M-1',
             'M=D',
         ]
-    else:
-        raise ValueError(f"Invalid pop command: \"{line}\". Unknown segment: \"{segment}\"")
+
+    def fill(self) -> list[str]:
+        """if the top of the stack isn't cached in D, pop it into D"""
+        if self.tos_cached:
+            return []
+        self.tos_cached = True
+        return [
+            '@SP',
+            'AM=M-1',
+            'D=M',
+        ]
+
+    def store_cached(self, segment:int, index:int) -> list[str]:
+        """store the cached top of the stack (in D) to segment[index]"""
+        if segment in segment_pointers and index > 10:
+            # too far to step to from the base address, so stash the value while computing the address
+            return [
+                '@R14',
+                'M=D',
+                f'@{segment_pointers[segment]}',
+                'D=M',
+                f'@{index}',
+                'D=D+A',
+                '@R13',
+                'M=D',
+                '@R14',
+                'D=M',
+                '@R13',
+                'A=M',
+                'M=D',
+            ]
+        if segment in segment_pointers:
+            return [f'@{segment_pointers[segment]}', 'A=M', *(['A=A+1'] * index), 'M=D']
+        _, store = self.store_D(segment, index)
+        return store
+
+    def compare_cached(self, jump:str) -> list[str]:
+        """compare the value below the top of the stack with the cached top (in D), leaving -1 (true) or 0 (false) in D"""
+        counter = self.get_next_counter()
+        true_label, end_label = self.unique_label('TRUE', counter), self.unique_label('END', counter)
+        return [
+            '@SP',
+            'AM=M-1',
+            'D=M-D',
+            f'@{true_label}',
+            f'D;{jump}',
+            'D=0',
+            f'@{end_label}',
+            '0;JMP',
+            f'({true_label})',
+            'D=-1',
+            f'({end_label})',
+        ]
+
 
 
+################## code shared by every translator ##################
+
 def push_D() -> list[str]:
     """push the value in D to the stack"""
     return [
@@ -293,6 +1043,15 @@ def push_constant(value:int) -> list[str]:
         *push_D(),
     ]
 
+def push_zero() -> list[str]:
+    """push 0 to the stack, without touching D"""
+    return [
+        '@SP',
+        'M=M+1',
+        'A=M-1',
+        'M=0',
+    ]
+
 def push_from_variable(varname:str, offset:int=0) -> list[str]:
     """push the value of the given variable + (optional) offset to the stack"""
     return [
@@ -335,117 +1094,12 @@ def pop_named_variable(varname:Literal['SP', 'LCL', 'ARG', 'THIS', 'THAT']) -> l
         'M=D',
     ]
 
-
-
-def label(line:str) -> list[str]:
-    """translate a label command into one or more asm lines"""
-
-    # verify the command starts with label and has a labelname
-    assert line.startswith('label'), f"Invalid label command: \"{line}\". expected `label <labelname>`"
-
-    # separate out the labelname
-    _, label_name = line.split()
-
-    return [
-        f'({get_current_function_name()}${label_name})',
-    ]
-
-def goto(line:str) -> list[str]:
-    """translate a goto command into one or more asm lines"""
-
-    # verify the command starts with goto and has a labelname
-    assert line.startswith('goto'), f"Invalid goto command: \"{line}\". expected `goto <labelname>`"
-
-    # separate out the labelname
-    _, label_name = line.split()
-
-    return [
-        f'@{get_current_function_name()}${label_name}',
-        '0;JMP',
-    ]
-
-def if_goto(line:str) -> list[str]:
-    """translate an if-goto command into one or more asm lines"""
-
-    # verify the command starts with if-goto and has a labelname
-    assert line.startswith('if-goto'), f"Invalid if-goto command: \"{line}\". expected `if-goto <labelname>`"
-
-    # separate out the labelname
-    _, label_name = line.split()
-
-    return [
-        *pop_D(),
-        f'@{get_current_function_name()}${label_name}',
-        'D;JNE',
-    ]
-
-def function_(line:str) -> list[str]:
-    """translate a function command into one or more asm lines"""
-
-    # verify the command starts with function and has a function name and local variable count
-    assert line.startswith('function'), f"Invalid function command: \"{line}\". expected `function <functionname> <localcount>`"
-
-    # separate out the function name and local variable count
-    _, function_name, local_count = line.split()
-    local_count = int(local_count)
-    
-    # save the function name globally for use in label/goto/if-goto commands
-    set_current_function_name(function_name)
-
-    # return the asm lines
-    return [
-        f'({function_name})',
-        *(push_constant(0) * local_count),
-    ]
-
-def call(line:str) -> list[str]:
-    """translate a call command into one or more asm lines"""
-
-    # verify the command starts with call and has a function name and argument count
-    assert line.startswith('call'), f"Invalid call command: \"{line}\". expected `call <functionname> <argcount>`"
-
-    # separate out the function name and argument count
-    _, function_name, arg_count = line.split()
-    arg_count = int(arg_count)
-
-    # generate a unique return address label
-    return_address = f'return_{get_next_counter()}'
-
-    # push the return address
-    return [
-        *push_constant(return_address),
-        *push_named_variable('LCL'),
-        *push_named_variable('ARG'),
-        *push_named_variable('THIS'),
-        *push_named_variable('THAT'),
-        # ARG = SP - arg_count - 5
-        '@SP',
-        'D=M',
-        f'@{arg_count}',
-        'D=D-A',
-        '@5',
-        'D=D-A',
-        '@ARG',
-        'M=D',
-        # LCL = SP
-        '@SP',
-        'D=M',
-        '@LCL',
-        'M=D',
-        # goto function
-        f'@{function_name}',
-        '0;JMP',
-        # return address label
-        f'({return_address})',
-    ]
-
-
-def return_() -> list[str]:
-    """translate a return command into one or more asm lines"""
+def return_body(value_in_D:bool=False) -> list[str]:
+    """asm lines that return from the current function. The return value is popped from the stack, unless it's already in D"""
 
     return [
         # save the return value retVal = pop()
-        *pop_D(),
+        *([] if value_in_D else pop_D()),
         '@retVal',
         'M=D',
 
@@ -488,7 +1142,6 @@ def return_() -> list[str]:
         '0;JMP',
     ]
 
-
 def add() -> list[str]:
     """add the top two values on the stack"""
     return [
@@ -513,39 +1166,6 @@ def neg() -> list[str]:
         'M=-M',
     ]
 
-def compare(op:Literal['LT', 'GT', 'EQ']) -> list[str]:
-    """compare the top two values on the stack according to the given operator (LT, GT, EQ). 0 if false, -1 if true"""
-    counter = get_next_counter()
-    return [
-        *pop_D(),
-        'A=A-1',
-        'D=M-D',
-        f'@{op}_{counter}',
-        f'D;J{op}',
-        '@SP',
-        'A=M-1',
-        'M=0',
-        f'@END_{counter}',
-        '0;JMP',
-        f'({op}_{counter})',
-        '@SP',
-        'A=M-1',
-        'M=-1',
-        f'(END_{counter})',
-    ]
-
-def eq() -> list[str]:
-    """compare the top two values on the stack for equality. 0 if false, -1 if true"""
-    return compare('EQ')
-
-def gt() -> list[str]:
-    """compare the top two values on the stack for greater than. 0 if false, -1 if true"""
-    return compare('GT')
-
-def lt() -> list[str]:
-    """compare the top two values on the stack for less than. 0 if false, -1 if true"""
-    return compare('LT')
-
 def and_() -> list[str]:
     """bitwise and the top two values on the stack"""
     return [
@@ -570,7 +1190,197 @@ def not_() -> list[str]:
         'M=!M',
     ]
 
+def shared_runtime(settings:Settings=Settings()) -> list[str]:
+    """the shared call/return/compare routines, if the settings use the shared runtime (otherwise nothing)"""
+    if not settings.shared_runtime:
+        return []
+
+    code = [
+        '// shared runtime',
+        *call_routine(),
+        *return_routine(),
+        *compare_routine('EQ'),
+        *compare_routine('GT'),
+        *compare_routine('LT'),
+        *(locals_routine() if uses_locals_routine(settings) else []),
+        '',
+    ]
+    return without_comments(code) if settings.strip_comments else code
+
+def call_routine() -> list[str]:
+    """shared call routine. Expects the return address in D, arg_count + 5 in R13 and the function address in R14"""
+    return [
+        '($CALL)',
+        *push_D(),
+        *push_named_variable('LCL'),
+        *push_named_variable('ARG'),
+        *push_named_variable('THIS'),
+        *push_named_variable('THAT'),
+        # ARG = SP - (arg_count + 5)
+        '@SP',
+        'D=M',
+        '@R13',
+        'D=D-M',
+        '@ARG',
+        'M=D',
+        # LCL = SP
+        '@SP',
+        'D=M',
+        '@LCL',
+        'M=D',
+        # goto function
+        '@R14',
+        'A=M',
+        '0;JMP',
+    ]
+
+def return_routine() -> list[str]:
+    """shared return routine"""
+    return [
+        '($RETURN)',
+        *return_body(),
+    ]
+
+def compare_routine(op:Literal['LT', 'GT', 'EQ']) -> list[str]:
+    """shared compare routine for the given operator. Expects the return address in D"""
+    return [
+        f'(${op})',
+        '@R15',
+        'M=D',
+        *pop_D(),
+        'A=A-1',
+        'D=M-D',
+        # assume true, and overwrite with false if the comparison fails
+        'M=-1',
+        f'@${op}_TRUE',
+        f'D;J{op}',
+        '@SP',
+        'A=M-1',
+        'M=0',
+        f'(${op}_TRUE)',
+        '@R15',
+        'A=M',
+        '0;JMP',
+    ]
+
+
+def locals_routine() -> list[str]:
+    """
+    shared routine pushing 0 for the locals of a function. It has an entry point for each local count up to
+    shared_locals_max ($LOCALS_1, $LOCALS_2, ...), each falling through into the next smaller. Expects the return address in D
+    """
+    code = []
+    for local_count in range(shared_locals_max, 0, -1):
+        code.extend([f'($LOCALS_{local_count})', *push_zero()])
+    return [*code, 'A=D', '0;JMP']
+
+
+
+################## function prologue cost model ##################
+
+# largest local count the shared $LOCALS routine has an entry point for
+shared_locals_max = 8
+
+# weights of a ROM word and of a cycle in the cost of code at each optimization level. A function's prologue runs on
+# every call, so even at 'balanced' a word is only worth a few cycles
+opt_level_weights = {'speed': (1, 100), 'balanced': (4, 1), 'size': (100, 1)}
+
+def prologue_options(local_count:int, settings:Settings=Settings()) -> dict[str, tuple[int, int]]:
+    """(ROM words, cycles) of each way the settings allow to push a 0 for each of local_count (at least 1) locals"""
+    options = {
+        # push_zero() for a single local, otherwise zero them in place and move SP once
+        'unrolled': (4, 4) if local_count == 1 else (2 * local_count + 4, 2 * local_count + 4),
+        # push_zero() in a loop counting D down
+        'loop': (8, 6 * local_count + 2),
+    }
+    if settings.shared_runtime and local_count <= shared_locals_max:
+        # jump into the $LOCALS routine, which does push_zero() local_count times, then jumps back
+        options['shared'] = (4, 4 * local_count + 6)
+    return options
+
+def choose_prologue(local_count:int, settings:Settings=Settings()) -> str:
+    """the cheapest way to initialise local_count (at least 1) locals at the settings' optimization level. Ties go to the first option"""
+    word_weight, cycle_weight = opt_level_weights[settings.opt_level]
+    options = prologue_options(local_count, settings)
+    return min(options, key=lambda option: options[option][0] * word_weight + options[option][1] * cycle_weight)
+
+def uses_locals_routine(settings:Settings=Settings()) -> bool:
+    """whether functions may be translated into jumps to the $LOCALS routine with these settings, so the program needs it"""
+    return any(choose_prologue(local_count, settings) == 'shared' for local_count in range(1, shared_locals_max + 1))
+
+
+
+################## tables and helpers for fused commands and top of stack caching ##################
+
+# base address variable of each pointer-based segment
+segment_pointers = {LOCAL: 'LCL', ARGUMENT: 'ARG', THIS: 'THIS', THAT: 'THAT'}
+
+def constant_D(value:int) -> list[str]:
+    """load a (possibly negative) constant into D"""
+    if value in (-1, 0, 1):
+        return [f'D={value}']
+    if value < 0:
+        return [f'@{~value}', 'D=!A']
+    return [f'@{value}', 'D=A']
+
+def array_load(command:VMCommand) -> list[str]:
+    """replace the address on top of the stack with the value at address + index, setting THAT (pop pointer 1, push that index)"""
+    index = command.index
+    return [
+        '@SP',
+        'A=M-1',
+        'D=M',
+        '@THAT',
+        'M=D',
+        *(['A=D'] if index == 0 else [f'@{index}', 'A=D+A']),
+        'D=M',
+        '@SP',
+        'A=M-1',
+        'M=D',
+    ]
+
+# jump condition of each compare-and-branch command
+compare_branch_jumps = {IF_EQ_GOTO: 'JEQ', IF_NE_GOTO: 'JNE', IF_GT_GOTO: 'JGT', IF_LE_GOTO: 'JLE', IF_LT_GOTO: 'JLT', IF_GE_GOTO: 'JGE'}
+
+# comp of each binary op, with the top of the stack in D and the value below it in M
+cached_binary_ops = {ADD: 'D+M', SUB: 'M-D', AND: 'D&M', OR: 'D|M'}
+
+# jump condition of each comparison
+commands_jumps = {EQ: 'JEQ', GT: 'JGT', LT: 'JLT'}
+
+# code of the arithmetic commands without caching, built once. They have no parameters, so their code never changes
+arithmetic_templates = {ADD: tuple(add()), SUB: tuple(sub()), NEG: tuple(neg()), AND: tuple(and_()), OR: tuple(or_()), NOT: tuple(not_())}
+
+# commands whose code only depends on their own fields (and whether the top of the stack is cached), not on the
+# current function or label counter, so the code generated for one can be reused for every identical command
+memoized_ops = frozenset({PUSH, POP, ADD, SUB, NEG, AND, OR, NOT, RETURN, MOVE, ARRAY_LOAD, ARRAY_STORE})
+
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = ArgumentParser()
+    parser.add_argument('path', type=Path, help='Path to a .vm file or a directory of .vm files')
+    parser.add_argument('--shared-runtime', action='store_true', help='Jump to shared call/return/compare routines instead of inlining them (smaller, slightly slower)')
+    parser.add_argument('--optimize', action='store_true', help='Run the peephole optimizer over each file before translating it')
+    parser.add_argument('--cache-tos', action='store_true', help='Keep the top of the stack in D within basic blocks')
+    parser.add_argument('--remove-unused', action='store_true', help='Leave out functions that can\'t be reached from Sys.init, and report their sizes')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='Number of worker processes used to translate the files of a directory')
+    parser.add_argument('--stream', action='store_true', help='Translate and write out one command at a time, so memory use doesn\'t grow with the program')
+    parser.add_argument('--objects', action='store_true', help='Build a relocatable .hobj for each changed .vm file and link them into a .hack program (instead of writing the .asm)')
+    parser.add_argument('--hack', action='store_true', help='Encode the program straight into a .hack file instead of writing .asm to be assembled')
+    parser.add_argument('--listing', action='store_true', help='With --hack, also write the .asm as a listing')
+    parser.add_argument('--strip-comments', action='store_true', help='Release profile: leave the comments and blank lines out of the output')
+    parser.add_argument('--opt-level', choices=['speed', 'balanced', 'size'], default='speed', help='Favour fewer cycles or fewer ROM words where the code can trade one for the other')
+    args = parser.parse_args()
+
+    if args.stream and (args.remove_unused or args.jobs != 1 or args.objects):
+        parser.error('--stream can\'t be combined with --remove-unused, --jobs or --objects')
+    if args.objects and args.remove_unused:
+        parser.error('--objects can\'t be combined with --remove-unused')
+    if args.hack and (args.stream or args.objects):
+        parser.error('--hack can\'t be combined with --stream or --objects')
+    if args.listing and not args.hack:
+        parser.error('--listing needs --hack')
+
+    settings = Settings(shared_runtime=args.shared_runtime, optimize=args.optimize, cache_tos=args.cache_tos, strip_comments=args.strip_comments, opt_level=args.opt_level)
+    main(args.path, settings, args.remove_unused, args.jobs, args.stream, args.objects, args.hack, args.listing)
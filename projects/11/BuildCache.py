@@ -0,0 +1,96 @@
+from pathlib import Path
+import hashlib
+import json
+
+from utils import write_atomic
+
+
+# modules whose source determines the generated VM code. Any change to them invalidates every cache entry
+compiler_modules = ["JackTokenizer.py", "CompilationEngine.py", "SymbolTable.py", "VMWriter.py", "utils.py", "../08/VMCode.py"]
+
+
+def file_digest(path: Path) -> str | None:
+    """hash of a file's content, or None if it doesn't exist"""
+    return hashlib.sha256(path.read_bytes()).hexdigest() if path.exists() else None
+
+
+def compiler_version() -> str:
+    """hash of the compiler's own source code"""
+    digest = hashlib.sha256()
+    for name in compiler_modules:
+        digest.update((Path(__file__).parent / name).read_bytes())
+    return digest.hexdigest()
+
+
+class BuildCache:
+    """
+    persistent cache of compiled .vm outputs, stored in a .jackcache/ directory next to the sources.
+    Each output is keyed by a hash of the compiler version plus the source content. The manifest records
+    the key each .vm file in the directory was last generated from, along with a hash of the .vm as it was written,
+    so unchanged files can be skipped entirely. A .vm that has been edited, truncated or overwritten since doesn't match
+    its recorded hash, and is restored from the cache (or recompiled) instead of being trusted
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.dir = root / ".jackcache"
+        self.objects_dir = self.dir / "objects"
+        self.manifest_path = self.dir / "manifest.json"
+        self.version = compiler_version()
+
+        # source file name -> {"key": cache key, "output": hash of the .vm written}
+        manifest = json.loads(self.manifest_path.read_text()) if self.manifest_path.exists() else {}
+        self.manifest: dict[str, dict[str, str]] = {name: entry for name, entry in manifest.items() if isinstance(entry, dict)}
+        self.keys: dict[str, str] = {}  # keys computed this run, by source file name
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, source_path: Path) -> str:
+        digest = hashlib.sha256(self.version.encode())
+        digest.update(source_path.read_bytes())
+        self.keys[source_path.name] = digest.hexdigest()
+        return self.keys[source_path.name]
+
+    def restore(self, source_path: Path) -> bool:
+        """make sure the .vm for source_path is up to date without compiling. Returns False on a cache miss"""
+        key = self.key(source_path)
+        out_path = source_path.with_suffix(".vm")
+        object_path = self.objects_dir / f"{key}.vm"
+
+        entry = self.manifest.get(source_path.name)
+        if entry is not None and entry["key"] == key and entry["output"] == file_digest(out_path):
+            self.hits += 1
+            return True
+
+        if object_path.exists():
+            write_atomic(out_path, object_path.read_text())
+            self.manifest[source_path.name] = {"key": key, "output": file_digest(out_path)}
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        return False
+
+    def store(self, source_path: Path, vmcode: str) -> None:
+        """record freshly compiled output for source_path (whose key was computed by restore(), and whose .vm has been written)"""
+        key = self.keys[source_path.name]
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        write_atomic(self.objects_dir / f"{key}.vm", vmcode)
+        self.manifest[source_path.name] = {"key": key, "output": file_digest(source_path.with_suffix(".vm"))}
+
+    def save(self) -> None:
+        """write the manifest and drop cached outputs that no existing source file refers to anymore"""
+        self.manifest = {name: entry for name, entry in self.manifest.items() if (self.root / name).exists()}
+        self.dir.mkdir(exist_ok=True)
+        write_atomic(self.manifest_path, json.dumps(self.manifest, indent=4, sort_keys=True))
+
+        live = {f"{entry['key']}.vm" for entry in self.manifest.values()}
+        if self.objects_dir.exists():
+            for object_path in self.objects_dir.iterdir():
+                if object_path.name not in live:
+                    object_path.unlink()
+
+    def __str__(self) -> str:
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0
+        return f"build cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)"
@@ -1,55 +1,51 @@
-from utils import Ref
-from JackTokenizer import Token
+from typing import Iterable
+
+from JackTokenizer import Token, TokenStream
 from SymbolTable import SymbolTable
 from VMWriter import VMWriter
 
-##
-import pdb
+
+def compile(tokens: Iterable[Token]) -> str:
+    return compile_vm(tokens).__str__()
 
 
-def compile(tokens: list[Token]) -> str:
-    tokens_ref = Ref(tokens)
+def compile_vm(tokens: Iterable[Token]) -> VMWriter:
+    """compile a class into its list of vm commands"""
+    stream = TokenStream(tokens)
     writer = VMWriter()
 
-    if not compile_class(tokens_ref, writer):
-        raise ValueError(f"Invalid program. Remaining tokens: {tokens_ref.value}")
+    if not compile_class(stream, writer):
+        raise ValueError(f"Invalid program. Remaining tokens: {stream.remaining()}")
 
-    return writer.__str__()
+    return writer
 
 
-def compile_class(tokens_ref: Ref[list[Token]], writer: VMWriter) -> bool:
+def compile_class(tokens: TokenStream, writer: VMWriter) -> bool:
     """'class' className '{' classVarDec* subroutineDec* '}'"""
 
     # 'class'
-    if tokens_ref.value[0].type != "keyword" or tokens_ref.value[0].value != "class":
+    if tokens.peek().type != "keyword" or tokens.peek().value != "class":
         return False
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.advance()
 
     class_symbols = SymbolTable()
 
     # className
-    if tokens_ref.value[0].type != "identifier":
-        raise ValueError(f"Invalid program. Expected className, got {tokens_ref.value[0]}")
-    class_name = tokens_ref.value[0].value
-    tokens_ref.value = tokens_ref.value[1:]
+    class_name = tokens.expect("identifier", description="className").value
 
     # '{'
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != "{":
-        raise ValueError(f"Invalid program. Expected '{{', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", "{")
 
     # classVarDec*
-    while compile_class_var_dec(tokens_ref, class_symbols):
+    while compile_class_var_dec(tokens, class_symbols):
         ...
 
     # subroutineDec*
-    while compile_subroutine(tokens_ref, class_name, class_symbols, writer):
+    while compile_subroutine(tokens, class_name, class_symbols, writer):
         ...
 
     # '}'
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != "}":
-        raise ValueError(f"Invalid program. Expected '}}', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", "}")
 
     return True
 
@@ -63,57 +59,45 @@ def is_type(token: Token) -> bool:
     return False
 
 
-def compile_class_var_dec(tokens_ref: Ref[list[Token]], class_symbols: SymbolTable) -> bool:
+def compile_class_var_dec(tokens: TokenStream, class_symbols: SymbolTable) -> bool:
     """('static' | 'field') type varName (',' varName)* ';'"""
 
     # ('static' | 'field')
-    if tokens_ref.value[0].type != "keyword" or tokens_ref.value[0].value not in ["static", "field"]:
+    if tokens.peek().type != "keyword" or tokens.peek().value not in ["static", "field"]:
         return False
-    kind = tokens_ref.value[0].value
-    tokens_ref.value = tokens_ref.value[1:]
+    kind = tokens.advance().value
 
     # type
-    if not is_type(tokens_ref.value[0]):
-        raise ValueError(f"Invalid program. Expected type, got {tokens_ref.value[0]}")
-    type = tokens_ref.value[0].value
-    tokens_ref.value = tokens_ref.value[1:]
+    if not is_type(tokens.peek()):
+        raise ValueError(f"Invalid program. Expected type, got {tokens.peek()}")
+    type = tokens.advance().value
 
     # varName
-    if tokens_ref.value[0].type != "identifier":
-        raise ValueError(f"Invalid program. Expected varName, got {tokens_ref.value[0]}")
-    name = tokens_ref.value[0].value
-    tokens_ref.value = tokens_ref.value[1:]
+    name = tokens.expect("identifier", description="varName").value
 
     # insert the first variable
     class_symbols.insert(name, type, kind)
 
     # (',' varName)*
-    while tokens_ref.value[0].type == "symbol" and tokens_ref.value[0].value == ",":
-        tokens_ref.value = tokens_ref.value[1:]
+    while tokens.peek().type == "symbol" and tokens.peek().value == ",":
+        tokens.advance()
 
-        if tokens_ref.value[0].type != "identifier":
-            raise ValueError(f"Invalid program. Expected varName, got {tokens_ref.value[0]}")
-
-        name = tokens_ref.value[0].value
+        name = tokens.expect("identifier", description="varName").value
         class_symbols.insert(name, type, kind)
-        tokens_ref.value = tokens_ref.value[1:]
 
     # ';'
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != ";":
-        raise ValueError(f"Invalid program. Expected ';', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", ";")
 
     return True
 
 
-def compile_subroutine(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: SymbolTable, writer: VMWriter) -> bool:
+def compile_subroutine(tokens: TokenStream, class_name: str, class_symbols: SymbolTable, writer: VMWriter) -> bool:
     """('constructor' | 'function' | 'method') ('void' | type) subroutineName '(' parameterList ')' '{' varDec* statements '}'"""
 
     # ('constructor' | 'function' | 'method')
-    if tokens_ref.value[0].type != "keyword" or tokens_ref.value[0].value not in ["constructor", "function", "method"]:
+    if tokens.peek().type != "keyword" or tokens.peek().value not in ["constructor", "function", "method"]:
         return False
-    subroutine_type = tokens_ref.value[0].value
-    tokens_ref.value = tokens_ref.value[1:]
+    subroutine_type = tokens.advance().value
 
     # set up the symbol table for this subroutine
     subroutine_symbols = SymbolTable()
@@ -122,37 +106,28 @@ def compile_subroutine(tokens_ref: Ref[list[Token]], class_name: str, class_symb
         subroutine_symbols.insert("this", class_name, "argument")
 
     # ('void' | type)
-    if not is_type(tokens_ref.value[0]) and tokens_ref.value[0].type != "keyword" and tokens_ref.value[0].value != "void":
-        raise ValueError(f"Invalid program. Expected type or 'void', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    if not is_type(tokens.peek()) and tokens.peek().type != "keyword" and tokens.peek().value != "void":
+        raise ValueError(f"Invalid program. Expected type or 'void', got {tokens.peek()}")
+    tokens.advance()
 
     # subroutineName
-    if tokens_ref.value[0].type != "identifier":
-        raise ValueError(f"Invalid program. Expected subroutineName, got {tokens_ref.value[0]}")
-    subroutine_name = tokens_ref.value[0].value
-    tokens_ref.value = tokens_ref.value[1:]
+    subroutine_name = tokens.expect("identifier", description="subroutineName").value
 
     # '('
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != "(":
-        raise ValueError(f"Invalid program. Expected '(', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", "(")
 
     # parameterList
-    if not compile_parameter_list(tokens_ref, subroutine_symbols):
-        raise ValueError(f"Invalid program. Expected parameterList, got {tokens_ref.value[0]}")
+    if not compile_parameter_list(tokens, subroutine_symbols):
+        raise ValueError(f"Invalid program. Expected parameterList, got {tokens.peek()}")
 
     # ')'
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != ")":
-        raise ValueError(f"Invalid program. Expected ')', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", ")")
 
     # '{'
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != "{":
-        raise ValueError(f"Invalid program. Expected '{{', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", "{")
 
     # varDec*
-    while compile_var_dec(tokens_ref, subroutine_symbols):
+    while compile_var_dec(tokens, subroutine_symbols):
         ...
 
     # now that we know how many locals there are, we can create the function entry label
@@ -168,131 +143,110 @@ def compile_subroutine(tokens_ref: Ref[list[Token]], class_name: str, class_symb
         writer.write_pop("pointer", 0)
 
     # statements
-    if not compile_statements(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
-        raise ValueError(f"Invalid program. Expected statements, got {tokens_ref.value[0]}")
+    if not compile_statements(tokens, class_name, class_symbols, subroutine_symbols, writer):
+        raise ValueError(f"Invalid program. Expected statements, got {tokens.peek()}")
 
     # '}'
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != "}":
-        raise ValueError(f"Invalid program. Expected '}}', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", "}")
 
     return True
 
 
-def compile_parameter_list(tokens_ref: Ref[list[Token]], subroutine_symbols: SymbolTable) -> bool:
+def compile_parameter_list(tokens: TokenStream, subroutine_symbols: SymbolTable) -> bool:
     """((type varName) (',' type varName)*)?"""
     # ((type varName) (',' type varName)*)?
-    if tokens_ref.value[0].type not in ["keyword", "identifier"]:
+    if tokens.peek().type not in ["keyword", "identifier"]:
         return True  # empty parameter list
 
     # type
-    if not is_type(tokens_ref.value[0]):
-        raise ValueError(f"Invalid program. Expected type, got {tokens_ref.value[0]}")
-    type = tokens_ref.value[0].value
-    tokens_ref.value = tokens_ref.value[1:]
+    if not is_type(tokens.peek()):
+        raise ValueError(f"Invalid program. Expected type, got {tokens.peek()}")
+    type = tokens.advance().value
 
     # varName
-    if tokens_ref.value[0].type != "identifier":
-        raise ValueError(f"Invalid program. Expected varName, got {tokens_ref.value[0]}")
-    name = tokens_ref.value[0].value
-    tokens_ref.value = tokens_ref.value[1:]
+    name = tokens.expect("identifier", description="varName").value
 
     # insert the first variable
     subroutine_symbols.insert(name, type, "argument")
 
     # (',' type varName)*
-    while tokens_ref.value[0].type == "symbol" and tokens_ref.value[0].value == ",":
-        tokens_ref.value = tokens_ref.value[1:]
+    while tokens.peek().type == "symbol" and tokens.peek().value == ",":
+        tokens.advance()
 
         # type
-        if not is_type(tokens_ref.value[0]):
-            raise ValueError(f"Invalid program. Expected type, got {tokens_ref.value[0]}")
-        type = tokens_ref.value[0].value
-        tokens_ref.value = tokens_ref.value[1:]
+        if not is_type(tokens.peek()):
+            raise ValueError(f"Invalid program. Expected type, got {tokens.peek()}")
+        type = tokens.advance().value
 
         # varName
-        if tokens_ref.value[0].type != "identifier":
-            raise ValueError(f"Invalid program. Expected varName, got {tokens_ref.value[0]}")
-        name = tokens_ref.value[0].value
-        tokens_ref.value = tokens_ref.value[1:]
+        name = tokens.expect("identifier", description="varName").value
 
         subroutine_symbols.insert(name, type, "argument")
 
     return True
 
 
-def compile_var_dec(tokens_ref: Ref[list[Token]], subroutine_symbols: SymbolTable) -> bool:
+def compile_var_dec(tokens: TokenStream, subroutine_symbols: SymbolTable) -> bool:
     """'var' type varName (',' varName)* ';'"""
 
     # 'var'
-    if tokens_ref.value[0].type != "keyword" or tokens_ref.value[0].value != "var":
+    if tokens.peek().type != "keyword" or tokens.peek().value != "var":
         return False
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.advance()
 
     # type
-    if not is_type(tokens_ref.value[0]):
-        raise ValueError(f"Invalid program. Expected type, got {tokens_ref.value[0]}")
-    type = tokens_ref.value[0].value
-    tokens_ref.value = tokens_ref.value[1:]
+    if not is_type(tokens.peek()):
+        raise ValueError(f"Invalid program. Expected type, got {tokens.peek()}")
+    type = tokens.advance().value
 
     # varName
-    if tokens_ref.value[0].type != "identifier":
-        raise ValueError(f"Invalid program. Expected varName, got {tokens_ref.value[0]}")
-    name = tokens_ref.value[0].value
-    tokens_ref.value = tokens_ref.value[1:]
+    name = tokens.expect("identifier", description="varName").value
 
     # insert the first variable
     subroutine_symbols.insert(name, type, "local")
 
     # (',' varName)*
-    while tokens_ref.value[0].type == "symbol" and tokens_ref.value[0].value == ",":
-        tokens_ref.value = tokens_ref.value[1:]
+    while tokens.peek().type == "symbol" and tokens.peek().value == ",":
+        tokens.advance()
 
-        if tokens_ref.value[0].type != "identifier":
-            raise ValueError(f"Invalid program. Expected varName, got {tokens_ref.value[0]}")
-        name = tokens_ref.value[0].value
-        tokens_ref.value = tokens_ref.value[1:]
+        name = tokens.expect("identifier", description="varName").value
 
         subroutine_symbols.insert(name, type, "local")
 
     # ';'
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != ";":
-        raise ValueError(f"Invalid program. Expected ';', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", ";")
 
     return True
 
 
-def compile_statements(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
+def compile_statements(tokens: TokenStream, class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
     """statement*"""
 
     # statement*
-    while compile_do(tokens_ref, class_name, class_symbols, subroutine_symbols, writer) or \
-            compile_let(tokens_ref, class_name, class_symbols, subroutine_symbols, writer) or \
-            compile_while(tokens_ref, class_name, class_symbols, subroutine_symbols, writer) or \
-            compile_return(tokens_ref, class_name, class_symbols, subroutine_symbols, writer) or \
-            compile_if(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
+    while compile_do(tokens, class_name, class_symbols, subroutine_symbols, writer) or \
+            compile_let(tokens, class_name, class_symbols, subroutine_symbols, writer) or \
+            compile_while(tokens, class_name, class_symbols, subroutine_symbols, writer) or \
+            compile_return(tokens, class_name, class_symbols, subroutine_symbols, writer) or \
+            compile_if(tokens, class_name, class_symbols, subroutine_symbols, writer):
         ...
 
     return True
 
 
-def compile_do(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
+def compile_do(tokens: TokenStream, class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
     """'do' subroutineCall ';'"""
 
     # 'do'
-    if tokens_ref.value[0].type != "keyword" or tokens_ref.value[0].value != "do":
+    if tokens.peek().type != "keyword" or tokens.peek().value != "do":
         return False
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.advance()
 
     # subroutineCall
-    if not compile_subroutine_call(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
-        raise ValueError(f"Invalid program. Expected subroutineCall, got {tokens_ref.value[0]}")
+    if not compile_subroutine_call(tokens, class_name, class_symbols, subroutine_symbols, writer):
+        raise ValueError(f"Invalid program. Expected subroutineCall, got {tokens.peek()}")
 
     # ';'
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != ";":
-        raise ValueError(f"Invalid program. Expected ';', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", ";")
 
     # throw away the return value
     writer.write_pop("temp", 0)
@@ -300,19 +254,16 @@ def compile_do(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: Sym
     return True
 
 
-def compile_let(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
+def compile_let(tokens: TokenStream, class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
     """'let' varName ('[' expression ']')? '=' expression ';'"""
 
     # 'let'
-    if tokens_ref.value[0].type != "keyword" or tokens_ref.value[0].value != "let":
+    if tokens.peek().type != "keyword" or tokens.peek().value != "let":
         return False
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.advance()
 
     # varName
-    if tokens_ref.value[0].type != "identifier":
-        raise ValueError(f"Invalid program. Expected varName, got {tokens_ref.value[0]}")
-    var_name = tokens_ref.value[0].value
-    tokens_ref.value = tokens_ref.value[1:]
+    var_name = tokens.expect("identifier", description="varName").value
 
     # get the symbol associated with this variable
     symbol = subroutine_symbols.get(var_name, None) or class_symbols.get(var_name, None)
@@ -320,36 +271,33 @@ def compile_let(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: Sy
 
     # ('[' expression ']')?
     is_array_assignment = False
-    if tokens_ref.value[0].type == "symbol" and tokens_ref.value[0].value == "[":
-        tokens_ref.value = tokens_ref.value[1:]
+    if tokens.peek().type == "symbol" and tokens.peek().value == "[":
+        tokens.advance()
         is_array_assignment = True
 
         # push the base address of the array
-        writer.write_push(symbol.kind, symbol.index)
+        if symbol.kind == "field":
+            writer.write_push("this", symbol.index)
+        else:
+            writer.write_push(symbol.kind, symbol.index)
 
-        if not compile_expression(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
-            raise ValueError(f"Invalid program. Expected expression, got {tokens_ref.value[0]}")
+        if not compile_expression(tokens, class_name, class_symbols, subroutine_symbols, writer):
+            raise ValueError(f"Invalid program. Expected expression, got {tokens.peek()}")
 
-        if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != "]":
-            raise ValueError(f"Invalid program. Expected ']', got {tokens_ref.value[0]}")
-        tokens_ref.value = tokens_ref.value[1:]
+        tokens.expect("symbol", "]")
 
         # add the index to the base address
         writer.write_arithmetic("add")
 
     # '='
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != "=":
-        raise ValueError(f"Invalid program. Expected '=', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", "=")
 
     # expression
-    if not compile_expression(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
-        raise ValueError(f"Invalid program. Expected expression, got {tokens_ref.value[0]}")
+    if not compile_expression(tokens, class_name, class_symbols, subroutine_symbols, writer):
+        raise ValueError(f"Invalid program. Expected expression, got {tokens.peek()}")
 
     # ';'
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != ";":
-        raise ValueError(f"Invalid program. Expected ';', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", ";")
 
     if is_array_assignment:
         writer.write_pop("temp", 0)
@@ -364,53 +312,41 @@ def compile_let(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: Sy
     return True
 
 
-while_label_count = 0
-
-
-def compile_while(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
+def compile_while(tokens: TokenStream, class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
     """'while' '(' expression ')' '{' statements '}'"""
 
     # 'while'
-    if tokens_ref.value[0].type != "keyword" or tokens_ref.value[0].value != "while":
+    if tokens.peek().type != "keyword" or tokens.peek().value != "while":
         return False
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.advance()
 
-    global while_label_count
-    L1 = f"WHILE{while_label_count}"
-    L2 = f"WHILE_END{while_label_count}"
-    while_label_count += 1
+    label_index = writer.next_label_index("while")
+    L1 = f"WHILE{label_index}"
+    L2 = f"WHILE_END{label_index}"
     writer.write_label(L1)
 
     # '('
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != "(":
-        raise ValueError(f"Invalid program. Expected '(', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", "(")
 
     # expression
-    if not compile_expression(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
-        raise ValueError(f"Invalid program. Expected expression, got {tokens_ref.value[0]}")
+    if not compile_expression(tokens, class_name, class_symbols, subroutine_symbols, writer):
+        raise ValueError(f"Invalid program. Expected expression, got {tokens.peek()}")
 
     # ')'
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != ")":
-        raise ValueError(f"Invalid program. Expected ')', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", ")")
 
     writer.write_arithmetic("not")
     writer.write_if(L2)
 
     # '{'
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != "{":
-        raise ValueError(f"Invalid program. Expected '{{', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", "{")
 
     # statements
-    if not compile_statements(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
-        raise ValueError(f"Invalid program. Expected statements, got {tokens_ref.value[0]}")
+    if not compile_statements(tokens, class_name, class_symbols, subroutine_symbols, writer):
+        raise ValueError(f"Invalid program. Expected statements, got {tokens.peek()}")
 
     # '}'
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != "}":
-        raise ValueError(f"Invalid program. Expected '}}', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", "}")
 
     writer.write_goto(L1)
     writer.write_label(L2)
@@ -418,115 +354,96 @@ def compile_while(tokens_ref: Ref[list[Token]], class_name: str, class_symbols:
     return True
 
 
-def compile_return(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
+def compile_return(tokens: TokenStream, class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
     """'return' expression? ';'"""
 
     # 'return'
-    if tokens_ref.value[0].type != "keyword" or tokens_ref.value[0].value != "return":
+    if tokens.peek().type != "keyword" or tokens.peek().value != "return":
         return False
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.advance()
 
     # expression?
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != ";":
-        if not compile_expression(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
-            raise ValueError(f"Invalid program. Expected expression, got {tokens_ref.value[0]}")
+    if tokens.peek().type != "symbol" or tokens.peek().value != ";":
+        if not compile_expression(tokens, class_name, class_symbols, subroutine_symbols, writer):
+            raise ValueError(f"Invalid program. Expected expression, got {tokens.peek()}")
     else:
         writer.write_push("constant", 0)
 
     # ';'
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != ";":
-        raise ValueError(f"Invalid program. Expected ';', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", ";")
 
     writer.write_return()
 
     return True
 
 
-if_label_count = 0
-
-
-def compile_if(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
+def compile_if(tokens: TokenStream, class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
     """'if' '(' expression ')' '{' statements '}' ('else' '{' statements '}')?"""
 
     # 'if'
-    if tokens_ref.value[0].type != "keyword" or tokens_ref.value[0].value != "if":
+    if tokens.peek().type != "keyword" or tokens.peek().value != "if":
         return False
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.advance()
 
-    global if_label_count
-    L1 = f"IF_FALSE{if_label_count}"
-    L2 = f"IF_END{if_label_count}"
-    if_label_count += 1
+    label_index = writer.next_label_index("if")
+    L1 = f"IF_FALSE{label_index}"
+    L2 = f"IF_END{label_index}"
 
     # '('
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != "(":
-        raise ValueError(f"Invalid program. Expected '(', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", "(")
 
     # expression
-    if not compile_expression(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
-        raise ValueError(f"Invalid program. Expected expression, got {tokens_ref.value[0]}")
+    if not compile_expression(tokens, class_name, class_symbols, subroutine_symbols, writer):
+        raise ValueError(f"Invalid program. Expected expression, got {tokens.peek()}")
 
     # ')'
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != ")":
-        raise ValueError(f"Invalid program. Expected ')', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", ")")
 
     writer.write_arithmetic("not")
     writer.write_if(L1)
 
     # '{'
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != "{":
-        raise ValueError(f"Invalid program. Expected '{{', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", "{")
 
     # statements
-    if not compile_statements(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
-        raise ValueError(f"Invalid program. Expected statements, got {tokens_ref.value[0]}")
+    if not compile_statements(tokens, class_name, class_symbols, subroutine_symbols, writer):
+        raise ValueError(f"Invalid program. Expected statements, got {tokens.peek()}")
 
     # '}'
-    if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != "}":
-        raise ValueError(f"Invalid program. Expected '}}', got {tokens_ref.value[0]}")
-    tokens_ref.value = tokens_ref.value[1:]
+    tokens.expect("symbol", "}")
 
     writer.write_goto(L2)
     writer.write_label(L1)
 
     # ('else' '{' statements '}')?
-    if tokens_ref.value[0].type == "keyword" and tokens_ref.value[0].value == "else":
-        tokens_ref.value = tokens_ref.value[1:]
+    if tokens.peek().type == "keyword" and tokens.peek().value == "else":
+        tokens.advance()
 
-        if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != "{":
-            raise ValueError(f"Invalid program. Expected '{{', got {tokens_ref.value[0]}")
-        tokens_ref.value = tokens_ref.value[1:]
+        tokens.expect("symbol", "{")
 
-        if not compile_statements(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
-            raise ValueError(f"Invalid program. Expected statements, got {tokens_ref.value[0]}")
+        if not compile_statements(tokens, class_name, class_symbols, subroutine_symbols, writer):
+            raise ValueError(f"Invalid program. Expected statements, got {tokens.peek()}")
 
-        if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != "}":
-            raise ValueError(f"Invalid program. Expected '}}', got {tokens_ref.value[0]}")
-        tokens_ref.value = tokens_ref.value[1:]
+        tokens.expect("symbol", "}")
 
     writer.write_label(L2)
 
     return True
 
 
-def compile_expression(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
+def compile_expression(tokens: TokenStream, class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
     """term (op term)*"""
 
     # term
-    if not compile_term(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
+    if not compile_term(tokens, class_name, class_symbols, subroutine_symbols, writer):
         return False
 
     # (op term)*
-    while tokens_ref.value[0].type == "symbol" and tokens_ref.value[0].value in "+-*/&|<>=":
-        operator = tokens_ref.value[0].value
-        tokens_ref.value = tokens_ref.value[1:]
+    while tokens.peek().type == "symbol" and tokens.peek().value in "+-*/&|<>=":
+        operator = tokens.advance().value
 
-        if not compile_term(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
-            raise ValueError(f"Invalid program. Expected term, got {tokens_ref.value[0]}")
+        if not compile_term(tokens, class_name, class_symbols, subroutine_symbols, writer):
+            raise ValueError(f"Invalid program. Expected term, got {tokens.peek()}")
 
         if operator == "+":
             writer.write_arithmetic("add")
@@ -552,25 +469,26 @@ def compile_expression(tokens_ref: Ref[list[Token]], class_name: str, class_symb
     return True
 
 
-def compile_term(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
+def compile_term(tokens: TokenStream, class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
     """integerConstant | stringConstant | keywordConstant | varName | varName '[' expression ']' | subroutineCall | '(' expression ')' | unaryOp term"""
 
     # varName '[' expression ']'   # needs to be before varName
-    if tokens_ref.value[0].type == "identifier" and tokens_ref.value[1].type == "symbol" and tokens_ref.value[1].value == "[":
-        var_name = tokens_ref.value[0].value
-        tokens_ref.value = tokens_ref.value[2:]
+    if tokens.peek().type == "identifier" and tokens.peek(1).type == "symbol" and tokens.peek(1).value == "[":
+        var_name = tokens.peek().value
+        tokens.advance(2)
 
         # push the base address of the array
         symbol = subroutine_symbols.get(var_name, None) or class_symbols.get(var_name, None)
         assert symbol is not None, f"Variable {var_name} not found. Expected local or class variable."
-        writer.write_push(symbol.kind, symbol.index)
+        if symbol.kind == "field":
+            writer.write_push("this", symbol.index)
+        else:
+            writer.write_push(symbol.kind, symbol.index)
 
-        if not compile_expression(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
-            raise ValueError(f"Invalid program. Expected expression, got {tokens_ref.value[0]}")
+        if not compile_expression(tokens, class_name, class_symbols, subroutine_symbols, writer):
+            raise ValueError(f"Invalid program. Expected expression, got {tokens.peek()}")
 
-        if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != "]":
-            raise ValueError(f"Invalid program. Expected ']', got {tokens_ref.value[0]}")
-        tokens_ref.value = tokens_ref.value[1:]
+        tokens.expect("symbol", "]")
 
         # add the index to the base address
         writer.write_arithmetic("add")
@@ -582,20 +500,19 @@ def compile_term(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: S
         return True
 
     # subroutineCall    # needs to be before varName
-    if compile_subroutine_call(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
+    if compile_subroutine_call(tokens, class_name, class_symbols, subroutine_symbols, writer):
         return True
 
     # integerConstant
-    if tokens_ref.value[0].type == "integerConstant":
-        writer.write_push("constant", tokens_ref.value[0].value)
-        tokens_ref.value = tokens_ref.value[1:]
+    if tokens.peek().type == "integerConstant":
+        writer.write_push("constant", int(tokens.peek().value))
+        tokens.advance()
 
         return True
 
     # stringConstant
-    if tokens_ref.value[0].type == "stringConstant":
-        string = tokens_ref.value[0].value
-        tokens_ref.value = tokens_ref.value[1:]
+    if tokens.peek().type == "stringConstant":
+        string = tokens.advance().value
 
         writer.write_push("constant", len(string))
         writer.write_call("String.new", 1)
@@ -606,26 +523,25 @@ def compile_term(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: S
         return True
 
     # keywordConstant
-    if tokens_ref.value[0].type == "keyword" and tokens_ref.value[0].value in ["true", "false", "null", "this"]:
-        if tokens_ref.value[0].value == "true":
+    if tokens.peek().type == "keyword" and tokens.peek().value in ["true", "false", "null", "this"]:
+        if tokens.peek().value == "true":
             writer.write_push("constant", 1)
             writer.write_arithmetic("neg")
-        elif tokens_ref.value[0].value == "false":
+        elif tokens.peek().value == "false":
             writer.write_push("constant", 0)
-        elif tokens_ref.value[0].value == "null":
+        elif tokens.peek().value == "null":
             writer.write_push("constant", 0)
-        elif tokens_ref.value[0].value == "this":
+        elif tokens.peek().value == "this":
             writer.write_push("pointer", 0)
         else:
-            raise ValueError(f"Invalid keyword: {tokens_ref.value[0].value}")
-        tokens_ref.value = tokens_ref.value[1:]
+            raise ValueError(f"Invalid keyword: {tokens.peek().value}")
+        tokens.advance()
 
         return True
 
     # varName
-    if tokens_ref.value[0].type == "identifier":
-        name = tokens_ref.value[0].value
-        tokens_ref.value = tokens_ref.value[1:]
+    if tokens.peek().type == "identifier":
+        name = tokens.advance().value
 
         symbol = subroutine_symbols.get(name, None) or class_symbols.get(name, None)
         assert symbol is not None, f"Variable {name} not found. Expected local or class variable."
@@ -637,25 +553,22 @@ def compile_term(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: S
         return True
 
     # '(' expression ')'
-    if tokens_ref.value[0].type == "symbol" and tokens_ref.value[0].value == "(":
-        tokens_ref.value = tokens_ref.value[1:]
+    if tokens.peek().type == "symbol" and tokens.peek().value == "(":
+        tokens.advance()
 
-        if not compile_expression(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
-            raise ValueError(f"Invalid program. Expected expression, got {tokens_ref.value[0]}")
+        if not compile_expression(tokens, class_name, class_symbols, subroutine_symbols, writer):
+            raise ValueError(f"Invalid program. Expected expression, got {tokens.peek()}")
 
-        if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != ")":
-            raise ValueError(f"Invalid program. Expected ')', got {tokens_ref.value[0]}")
-        tokens_ref.value = tokens_ref.value[1:]
+        tokens.expect("symbol", ")")
 
         return True
 
     # unaryOp term
-    if tokens_ref.value[0].type == "symbol" and tokens_ref.value[0].value in "-~":
-        operator = tokens_ref.value[0].value
-        tokens_ref.value = tokens_ref.value[1:]
+    if tokens.peek().type == "symbol" and tokens.peek().value in "-~":
+        operator = tokens.advance().value
 
-        if not compile_term(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
-            raise ValueError(f"Invalid program. Expected term, got {tokens_ref.value[0]}")
+        if not compile_term(tokens, class_name, class_symbols, subroutine_symbols, writer):
+            raise ValueError(f"Invalid program. Expected term, got {tokens.peek()}")
 
         if operator == "-":
             writer.write_arithmetic("neg")
@@ -668,40 +581,35 @@ def compile_term(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: S
     return False
 
 
-def compile_subroutine_call(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
+def compile_subroutine_call(tokens: TokenStream, class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> bool:
     """subroutineName '(' expressionList ')' | (className | varName) '.' subroutineName '(' expressionList ')'"""
 
     # subroutineName '(' expressionList ')'
-    if tokens_ref.value[0].type == "identifier" and tokens_ref.value[1].type == "symbol" and tokens_ref.value[1].value == "(":
+    if tokens.peek().type == "identifier" and tokens.peek(1).type == "symbol" and tokens.peek(1).value == "(":
         nArgs = 0
-        subroutine_name = tokens_ref.value[0].value
-        tokens_ref.value = tokens_ref.value[2:]
+        subroutine_name = tokens.peek().value
+        tokens.advance(2)
 
         # push this as the first argument
         writer.write_push("pointer", 0)
         nArgs += 1
 
         # expressionList
-        nArgs += compile_expression_list(tokens_ref, class_name, class_symbols, subroutine_symbols, writer)
+        nArgs += compile_expression_list(tokens, class_name, class_symbols, subroutine_symbols, writer)
 
-        if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != ")":
-            raise ValueError(f"Invalid program. Expected ')', got {tokens_ref.value[0]}")
-        tokens_ref.value = tokens_ref.value[1:]
+        tokens.expect("symbol", ")")
 
         writer.write_call(f"{class_name}.{subroutine_name}", nArgs)
 
         return True
 
     # (className | varName) '.' subroutineName '(' expressionList ')'
-    if tokens_ref.value[0].type == "identifier" and tokens_ref.value[1].type == "symbol" and tokens_ref.value[1].value == ".":
+    if tokens.peek().type == "identifier" and tokens.peek(1).type == "symbol" and tokens.peek(1).value == ".":
         nArgs = 0
-        parent_name = tokens_ref.value[0].value
-        tokens_ref.value = tokens_ref.value[2:]
+        parent_name = tokens.peek().value
+        tokens.advance(2)
 
-        if tokens_ref.value[0].type != "identifier":
-            raise ValueError(f"Invalid program. Expected subroutineName, got {tokens_ref.value[0]}")
-        method_name = tokens_ref.value[0].value
-        tokens_ref.value = tokens_ref.value[1:]
+        method_name = tokens.expect("identifier", description="subroutineName").value
 
         call_label = f"{parent_name}.{method_name}"
 
@@ -714,16 +622,12 @@ def compile_subroutine_call(tokens_ref: Ref[list[Token]], class_name: str, class
             call_label = f"{parent_symbol.type}.{method_name}"
             nArgs += 1
 
-        if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != "(":
-            raise ValueError(f"Invalid program. Expected '(', got {tokens_ref.value[0]}")
-        tokens_ref.value = tokens_ref.value[1:]
+        tokens.expect("symbol", "(")
 
         # expressionList
-        nArgs += compile_expression_list(tokens_ref, class_name, class_symbols, subroutine_symbols, writer)
+        nArgs += compile_expression_list(tokens, class_name, class_symbols, subroutine_symbols, writer)
 
-        if tokens_ref.value[0].type != "symbol" or tokens_ref.value[0].value != ")":
-            raise ValueError(f"Invalid program. Expected ')', got {tokens_ref.value[0]}")
-        tokens_ref.value = tokens_ref.value[1:]
+        tokens.expect("symbol", ")")
 
         writer.write_call(call_label, nArgs)
 
@@ -732,24 +636,24 @@ def compile_subroutine_call(tokens_ref: Ref[list[Token]], class_name: str, class
     return False
 
 
-def compile_expression_list(tokens_ref: Ref[list[Token]], class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> int:
+def compile_expression_list(tokens: TokenStream, class_name: str, class_symbols: SymbolTable, subroutine_symbols: SymbolTable, writer: VMWriter) -> int:
     """(expression (',' expression)*)?"""
     nArgs = 0
     # (expression (',' expression)*)?
-    if tokens_ref.value[0].type == "symbol" and tokens_ref.value[0].value == ")":
+    if tokens.peek().type == "symbol" and tokens.peek().value == ")":
         return nArgs  # empty expression list
 
     # expression
-    if not compile_expression(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
-        raise ValueError(f"Invalid program. Expected expression, got {tokens_ref.value[0]}")
+    if not compile_expression(tokens, class_name, class_symbols, subroutine_symbols, writer):
+        raise ValueError(f"Invalid program. Expected expression, got {tokens.peek()}")
     nArgs += 1
 
     # (',' expression)*
-    while tokens_ref.value[0].type == "symbol" and tokens_ref.value[0].value == ",":
-        tokens_ref.value = tokens_ref.value[1:]
+    while tokens.peek().type == "symbol" and tokens.peek().value == ",":
+        tokens.advance()
 
-        if not compile_expression(tokens_ref, class_name, class_symbols, subroutine_symbols, writer):
-            raise ValueError(f"Invalid program. Expected expression, got {tokens_ref.value[0]}")
+        if not compile_expression(tokens, class_name, class_symbols, subroutine_symbols, writer):
+            raise ValueError(f"Invalid program. Expected expression, got {tokens.peek()}")
 
         nArgs += 1
 
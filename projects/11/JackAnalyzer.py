@@ -1,38 +1,63 @@
 from pathlib import Path
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import subprocess
 
-from JackTokenizer import tokenize
+from JackTokenizer import tokenize, tokenize_lazy
 from CompilationEngine import compile
+from BuildCache import BuildCache
+from utils import write_atomic
 
-import pdb
 
-
-def main(path:Path):
+def main(path:Path, lazy:bool=False, jobs:int=1, use_cache:bool=True, stats:bool=False):
     if path.is_dir():
-        analyze_dir(path)
+        cache = BuildCache(path) if use_cache else None
+        analyze_dir(path, lazy, jobs, cache)
     elif path.is_file():
-        analyze_file(path)
+        cache = BuildCache(path.parent) if use_cache else None
+        analyze_files([path], lazy, 1, cache)
     else:
         raise Exception(f"Invalid path: {path}")
 
+    if stats and cache is not None:
+        print(cache)
 
-def analyze_dir(dir_path:Path):
-    for file_path in dir_path.iterdir():
-        if file_path.suffix == ".jack":
-            analyze_file(file_path)
+
+def analyze_dir(dir_path:Path, lazy:bool=False, jobs:int=1, cache:BuildCache|None=None):
+    files = sorted(file_path for file_path in dir_path.iterdir() if file_path.suffix == ".jack")
+    analyze_files(files, lazy, jobs, cache)
 
 
-def analyze_file(file_path:Path):
+def analyze_files(files:list[Path], lazy:bool=False, jobs:int=1, cache:BuildCache|None=None):
+    # files whose output can be restored from the cache don't need compiling at all
+    if cache is not None:
+        files = [file_path for file_path in files if not cache.restore(file_path)]
+
+    if jobs == 1:
+        vmcodes = [analyze_file(file_path, lazy) for file_path in files]
+    else:
+        # each file compiles independently, so they can be spread over worker processes
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            vmcodes = list(executor.map(analyze_file, files, repeat(lazy)))
+
+    if cache is not None:
+        for file_path, vmcode in zip(files, vmcodes):
+            cache.store(file_path, vmcode)
+        cache.save()
+
+
+def analyze_file(file_path:Path, lazy:bool=False) -> str:
     if file_path.suffix != ".jack":
         raise Exception(f"Invalid file: {file_path}")
 
-    # compile the file to VM code
-    tokens = tokenize(file_path)
+    # compile the file to VM code. In lazy mode, tokens are read from the file as the parser needs them
+    tokens = tokenize_lazy(file_path) if lazy else tokenize(file_path)
     vmcode = compile(tokens)
 
-    out_path = file_path.with_suffix(".vm")
-    out_path.write_text(vmcode)
+    write_atomic(file_path.with_suffix(".vm"), vmcode)
+
+    return vmcode
 
 
 
@@ -78,10 +103,14 @@ def compare_file(test_path:Path, answer_path:Path):
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("path", type=Path, help="Path to a .jack file or directory")
+    parser.add_argument("--lazy", action="store_true", help="Stream tokens from the source file into the parser instead of tokenizing the whole file first")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of worker processes used to compile a directory")
+    parser.add_argument("--no-cache", action="store_true", help="Recompile every file instead of reusing outputs from the .jackcache/ build cache")
+    parser.add_argument("--stats", action="store_true", help="Print build cache hits and misses")
     parser.add_argument("--compare", action="store_true", help="Test a <file>TTT.xml against <file>T.xml using TextComparer.sh")
     args = parser.parse_args()
     
     if args.compare:
         compare(args.path)
     else:
-        main(args.path)
\ No newline at end of file
+        main(args.path, args.lazy, args.jobs, not args.no_cache, args.stats)
\ No newline at end of file
@@ -0,0 +1,104 @@
+from pathlib import Path
+from argparse import ArgumentParser
+import sys
+
+from JackTokenizer import tokenize
+from CompilationEngine import compile_vm
+from utils import write_atomic
+
+# the vm translator and assembler live in their own project directories
+projects_dir = Path(__file__).resolve().parent.parent
+sys.path.extend([str(projects_dir / '08'), str(projects_dir / '06')])
+from VMCode import VMCommand, parse_lines
+from VMLinker import remove_unused_functions
+import VMTranslator
+from VMTranslator import Settings
+import HackAssembler
+import HackLinker
+
+
+def main(path:Path, write_vm:bool=False, write_asm:bool=False, remove_unused:bool=False, settings:Settings=Settings(), jobs:int=1):
+    """build a .hack program from a directory of sources, or a single source file"""
+    if path.is_dir():
+        hack_path = build_dir(path, write_vm, write_asm, remove_unused, settings, jobs)
+    elif path.is_file():
+        hack_path = build_file(path, write_vm, write_asm, settings)
+    else:
+        raise Exception(f"Invalid path: {path}")
+
+    print(f'wrote to {hack_path}')
+
+
+def build_dir(dir_path:Path, write_vm:bool=False, write_asm:bool=False, remove_unused:bool=False, settings:Settings=Settings(), jobs:int=1) -> Path:
+    """
+    build every source in the directory into one program, starting with the bootstrap code.
+    If remove_unused, functions that can't be reached from Sys.init are left out (and reported).
+    The compiled files are translated on `jobs` worker processes
+    """
+    programs = {path.stem: compile_source(path, write_vm) for path in sorted(filter(is_program_source, dir_path.iterdir()))}
+    if remove_unused:
+        programs, removed = remove_unused_functions(programs)
+
+    hack_path = dir_path / f'{dir_path.name}.hack'
+    write_program(*VMTranslator.emit_hack(programs, settings, jobs, listing=write_asm), hack_path)
+
+    if remove_unused:
+        print(VMTranslator.removal_report(removed, settings))
+    return hack_path
+
+
+def build_file(path:Path, write_vm:bool=False, write_asm:bool=False, settings:Settings=Settings()) -> Path:
+    """build a single source file into a program. Like the vm translator, single files get no bootstrap code"""
+    if path.suffix not in ('.jack', '.vm'):
+        raise Exception(f"Invalid file: {path}")
+
+    programs = {path.stem: compile_source(path, write_vm)}
+    hack_path = path.with_suffix('.hack')
+    write_program(*VMTranslator.emit_hack(programs, settings, include_bootstrap=False, listing=write_asm), hack_path)
+    return hack_path
+
+
+def is_program_source(path:Path) -> bool:
+    """every .jack file, plus any .vm file that isn't generated from one"""
+    return path.suffix == '.jack' or (path.suffix == '.vm' and not path.with_suffix('.jack').exists())
+
+
+def compile_source(path:Path, write_vm:bool=False) -> list[VMCommand]:
+    """the vm commands of a source file: compiled if it's a .jack file, parsed if it's a .vm file"""
+    if path.suffix != '.jack':
+        return parse_lines(path.read_text().splitlines())
+
+    writer = compile_vm(tokenize(path))
+    if write_vm:
+        write_atomic(path.with_suffix('.vm'), str(writer))
+    return writer
+
+
+def bootstrap_asm(settings:Settings=Settings()) -> list[str]:
+    return VMTranslator.bootstrap_section(settings)
+
+
+def write_program(hack_lines:list[str], asm_lines:list[str], hack_path:Path):
+    """write the machine code of the program to hack_path, and its asm listing (if there is one) next to it"""
+    if asm_lines:
+        write_atomic(hack_path.with_suffix('.asm'), '\n'.join(asm_lines))
+    write_atomic(hack_path, '\n'.join(hack_lines))
+
+
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("path", type=Path, help="Path to a program directory of .jack (and/or .vm) files, or a single source file")
+    parser.add_argument("--vm", action="store_true", help="Also write the intermediate .vm file for each .jack file")
+    parser.add_argument("--asm", action="store_true", help="Also write the intermediate .asm listing of the program")
+    parser.add_argument("--shared-runtime", action="store_true", help="Jump to shared call/return/compare routines instead of inlining them (smaller, slightly slower)")
+    parser.add_argument("--optimize", action="store_true", help="Run the peephole optimizer over the vm code before translating it")
+    parser.add_argument("--cache-tos", action="store_true", help="Keep the top of the stack in D within basic blocks")
+    parser.add_argument("--opt-level", choices=["speed", "balanced", "size"], default="speed", help="Favour fewer cycles or fewer ROM words where the code can trade one for the other")
+    parser.add_argument("--remove-unused", action="store_true", help="Leave out functions that can't be reached from Sys.init, and report their sizes")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of worker processes used to translate the files of a directory")
+    args = parser.parse_args()
+
+    settings = Settings(shared_runtime=args.shared_runtime, optimize=args.optimize, cache_tos=args.cache_tos, opt_level=args.opt_level)
+    main(args.path, args.vm, args.asm, args.remove_unused, settings, args.jobs)
@@ -1,8 +1,13 @@
 from pathlib import Path
 from utils import Ref
-from dataclasses import dataclass
-
-import pdb
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, Sequence
+from collections import defaultdict
+from time import perf_counter_ns
+from array import array
+import string
+import sys
+import re
 
 keywords = {
     "class", "constructor", "function", "method", "field", "static", "var",
@@ -12,121 +17,315 @@ keywords = {
 
 symbols = {*"{}()[].,;+-*/&|<>=~"}
 
+# patterns are only ever matched at the cursor position, never on a copy of the remaining source
+whitespace_pattern = re.compile(r"\s+")
+integer_pattern = re.compile(r"\d+")
+word_pattern = re.compile(r"[^\W\d]\w*")
 
-@dataclass
+
+token_types = ["keyword", "symbol", "integerConstant", "stringConstant", "identifier"]
+type_codes = {type: code for code, type in enumerate(token_types)}
+
+
+@dataclass(slots=True)
 class Token:
     type: str
     value: str
+    # source position (1-based). Not part of token identity
+    line: int = field(default=0, compare=False)
+    column: int = field(default=0, compare=False)
 
 
-def tokenize(inpath: Path) -> list[Token]:
-    src = Ref(inpath.read_text())
-    tokens: list[Token] = []
+@dataclass
+class ScanStats:
+    """per token class counters collected while scanning (whitespace and comments are counted as classes too)"""
+    counts: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    times: dict[str, int] = field(default_factory=lambda: defaultdict(int))  # nanoseconds
 
-    while len(src.value) > 0:
-        if eat_comments(src):
-            continue
-        if eat_whitespace(src):
-            continue
-        if eat_keyword(src, tokens):
-            continue
-        if eat_symbol(src, tokens):
-            continue
-        if eat_integer_constant(src, tokens):
-            continue
-        if eat_string_constant(src, tokens):
+    def record(self, token_class: str, elapsed: int) -> None:
+        self.counts[token_class] += 1
+        self.times[token_class] += elapsed
+
+    def __str__(self) -> str:
+        """nice table printout"""
+        total = sum(self.times.values()) or 1
+        rows = [(name, f"{self.counts[name]}", f"{self.times[name] / 1e6:.2f}", f"{self.times[name] / self.counts[name]:.0f}", f"{100 * self.times[name] / total:.1f}%")
+                for name in sorted(self.times, key=self.times.get, reverse=True)]
+        header = ("class", "count", "time (ms)", "ns/each", "share")
+        widths = [max(len(row[i]) for row in [header, *rows]) for i in range(len(header))]
+        lines = [" │ ".join(f"{cell:<{width}}" for cell, width in zip(header, widths))]
+        lines.append("─┼─".join("─" * width for width in widths))
+        for row in rows:
+            lines.append(" │ ".join(f"{cell:<{width}}" for cell, width in zip(row, widths)))
+        return "\n".join(lines)
+
+
+def make_token(src: str, type: str, start: int, length: int, line: int) -> Token:
+    """materialize a token from its location in the source"""
+    value = sys.intern(src[start:start + length])
+    column = start - src.rfind("\n", 0, start)
+    return Token(type, value, line, column)
+
+
+class TokenArray(Sequence[Token]):
+    """
+    compact columnar token store. Each token is a type code plus the offset/length of its text in the source and its
+    line number, held in parallel arrays. Token objects (and their interned string values) are only created on access
+    """
+
+    def __init__(self, src: str):
+        self.src = src
+        self.types = array('B')
+        self.starts = array('I')
+        self.lengths = array('I')  # string constants can be longer than 65535 characters
+        self.lines = array('I')
+
+    def append(self, type: str, start: int, length: int, line: int) -> None:
+        self.types.append(type_codes[type])
+        self.starts.append(start)
+        self.lengths.append(length)
+        self.lines.append(line)
+
+    def type_at(self, i: int) -> str:
+        return token_types[self.types[i]]
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __iter__(self) -> Iterator[Token]:
+        for code, start, length, line in zip(self.types, self.starts, self.lengths, self.lines):
+            yield make_token(self.src, token_types[code], start, length, line)
+
+    def __getitem__(self, i: int | slice) -> Token | list[Token]:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return make_token(self.src, self.type_at(i), self.starts[i], self.lengths[i], self.lines[i])
+
+
+class TokenStream:
+    """
+    read cursor over a source of tokens, either an array of tokens or a lazy token generator.
+    Only the tokens at the cursor and the few ahead of it that the parser has peeked at are held
+    """
+
+    def __init__(self, tokens: Iterable[Token]):
+        self.tokens = iter(tokens)
+        self.index = 0
+
+        # tokens at the cursor and ahead of it that have already been pulled from the source
+        self.lookahead: list[Token] = []
+
+    def peek(self, k: int = 0) -> Token:
+        """return the token k positions ahead of the cursor without consuming it"""
+        try:
+            return self.lookahead[k]
+        except IndexError:
+            pass
+        while len(self.lookahead) <= k:
+            token = next(self.tokens, None)
+            if token is None:
+                raise ValueError(f"Invalid program. Unexpected end of file after {self.index + len(self.lookahead)} tokens")
+            self.lookahead.append(token)
+        return self.lookahead[k]
+
+    def advance(self, n: int = 1) -> Token:
+        """consume n tokens and return the last one consumed"""
+        token = self.peek(n - 1)
+        del self.lookahead[:n]
+        self.index += n
+        return token
+
+    def expect(self, type: str, value: str | None = None, description: str | None = None) -> Token:
+        """consume the next token, raising if it doesn't have the given type (and value if specified)"""
+        token = self.peek()
+        if token.type != type or (value is not None and token.value != value):
+            if description is None:
+                description = type if value is None else f"'{value}'"
+            raise ValueError(f"Invalid program. Expected {description}, got {token}")
+        return self.advance()
+
+    def remaining(self) -> list[Token]:
+        return [*self.lookahead, *self.tokens]
+
+
+def tokenize(inpath: Path, stats: ScanStats | None = None) -> TokenArray:
+    return tokenize_source(inpath.read_text(), stats)
+
+
+def tokenize_source(src: str, stats: ScanStats | None = None) -> TokenArray:
+    """tokenize the whole source up front. Tokens are recorded as offsets into the source, which is never copied"""
+    tokens = TokenArray(src)
+    for type, start, length, line in scan(src, Ref(0), stats=stats):
+        tokens.append(type, start, length, line)
+    return tokens
+
+
+def tokenize_lazy(inpath: Path) -> Iterator[Token]:
+    """tokenize a file on demand, reading it line by line as the consumer pulls tokens"""
+    with inpath.open() as f:
+        yield from iter_tokens(f)
+
+
+def iter_tokens(lines: Iterable[str]) -> Iterator[Token]:
+    """
+    lazily tokenize source text given as lines (each including its line ending). Only the current line is held,
+    plus any following lines spanned by a block comment that hasn't been closed yet
+    """
+    chunk = ""
+    line = 1  # line number of the start of the chunk
+    pos = Ref(0)
+    in_comment = False  # whether scanning stopped at a block comment that isn't closed yet
+
+    for text in lines:
+        end = len(chunk)
+        chunk += text
+        # only the new text (and the character before it) can close the comment, so the rest isn't searched again
+        if in_comment and chunk.find("*/", max(end - 1, pos.value + 2)) == -1:
             continue
-        if eat_identifier(src, tokens):
+
+        for type, start, length, token_line in scan(chunk, pos, line, partial=True):
+            yield make_token(chunk, type, start, length, token_line)
+
+        in_comment = pos.value < len(chunk)
+        if in_comment:
+            # stopped at an unclosed block comment. Keep the line it starts on so columns stay correct
+            line_start = chunk.rfind("\n", 0, pos.value) + 1
+            line += chunk.count("\n", 0, line_start)
+            chunk = chunk[line_start:]
+            pos.value -= line_start
+        else:
+            line += chunk.count("\n")
+            chunk = ""
+            pos.value = 0
+
+    # anything left over is an unclosed comment, which scanning will report
+    for type, start, length, token_line in scan(chunk, pos, line):
+        yield make_token(chunk, type, start, length, token_line)
+
+
+def scan(src: str, pos: Ref[int], line: int = 1, partial: bool = False, stats: ScanStats | None = None) -> Iterator[tuple[str, int, int, int]]:
+    """
+    scan tokens from pos with a single cursor index, yielding (type, start, length, line) for each.
+    `line` is the line number at pos. If partial, the source may be continued later, so scanning stops
+    (leaving pos) at a block comment that isn't closed yet. If stats is given, time spent per token class is recorded
+    """
+    pending: list[tuple[str, int, int]] = []
+    counted = pos.value  # newlines before this offset have been counted into line
+
+    while pos.value < len(src):
+        # the first character determines which scanner applies. Anything outside ASCII is whitespace or starts an identifier
+        code = ord(src[pos.value])
+        eat = dispatch[code] if code < 128 else eat_non_ascii
+
+        if partial and eat is eat_comment_or_symbol and src.startswith("/*", pos.value) and src.find("*/", pos.value + 2) == -1:
+            return
+
+        start_time = perf_counter_ns() if stats is not None else 0
+        if eat is None or not eat(src, pos, pending):
+            raise Exception(f"Invalid token: '{src[pos.value:pos.value + 40]}'")
+
+        if not pending:
+            if stats is not None:
+                stats.record("whitespace" if eat is eat_whitespace or eat is eat_non_ascii else "comment", perf_counter_ns() - start_time)
             continue
 
-        pdb.set_trace()
-        raise Exception(f"Invalid token: '{src.value}'")
+        type, start, length = pending.pop()
+        if stats is not None:
+            stats.record(type, perf_counter_ns() - start_time)
+        line += src.count("\n", counted, start)
+        counted = start
+        yield type, start, length, line
 
-    return tokens
 
+def eat_word(src: str, pos: Ref[int], tokens: list[tuple[str, int, int]]) -> bool:
+    """keyword or identifier. The whole word is scanned once and then classified with a single set lookup"""
+    match = word_pattern.match(src, pos.value)
+    if match is None:
+        return False
 
-def eat_keyword(src: Ref[str], tokens: list[Token]) -> bool:
-    for keyword in keywords:
-        if src.value.startswith(keyword) and (len(src.value) == len(keyword) or not src.value[len(keyword)].isalnum()):
-            tokens.append(Token("keyword", keyword))
-            src.value = src.value[len(keyword):]
-            return True
-    return False
+    tokens.append(("keyword" if match.group() in keywords else "identifier", pos.value, match.end() - pos.value))
+    pos.value = match.end()
+    return True
 
 
-def eat_symbol(src: Ref[str], tokens: list[Token]) -> bool:
-    if src.value[0] in symbols:
-        tokens.append(Token("symbol", src.value[0]))
-        src.value = src.value[1:]
+def eat_symbol(src: str, pos: Ref[int], tokens: list[tuple[str, int, int]]) -> bool:
+    if src[pos.value] in symbols:
+        tokens.append(("symbol", pos.value, 1))
+        pos.value += 1
         return True
     return False
 
 
-def eat_integer_constant(src: Ref[str], tokens: list[Token]) -> bool:
-    if src.value[0].isdigit():
-        i = 1
-        while i < len(src.value) and src.value[i].isdigit():
-            i += 1
-        tokens.append(Token("integerConstant", src.value[:i]))
-        src.value = src.value[i:]
-        return True
-    return False
+def eat_integer_constant(src: str, pos: Ref[int], tokens: list[tuple[str, int, int]]) -> bool:
+    match = integer_pattern.match(src, pos.value)
+    if match is None:
+        return False
+
+    tokens.append(("integerConstant", pos.value, match.end() - pos.value))
+    pos.value = match.end()
+    return True
 
 
-def eat_string_constant(src: Ref[str], tokens: list[Token]) -> bool:
-    if src.value[0] == '"':
-        i = 1
-        while i < len(src.value) and src.value[i] != '"':
-            i += 1
-        tokens.append(Token("stringConstant", src.value[1:i]))
-        src.value = src.value[i+1:]
+def eat_string_constant(src: str, pos: Ref[int], tokens: list[tuple[str, int, int]]) -> bool:
+    if src[pos.value] == '"':
+        end = src.find('"', pos.value + 1)
+        assert end != -1, "Unclosed string constant"
+        tokens.append(("stringConstant", pos.value + 1, end - pos.value - 1))
+        pos.value = end + 1
         return True
     return False
 
 
-def eat_identifier(src: Ref[str], tokens: list[Token]) -> bool:
-    if src.value[0].isalpha() or src.value[0] == "_":
-        i = 1
-        while i < len(src.value) and (src.value[i].isalnum() or src.value[i] == "_"):
-            i += 1
+def eat_whitespace(src: str, pos: Ref[int], tokens: list[tuple[str, int, int]]) -> bool:
+    match = whitespace_pattern.match(src, pos.value)
+    if match is None:
+        return False
 
-        if src.value[:i] in keywords:
-            return False  # keywords are not identifiers
+    pos.value = match.end()
+    return True
 
-        tokens.append(Token("identifier", src.value[:i]))
-        src.value = src.value[i:]
-        return True
-    return False
 
+def eat_non_ascii(src: str, pos: Ref[int], tokens: list[tuple[str, int, int]]) -> bool:
+    """a character outside ASCII: unicode whitespace (e.g. a non-breaking space), or the start of an identifier"""
+    return eat_whitespace(src, pos, tokens) or eat_word(src, pos, tokens)
 
-def eat_whitespace(src: Ref[str]) -> bool:
-    if src.value[0].isspace():
-        i = 1
-        while i < len(src.value) and src.value[i].isspace():
-            i += 1
-        src.value = src.value[i:]
-        return True
-    return False
 
+def eat_comment_or_symbol(src: str, pos: Ref[int], tokens: list[tuple[str, int, int]]) -> bool:
+    """'/' starts either a comment or the division symbol"""
+    return eat_comments(src, pos) or eat_symbol(src, pos, tokens)
 
-def eat_comments(src: Ref[str]) -> bool:
-    if src.value.startswith("//"):
-        i = 2
-        while i < len(src.value) and src.value[i] != "\n":
-            i += 1
-        src.value = src.value[i:]
+
+def eat_comments(src: str, pos: Ref[int]) -> bool:
+    if src.startswith("//", pos.value):
+        end = src.find("\n", pos.value + 2)
+        pos.value = len(src) if end == -1 else end
         return True
-    if src.value.startswith("/*"):
-        i = 2
-        while i < len(src.value) and not src.value[i:].startswith("*/"):
-            i += 1
-        assert src.value[i:].startswith("*/"), "Unclosed comment"
-        src.value = src.value[i+2:]
+    if src.startswith("/*", pos.value):
+        end = src.find("*/", pos.value + 2)
+        assert end != -1, "Unclosed comment"
+        pos.value = end + 2
         return True
     return False
 
 
+# scanner to use for each ASCII first character. None means the character can't start a token
+dispatch: list[Callable[[str, Ref[int], list[tuple[str, int, int]]], bool] | None] = [None] * 128
+for char in string.ascii_letters + "_":
+    dispatch[ord(char)] = eat_word
+for char in string.digits:
+    dispatch[ord(char)] = eat_integer_constant
+for char in map(chr, range(128)):
+    if char.isspace():  # also the \x1c-\x1f separators, which str.isspace counts as whitespace
+        dispatch[ord(char)] = eat_whitespace
+for char in symbols:
+    dispatch[ord(char)] = eat_symbol
+dispatch[ord('"')] = eat_string_constant
+dispatch[ord('/')] = eat_comment_or_symbol
+
+
 # simple test
 if __name__ == "__main__":
     tokens = tokenize(Path('ComplexArrays/Main.jack'))
-    print(tokens)
+    print(list(tokens))
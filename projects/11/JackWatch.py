@@ -0,0 +1,143 @@
+from pathlib import Path
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from time import perf_counter, sleep
+import os
+
+from JackBuild import VMCommand, VMTranslator, Settings, HackLinker, is_program_source, compile_source, bootstrap_asm, remove_unused_functions
+from utils import write_atomic
+
+
+@dataclass
+class SourceFile:
+    """in-memory build state of one source file"""
+    mtime: int  # st_mtime_ns of the source when it was built
+    program: list[VMCommand]
+    obj: HackLinker.ObjectFile  # machine code of the file as a relocatable object, ready to link
+    asm_lines: list[str]        # translated asm with comments, if the listing is written
+
+
+class Workspace:
+    """
+    warm build state for a program directory: the vm code and object of every source file are kept in memory,
+    so a rebuild only recompiles and retranslates the files that changed, then relinks the program
+    """
+
+    def __init__(self, root: Path, write_vm: bool = False, write_asm: bool = False, remove_unused: bool = False, settings: Settings = Settings()):
+        self.root = root
+        self.write_vm = write_vm
+        self.write_asm = write_asm
+        self.remove_unused = remove_unused
+        self.settings = settings
+        self.asm_path = root / f'{root.name}.asm'
+        self.hack_path = root / f'{root.name}.hack'
+        self.files: dict[Path, SourceFile] = {}
+        self.errors: dict[Path, int] = {}  # sources that failed to build, by the mtime that failed
+
+    def sources(self) -> dict[Path, int]:
+        """current sources with their modification times: every .jack file, plus any .vm file not generated from one"""
+        sources = {}
+        for entry in os.scandir(self.root):
+            path = Path(entry.path)
+            if is_program_source(path):
+                sources[path] = entry.stat().st_mtime_ns
+        return sources
+
+    def rebuild(self) -> list[Path]:
+        """bring the outputs up to date. Returns the sources that were rebuilt or removed"""
+        sources = self.sources()
+        changed = [path for path, mtime in sorted(sources.items())
+                   if (path not in self.files or self.files[path].mtime != mtime) and self.errors.get(path) != mtime]
+        removed = [path for path in [*self.files, *self.errors] if path not in sources]
+        if not changed and not removed:
+            return []
+
+        for path in removed:
+            self.files.pop(path, None)
+            self.errors.pop(path, None)
+
+        for path in changed:
+            try:
+                self.files[path] = self.build_file(path, sources[path])
+                self.errors.pop(path, None)
+            except Exception as e:
+                self.errors[path] = sources[path]
+                print(f'error building {path.name}: {e}')
+
+        if self.errors:
+            print(f'not linking {self.hack_path.name} until {", ".join(path.name for path in self.errors)} build(s)')
+        else:
+            self.link()
+
+        return changed + removed
+
+    def build_file(self, path: Path, mtime: int) -> SourceFile:
+        """compile (if jack) and translate a single source file into an object"""
+        program = compile_source(path, self.write_vm)
+        return SourceFile(mtime, program, *VMTranslator.emit_program(path.stem, program, self.settings, self.write_asm))
+
+    def link(self):
+        """link the objects of every file (with the bootstrap code and shared routines) into the whole program"""
+        bootstrap = bootstrap_asm(self.settings)
+        asm_lines = [*bootstrap]
+        objects = [HackLinker.assemble_object(bootstrap)]
+        if self.remove_unused:
+            # which functions are reachable depends on every file, so the kept ones are retranslated on each link
+            programs, _ = remove_unused_functions({path.stem: self.files[path].program for path in sorted(self.files)})
+            for name, program in programs.items():
+                obj, fragment = VMTranslator.emit_program(name, program, self.settings, self.write_asm)
+                asm_lines.extend(fragment)
+                objects.append(obj)
+        else:
+            for path in sorted(self.files):
+                asm_lines.extend(self.files[path].asm_lines)
+                objects.append(self.files[path].obj)
+        runtime = VMTranslator.shared_runtime(self.settings)
+        asm_lines.extend(runtime)
+        objects.append(HackLinker.assemble_object(runtime))
+
+        if self.write_asm:
+            write_atomic(self.asm_path, '\n'.join(asm_lines))
+        write_atomic(self.hack_path, '\n'.join(HackLinker.link(objects)))
+
+
+def watch(root: Path, interval: float, once: bool = False, write_vm: bool = False, write_asm: bool = False, remove_unused: bool = False, settings: Settings = Settings()):
+    """poll the directory for changes and rebuild whatever is affected"""
+    workspace = Workspace(root, write_vm, write_asm, remove_unused, settings)
+    if not once:
+        print(f'watching {root} (ctrl-c to stop)')
+
+    while True:
+        start = perf_counter()
+        rebuilt = workspace.rebuild()
+        if rebuilt and not workspace.errors:
+            elapsed = (perf_counter() - start) * 1000
+            print(f'rebuilt {workspace.hack_path.name} from {", ".join(path.name for path in rebuilt)} in {elapsed:.0f} ms')
+        if once:
+            return
+        sleep(interval)
+
+
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("path", type=Path, help="Path to a program directory of .jack (and/or .vm) files")
+    parser.add_argument("--interval", type=float, default=0.1, help="Seconds between polls for changed files")
+    parser.add_argument("--once", action="store_true", help="Build once and exit instead of watching")
+    parser.add_argument("--vm", action="store_true", help="Also write the intermediate .vm file for each .jack file")
+    parser.add_argument("--asm", action="store_true", help="Also write the intermediate .asm listing of the program")
+    parser.add_argument("--shared-runtime", action="store_true", help="Jump to shared call/return/compare routines instead of inlining them (smaller, slightly slower)")
+    parser.add_argument("--optimize", action="store_true", help="Run the peephole optimizer over the vm code before translating it")
+    parser.add_argument("--cache-tos", action="store_true", help="Keep the top of the stack in D within basic blocks")
+    parser.add_argument("--opt-level", choices=["speed", "balanced", "size"], default="speed", help="Favour fewer cycles or fewer ROM words where the code can trade one for the other")
+    parser.add_argument("--remove-unused", action="store_true", help="Leave out functions that can't be reached from Sys.init")
+    args = parser.parse_args()
+
+    settings = Settings(shared_runtime=args.shared_runtime, optimize=args.optimize, cache_tos=args.cache_tos, opt_level=args.opt_level)
+
+    assert args.path.is_dir(), f"Invalid path: {args.path} is not a directory"
+    try:
+        watch(args.path, args.interval, args.once, args.vm, args.asm, args.remove_unused, settings)
+    except KeyboardInterrupt:
+        ...
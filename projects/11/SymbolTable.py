@@ -1,7 +1,5 @@
 from dataclasses import dataclass
 from typing import Literal
-##
-import pdb
 
 
 @dataclass
@@ -1,33 +1,52 @@
+from pathlib import Path
 from typing import Literal
+import sys
 
+# the vm command format is defined alongside the vm translator
+sys.path.append(str(Path(__file__).resolve().parent.parent / '08'))
+from VMCode import VMCommand, serialize, opcodes, segment_codes, PUSH, POP, LABEL, GOTO, IF_GOTO, CALL, FUNCTION, RETURN
+
+
+class VMWriter(list[VMCommand]):
+    """list of the vm commands of a class, in the compact form the vm translator consumes directly. str() gives the .vm text"""
+
+    def __init__(self):
+        super().__init__()
+        # counters for generating unique labels. Kept per writer so that compiling a class gives the same output no matter what else was compiled before it
+        self.label_counts: dict[str, int] = {}
+
+    def next_label_index(self, kind: str) -> int:
+        """return the next unused index for labels of the given kind (e.g. 'while', 'if')"""
+        index = self.label_counts.get(kind, 0)
+        self.label_counts[kind] = index + 1
+        return index
 
-class VMWriter(list[str]):
     def write_push(self, segment: Literal['constant', 'argument', 'local', 'static', 'this', 'that', 'pointer', 'temp'], index: int) -> None:
-        self.append(f"push {segment} {index}")
+        self.append(VMCommand(PUSH, segment_codes[segment], index))
 
     def write_pop(self, segment: Literal['constant', 'argument', 'local', 'static', 'this', 'that', 'pointer', 'temp'], index: int) -> None:
-        self.append(f"pop {segment} {index}")
+        self.append(VMCommand(POP, segment_codes[segment], index))
 
     def write_arithmetic(self, command: Literal['add', 'sub', 'neg', 'eq', 'gt', 'lt', 'and', 'or', 'not']) -> None:
-        self.append(command)
+        self.append(VMCommand(opcodes[command]))
 
     def write_label(self, label: str) -> None:
-        self.append(f"label {label}")
+        self.append(VMCommand(LABEL, name=label))
 
     def write_goto(self, label: str) -> None:
-        self.append(f"goto {label}")
+        self.append(VMCommand(GOTO, name=label))
 
     def write_if(self, label: str) -> None:
-        self.append(f"if-goto {label}")
+        self.append(VMCommand(IF_GOTO, name=label))
 
     def write_call(self, name: str, nArgs: int) -> None:
-        self.append(f"call {name} {nArgs}")
+        self.append(VMCommand(CALL, index=nArgs, name=name))
 
     def write_function(self, name: str, nLocals: int) -> None:
-        self.append(f"function {name} {nLocals}")
+        self.append(VMCommand(FUNCTION, index=nLocals, name=name))
 
     def write_return(self) -> None:
-        self.append("return")
+        self.append(VMCommand(RETURN))
 
     def __str__(self) -> str:
-        return "\n".join(self)
+        return serialize(self)
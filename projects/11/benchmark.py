@@ -0,0 +1,746 @@
+from pathlib import Path
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from time import perf_counter
+from tempfile import TemporaryDirectory
+import tracemalloc
+import subprocess
+import sys
+import os
+from typing import Callable, Iterable
+
+from utils import Ref
+from JackAnalyzer import analyze_dir
+from JackTokenizer import Token, ScanStats, tokenize, tokenize_lazy, tokenize_source, keywords, symbols
+from CompilationEngine import compile, compile_vm
+from JackBuild import VMTranslator, Settings, HackAssembler, HackLinker, VMCommand, compile_source, bootstrap_asm
+
+
+projects_dir = Path(__file__).resolve().parent.parent
+sys.path.append(str(projects_dir / '05'))
+from HackEmulator import HackEmulator
+import HackOptimizer
+import HackRom
+from VMCode import FUNCTION
+from VMOptimizer import Site, optimize, patterns
+
+
+def tetris_sources() -> list[Path]:
+    return [*sorted((projects_dir / '09' / 'Tetris').glob('*.jack')), *sorted((projects_dir / '12').glob('*.jack'))]
+
+
+def corpus() -> dict[str, str]:
+    """the Tetris game plus the OS, along with a synthetic ~1MB class"""
+    sources = {}
+    for path in tetris_sources():
+        sources[f'{path.parent.name}/{path.name}'] = path.read_text()
+    sources['synthetic (1MB)'] = synthetic_class(1_000_000)
+    return sources
+
+
+def synthetic_class(size: int, name: str = 'Synthetic') -> str:
+    """generate a valid jack class of roughly `size` characters"""
+    lines = [
+        '/** synthetic benchmark class */',
+        f'class {name} {{',
+        '    field int count;',
+        '    static Array buffer;',
+    ]
+    length = sum(len(line) + 1 for line in lines)
+    i = 0
+    while length < size:
+        body = [
+            f'    // function number {i}',
+            f'    function int f{i}(int a, int b) {{',
+            '        var int x, y;',
+            '        var String s;',
+            '        let x = a + (b * 3) - 17;',
+            f'        let s = "string constant {i}";',
+            '        while (x > 0) {',
+            '            let y = buffer[x] | (y & ~x);',
+            '            if (y = 42) { let x = x - 1; } else { let x = x / 2; }',
+            '        }',
+            '        /* block comment */',
+            f'        do Output.printInt({name}.f{i}(x, -y));',
+            '        return x;',
+            '    }',
+        ]
+        lines.extend(body)
+        length += sum(len(line) + 1 for line in body)
+        i += 1
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def timeit(fn: Callable[[], object], repeat: int) -> float:
+    """best wall time of `repeat` runs"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def bench_tokenizer(repeat: int):
+    """compare the legacy re-slicing tokenizer against the cursor tokenizer"""
+    print(f"{'file':<24} {'chars':>9} {'tokens':>8} {'legacy (s)':>11} {'cursor (s)':>11} {'speedup':>8}")
+    totals = [0.0, 0.0]
+    for name, src in corpus().items():
+        tokens = tokenize_source(src)
+        legacy = timeit(lambda: legacy_tokenize(src), repeat)
+        cursor = timeit(lambda: tokenize_source(src), repeat)
+        totals[0] += legacy
+        totals[1] += cursor
+        print(f"{name:<24} {len(src):>9} {len(tokens):>8} {legacy:>11.4f} {cursor:>11.4f} {legacy / cursor:>7.1f}x")
+
+        # the cursor tokenizer deliberately differs on some inputs (e.g. it keeps `do_x` as one identifier, where the
+        # legacy one splits off the keyword), so a mismatch is reported rather than failing the benchmark
+        if [(t.type, t.value) for t in tokens] != [(t.type, t.value) for t in legacy_tokenize(src)]:
+            print(f"{'':<24} note: the tokenizers disagree on {name}")
+    print(f"{'total':<24} {'':>9} {'':>8} {totals[0]:>11.4f} {totals[1]:>11.4f} {totals[0] / totals[1]:>7.1f}x")
+
+
+def bench_token_classes():
+    """where tokenizer time goes, per token class, over the whole corpus"""
+    stats = ScanStats()
+    for src in corpus().values():
+        tokenize_source(src, stats)
+    print(stats)
+
+
+def retained_memory(fn: Callable[[], object]) -> int:
+    """bytes still allocated by the result of fn() once it returns"""
+    tracemalloc.start()
+    result = fn()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def bench_token_memory():
+    """memory held by the token store: one (original) Token object per token vs the columnar TokenArray"""
+    print(f"{'file':<24} {'tokens':>8} {'list[Token] (KB)':>17} {'TokenArray (KB)':>16} {'ratio':>7}")
+    totals = [0, 0]
+    for name, src in corpus().items():
+        tokens = tokenize_source(src)
+        objects = retained_memory(lambda: [LegacyToken(tokens.type_at(i), src[start:start + length]) for i, (start, length) in enumerate(zip(tokens.starts, tokens.lengths))])
+        columns = retained_memory(lambda: tokenize_source(src))
+        totals[0] += objects
+        totals[1] += columns
+        print(f"{name:<24} {len(tokens):>8} {objects / 1024:>17.1f} {columns / 1024:>16.1f} {objects / columns:>6.1f}x")
+    print(f"{'total':<24} {'':>8} {totals[0] / 1024:>17.1f} {totals[1] / 1024:>16.1f} {totals[0] / totals[1]:>6.1f}x")
+
+
+def peak_memory(fn: Callable[[], object]) -> int:
+    """highest number of bytes allocated at any point while running fn()"""
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def drain(tokens: Iterable[Token]):
+    """pull every token without holding on to any of them"""
+    for _ in tokens:
+        ...
+
+
+def bench_lazy():
+    """peak memory with the whole token array built up front vs tokens streamed from the file, for tokens alone and for a full compile"""
+    print(f"{'':<24} {'':>8} {'tokens only (KB)':>20}  {'tokens + compile (KB)':>22}")
+    print(f"{'file':<24} {'tokens':>8} {'eager':>9} {'lazy':>10}  {'eager':>10} {'lazy':>11}")
+    with TemporaryDirectory() as tmp:
+        for name, src in corpus().items():
+            path = Path(tmp) / 'Main.jack'
+            path.write_text(src)
+            count = len(tokenize(path))
+            tokens = [peak_memory(lambda: drain(tokenize(path))), peak_memory(lambda: drain(tokenize_lazy(path)))]
+            full = [peak_memory(lambda: compile(tokenize(path))), peak_memory(lambda: compile(tokenize_lazy(path)))]
+            print(f"{name:<24} {count:>8} {tokens[0] / 1024:>9.1f} {tokens[1] / 1024:>10.1f}  {full[0] / 1024:>10.1f} {full[1] / 1024:>11.1f}")
+
+
+def bench_jobs(repeat: int):
+    """wall time of compiling a directory of many classes with 1/2/4/8 worker processes"""
+    with TemporaryDirectory() as tmp:
+        for i in range(100):
+            (Path(tmp) / f'Class{i}.jack').write_text(synthetic_class(50_000, f'Class{i}'))
+
+        print(f"100 classes, {os.cpu_count()} cpus available")
+        print(f"{'jobs':>4} {'time (s)':>9} {'speedup':>8}")
+        serial = None
+        for jobs in [1, 2, 4, 8]:
+            elapsed = timeit(lambda: analyze_dir(Path(tmp), jobs=jobs), repeat)
+            serial = serial or elapsed
+            print(f"{jobs:>4} {elapsed:>9.3f} {serial / elapsed:>7.2f}x")
+
+
+def bench_translate(repeat: int):
+    """wall time of translating a program of many vm files with 1/2/4/8 worker processes, checking that the output doesn't change"""
+    programs = {f'Class{i}': list(compile_vm(tokenize_source(synthetic_class(50_000, f'Class{i}')))) for i in range(100)}
+    commands = sum(len(program) for program in programs.values())
+
+    for settings in [Settings(), Settings(shared_runtime=True, optimize=True, cache_tos=True)]:
+        print(f"100 classes, {commands} vm commands, {os.cpu_count()} cpus available, {settings}")
+        print(f"{'jobs':>4} {'time (s)':>9} {'speedup':>8} {'commands/sec':>13}")
+        expected = VMTranslator.translate_programs(programs, settings)
+        serial = None
+        for jobs in [1, 2, 4, 8]:
+            assert VMTranslator.translate_programs(programs, settings, jobs) == expected, f"output differs with {jobs} jobs"
+            elapsed = timeit(lambda: VMTranslator.translate_programs(programs, settings, jobs), repeat)
+            serial = serial or elapsed
+            print(f"{jobs:>4} {elapsed:>9.3f} {serial / elapsed:>7.2f}x {commands / elapsed:>13.0f}")
+
+
+def bench_compile(repeat: int):
+    """parse + code generation throughput of the compilation engine, measured in tokens/sec"""
+    print(f"{'file':<24} {'tokens':>8} {'time (s)':>9} {'tokens/sec':>11}")
+    total_tokens, total_time = 0, 0.0
+    for name, src in corpus().items():
+        tokens = tokenize_source(src)
+        elapsed = timeit(lambda: compile(tokens), repeat)
+        total_tokens += len(tokens)
+        total_time += elapsed
+        print(f"{name:<24} {len(tokens):>8} {elapsed:>9.4f} {len(tokens) / elapsed:>11.0f}")
+    print(f"{'total':<24} {total_tokens:>8} {total_time:>9.4f} {total_tokens / total_time:>11.0f}")
+
+
+def bench_dispatch(repeat: int):
+    """translator throughput in vm commands/sec over the OS sources, for the main combinations of settings"""
+    programs = {path.stem: compile_source(path) for path in sorted((projects_dir / '12').glob('*.jack'))}
+    commands = sum(len(program) for program in programs.values())
+    rounds = 20
+
+    print(f"OS sources, {commands} vm commands, translated {rounds} times per run")
+    print(f"{'settings':<36} {'time (s)':>9} {'commands/sec':>13}")
+    for name, settings in [('default', Settings()), ('shared runtime', Settings(shared_runtime=True)), ('optimize + cache tos', Settings(optimize=True, cache_tos=True)),
+                           ('default, no comments', Settings(strip_comments=True)), ('optimize + cache tos, no comments', Settings(optimize=True, cache_tos=True, strip_comments=True))]:
+        elapsed = timeit(lambda: [VMTranslator.translate_programs(programs, settings) for _ in range(rounds)], repeat)
+        print(f"{name:<36} {elapsed:>9.3f} {commands * rounds / elapsed:>13.0f}")
+
+
+# runs a script (argv[1:]) and prints its peak resident memory in KB. ru_maxrss can't be used for this, since linux
+# carries the parent's high water mark over into a child started with fork/vfork + exec
+peak_rss_script = """
+import runpy, sys, os
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+runpy.run_path(sys.argv[0], run_name='__main__')
+print(next(line.split()[1] for line in open('/proc/self/status') if line.startswith('VmHWM')))
+"""
+
+
+def bench_stream():
+    """peak RSS and wall time of the vm translator on generated programs of ~100K and ~1M vm commands: whole program in memory vs streamed"""
+    translator = projects_dir / '08' / 'VMTranslator.py'
+    modes = {'in memory': [], 'stream': ['--stream'], 'stream, no comments': ['--stream', '--strip-comments']}
+
+    print(f"{'program':<24} {'mode':<20} {'peak RSS (MB)':>14} {'time (s)':>9} {'output (MB)':>12}")
+    for classes in [10, 100]:
+        with TemporaryDirectory() as tmp:
+            program_dir = Path(tmp) / 'Program'
+            program_dir.mkdir()
+            commands = 0
+            for i in range(classes):
+                writer = compile_vm(tokenize_source(synthetic_class(50_000, f'Class{i}')))
+                (program_dir / f'Class{i}.vm').write_text(str(writer))
+                commands += len(writer)
+
+            outputs = {}
+            for mode, flags in modes.items():
+                start = perf_counter()
+                result = subprocess.run([sys.executable, '-c', peak_rss_script, str(translator), str(program_dir), *flags], capture_output=True, text=True, check=True)
+                elapsed = perf_counter() - start
+                peak_rss = int(result.stdout.split()[-1])
+                outputs[mode] = (program_dir / 'Program.asm').read_bytes()
+                print(f"{f'{commands} vm commands':<24} {mode:<20} {peak_rss / 1024:>14.1f} {elapsed:>9.2f} {len(outputs[mode]) / 2**20:>12.1f}")
+            assert outputs['in memory'] == outputs['stream'], "streamed output differs"
+
+
+def bench_emit(repeat: int):
+    """
+    building Tetris + OS from vm commands to machine code: writing out asm text and assembling it, vs encoding the
+    translator's code straight into machine words (with and without also producing the asm listing)
+    """
+    programs = {path.stem: compile_source(path) for path in tetris_sources()}
+
+    print(f"{'settings':<22} {'asm + assemble (ms)':>20} {'direct (ms)':>12} {'direct + listing (ms)':>22} {'speedup':>8}")
+    for name, settings in [('default', Settings()), ('shared runtime', Settings(shared_runtime=True)), ('optimize + cache tos', Settings(optimize=True, cache_tos=True))]:
+        assembled = lambda: HackAssembler.assemble_lines(link_program(programs, settings))
+        direct = lambda: VMTranslator.emit_hack(programs, settings)[0]
+        with_listing = lambda: VMTranslator.emit_hack(programs, settings, listing=True)[0]
+
+        assert direct() == with_listing() == assembled(), "emitted program differs from the assembled one"
+        assembled_time = timeit(assembled, repeat)
+        direct_time = timeit(direct, repeat)
+        listing_time = timeit(with_listing, repeat)
+        print(f"{name:<22} {assembled_time * 1000:>20.1f} {direct_time * 1000:>12.1f} {listing_time * 1000:>22.1f} {assembled_time / direct_time:>7.1f}x")
+
+
+def bench_relink(repeat: int):
+    """
+    rebuilding Tetris + OS after one file changed: translating and assembling the whole program again, vs
+    translating and assembling just that file into an object and relinking it with the objects of the others
+    """
+    programs = {path.stem: compile_source(path) for path in tetris_sources()}
+    changed = 'Main'
+
+    print(f"{'settings':<16} {'full rebuild (ms)':>18} {'relink one file (ms)':>21} {'speedup':>8}")
+    for name, settings in [('default', Settings()), ('shared runtime', Settings(shared_runtime=True)), ('optimize', Settings(optimize=True))]:
+        full = lambda: VMTranslator.emit_hack(programs, settings)[0]
+
+        bootstrap = HackLinker.assemble_object(VMTranslator.bootstrap(settings))
+        runtime = HackLinker.assemble_object(VMTranslator.shared_runtime(settings))
+        objects = {name: VMTranslator.emit_program(name, program, settings)[0] for name, program in programs.items()}
+        def relink():
+            objects[changed] = VMTranslator.emit_program(changed, programs[changed], settings)[0]
+            return HackLinker.link([bootstrap, *objects.values(), runtime])
+
+        assert relink() == full(), "linked program differs from the monolithic build"
+        full_time = timeit(full, repeat)
+        relink_time = timeit(relink, repeat)
+        print(f"{name:<16} {full_time * 1000:>18.1f} {relink_time * 1000:>21.1f} {full_time / relink_time:>7.1f}x")
+
+
+def bench_assembler():
+    """peak RSS and wall time of the assembler on generated programs of a few million asm lines: the whole file in memory vs a single streaming pass"""
+    translator = projects_dir / '08' / 'VMTranslator.py'
+    assembler = projects_dir / '06' / 'HackAssembler.py'
+    modes = {'in memory': [], 'stream': ['--stream']}
+
+    print(f"{'program':<24} {'mode':<10} {'peak RSS (MB)':>14} {'time (s)':>9} {'lines/sec':>10}")
+    for classes in [10, 30]:
+        with TemporaryDirectory() as tmp:
+            program_dir = Path(tmp) / 'Program'
+            program_dir.mkdir()
+            for i in range(classes):
+                (program_dir / f'Class{i}.vm').write_text(str(compile_vm(tokenize_source(synthetic_class(50_000, f'Class{i}')))))
+            subprocess.run([sys.executable, str(translator), str(program_dir), '--stream'], check=True)
+            asm_path = program_dir / 'Program.asm'
+            with open(asm_path) as f:
+                lines = sum(1 for _ in f)
+
+            outputs = {}
+            for mode, flags in modes.items():
+                start = perf_counter()
+                result = subprocess.run([sys.executable, '-c', peak_rss_script, str(assembler), str(asm_path), *flags], capture_output=True, text=True, check=True)
+                elapsed = perf_counter() - start
+                peak_rss = int(result.stdout.split()[-1])
+                outputs[mode] = asm_path.with_suffix('.hack').read_bytes()
+                print(f"{f'{lines} asm lines':<24} {mode:<10} {peak_rss / 1024:>14.1f} {elapsed:>9.2f} {lines / elapsed:>10.0f}")
+            assert outputs['in memory'] == outputs['stream'], "streamed output differs"
+
+
+def bench_batch():
+    """
+    assembling a regression suite of a few hundred generated programs: running the assembler once per file (as a
+    shell loop would), vs one batch run on 1, 2 and 4 worker processes, vs a batch run where everything is up to date
+    """
+    assembler = projects_dir / '06' / 'HackAssembler.py'
+    files = 200
+
+    with TemporaryDirectory() as tmp:
+        suite = Path(tmp)
+        for i in range(files):
+            program = compile_vm(tokenize_source(synthetic_class(2_000 + 500 * (i % 20), f'Class{i}')))
+            (suite / f'Test{i}.asm').write_text('\n'.join(link_program({f'Class{i}': program})))
+        paths = HackAssembler.find_sources([str(suite)])
+        instructions = sum(HackAssembler.assemble_file(path) for path in paths)
+        expected = {path: HackAssembler.output_path(path).read_bytes() for path in paths}
+
+        print(f"{files} programs, {instructions} instructions")
+        print(f"{'mode':<22} {'time (s)':>9} {'files/sec':>10} {'instructions/sec':>17}")
+        start = perf_counter()
+        for path in paths:
+            subprocess.run([sys.executable, str(assembler), str(path)], check=True, capture_output=True)
+        elapsed = perf_counter() - start
+        print(f"{'process per file':<22} {elapsed:>9.2f} {files / elapsed:>10.1f} {instructions / elapsed:>17.0f}")
+
+        for jobs in [1, 2, 4]:
+            stats = HackAssembler.assemble_batch(paths, jobs=jobs, force=True)
+            assert all(HackAssembler.output_path(path).read_bytes() == expected[path] for path in paths), f"batch output differs with {jobs} jobs"
+            print(f"{f'batch, {jobs} jobs':<22} {stats.seconds:>9.2f} {stats.files / stats.seconds:>10.1f} {stats.instructions / stats.seconds:>17.0f}")
+
+        stats = HackAssembler.assemble_batch(paths)
+        assert stats.skipped == files, "up to date files were assembled again"
+        print(f"{'batch, up to date':<22} {stats.seconds:>9.2f} {'-':>10} {'-':>17}")
+
+
+def bench_encoder(repeat: int):
+    """
+    lines/sec of the assembler's encoding pass with the original per-line encoder vs through the instruction caches, on
+    Tetris + OS and generated programs of increasing size, along with the cache hit rates of the cached runs
+    """
+    tetris = {path.stem: compile_source(path) for path in tetris_sources()}
+    workloads = [('Tetris + OS', tetris, Settings()), ('Tetris + OS, optimize', tetris, Settings(optimize=True, cache_tos=True))]
+    for classes in [4, 16]:
+        synthetic = {f'Class{i}': compile_vm(tokenize_source(synthetic_class(50_000, f'Class{i}'))) for i in range(classes)}
+        workloads.append((f'{classes} synthetic classes', synthetic, Settings()))
+
+    print(f"{'program':<24} {'lines':>8} {'legacy (lines/sec)':>19} {'cached (lines/sec)':>19} {'speedup':>8} {'C hits':>8} {'A hits':>8}")
+    for name, programs, settings in workloads:
+        asm_code = link_program(programs, settings)
+        lines = sum(1 for line in asm_code if not line.startswith('('))
+        assert legacy_assemble_code(asm_code) == HackAssembler.assemble_code(asm_code), "cached encoder gives a different program"
+
+        HackAssembler.encoder_stats = stats = HackAssembler.EncoderStats()
+        legacy_time = timeit(lambda: legacy_assemble_code(asm_code), repeat)
+        cached_time = timeit(lambda: HackAssembler.assemble_code(asm_code), repeat)
+        c_hits = 1 - stats.c_misses / stats.c_instructions
+        a_hits = 1 - stats.a_misses / (stats.a_instructions - stats.a_symbols)
+        print(f"{name:<24} {lines:>8} {lines / legacy_time:>19.0f} {lines / cached_time:>19.0f} {legacy_time / cached_time:>7.1f}x {c_hits:>8.2%} {a_hits:>8.2%}")
+
+
+def bench_rom(repeat: int):
+    """loading the Tetris + OS ROM many times (as emulator test runs do) from the text .hack format vs the packed .hrom format"""
+    programs = {path.stem: compile_source(path) for path in tetris_sources()}
+    hack_lines = VMTranslator.emit_hack(programs, Settings(shared_runtime=True))[0]
+    loads = 100
+
+    with TemporaryDirectory() as tmp:
+        hack_path = Path(tmp) / 'Tetris.hack'
+        rom_path = hack_path.with_suffix(HackRom.ROM_SUFFIX)
+        hack_path.write_text('\n'.join(hack_lines))
+        HackRom.hack_to_rom(hack_path, rom_path)
+
+        print(f"Tetris + OS, {len(hack_lines)} words, loaded {loads} times per run")
+        print(f"{'format':<6} {'file (KB)':>10} {'words (ms/load)':>16} {'emulator (ms/load)':>19}")
+        for name, path, read_words in [('.hack', hack_path, lambda: HackRom.parse_hack(hack_path.read_text().split())),
+                                       ('.hrom', rom_path, lambda: HackRom.map_rom(rom_path).close())]:
+            words_time = timeit(lambda: [read_words() for _ in range(loads)], repeat)
+            emulator_time = timeit(lambda: [HackEmulator.load(path) for _ in range(loads)], repeat)
+            print(f"{name:<6} {path.stat().st_size / 1024:>10.1f} {words_time * 1000 / loads:>16.3f} {emulator_time * 1000 / loads:>19.3f}")
+
+        assert HackEmulator.load(rom_path).rom == HackEmulator.load(hack_path).rom, "packed ROM loads a different program"
+
+
+def link_program(programs: dict[str, list[VMCommand]], settings: Settings = Settings()) -> list[str]:
+    """translate compiled classes (by class name) into a whole program with the given translator settings. Returns asm without whitespace/comments"""
+    asm_lines = bootstrap_asm(settings)
+    asm_lines.extend(VMTranslator.translate_programs(programs, settings))
+    asm_lines.extend(VMTranslator.shared_runtime(settings))
+    return HackAssembler.remove_all_whitespace(asm_lines)
+
+
+def link_with_addresses(programs: dict[str, list[VMCommand]]) -> tuple[list[str], dict[str, list[int]]]:
+    """
+    like link_program (with default settings), but also returns the ROM address where each command's code starts, by class name.
+    Each list has one extra entry at the end: the address just after the class's code
+    """
+    asm_code = HackAssembler.remove_all_whitespace(bootstrap_asm())
+    size = sum(1 for line in asm_code if not line.startswith('('))
+    addresses = {}
+    for name, program in programs.items():
+        addresses[name] = []
+        translator = VMTranslator.Translator(name)
+        for command in program:
+            addresses[name].append(size)
+            code = HackAssembler.remove_all_whitespace(translator.translate(command))
+            size += sum(1 for line in code if not line.startswith('('))
+            asm_code.extend(code)
+        addresses[name].append(size)
+    asm_code.extend(HackAssembler.remove_all_whitespace(VMTranslator.shared_runtime()))
+    return asm_code, addresses
+
+
+def run_until(asm_code: list[str], label: str, max_cycles: int, profile: list[int] | None = None) -> HackEmulator:
+    """assemble the program and run it on the emulator until it first reaches the given label"""
+    emulator = HackEmulator(HackAssembler.assemble_code(asm_code))
+    address = HackAssembler.generate_symbol_table(asm_code)[label]
+    if not emulator.run(max_cycles, address, profile=profile):
+        raise RuntimeError(f"program didn't reach {label} within {max_cycles} cycles")
+    return emulator
+
+
+def function_cycles(asm_code: list[str], profile: list[int]) -> dict[str, int]:
+    """cycles spent in each vm function, from an emulator profile of the program"""
+    cycles: dict[str, int] = {}
+    function, address = 'bootstrap', 0
+    for line in asm_code:
+        if line.startswith('('):
+            label = line[1:-1]
+            # function entry labels are the only ones with a '.' but no '$' (those are labels within functions and runtime routines)
+            if '.' in label and '$' not in label:
+                function = label
+            continue
+        cycles[function] = cycles.get(function, 0) + profile[address]
+        address += 1
+    return cycles
+
+
+def bench_runtime(until: str, max_cycles: int):
+    """ROM size and cycles (from boot until the given label is reached) of the Tetris build, with inlined vs shared call/return/compare"""
+    programs = {path.stem: compile_source(path) for path in tetris_sources()}
+
+    print(f"Tetris + OS, cycles counted from boot until {until}")
+    print(f"{'mode':<8} {'ROM words':>10} {'fits 32K':>9} {'cycles':>11}")
+    results = []
+    for shared in [False, True]:
+        asm_code = link_program(programs, Settings(shared_runtime=shared))
+        emulator = run_until(asm_code, until, max_cycles)
+        size = len(HackAssembler.assemble_code(asm_code))
+        results.append((size, emulator.cycles, emulator.screen()))
+        print(f"{'shared' if shared else 'inline':<8} {size:>10} {'yes' if size <= 32768 else 'no':>9} {emulator.cycles:>11}")
+
+    (inline_size, inline_cycles, inline_screen), (shared_size, shared_cycles, shared_screen) = results
+    assert inline_screen == shared_screen, "screen contents differ between modes"
+    print(f"{'change':<8} {100 * (shared_size - inline_size) / inline_size:>+9.1f}% {'':>9} {100 * (shared_cycles - inline_cycles) / inline_cycles:>+10.1f}%")
+
+
+def bench_peephole(until: str, max_cycles: int):
+    """instructions and cycles (from boot until the given label is reached) saved by each peephole pattern on the Tetris build"""
+    programs = {path.stem: compile_source(path) for path in tetris_sources()}
+    sites: dict[str, list[Site]] = {}
+    optimized = {}
+    for name, program in programs.items():
+        sites[name] = []
+        optimized[name] = optimize(program, sites[name])
+
+    # run both builds with a per-instruction profile. They execute the same vm commands, so for every rewritten
+    # window, the cycles spent in its original code vs in its fused code gives the cycles that rewrite saved
+    builds = []
+    for build in [programs, optimized]:
+        asm_code, addresses = link_with_addresses(build)
+        profile = [0] * len(asm_code)
+        emulator = run_until(asm_code, until, max_cycles, profile)
+        builds.append((addresses, profile, emulator))
+    (original_addresses, original_profile, original), (optimized_addresses, optimized_profile, fused) = builds
+    assert original.screen() == fused.screen(), "screen contents differ between the original and optimized builds"
+
+    savings: dict[str, list[int]] = {pattern: [0, 0, 0] for pattern, _, _ in patterns}  # sites, instructions, cycles
+    for name in programs:
+        for site in sites[name]:
+            original_range = range(original_addresses[name][site.start], original_addresses[name][site.start + site.length])
+            fused_range = range(optimized_addresses[name][site.index], optimized_addresses[name][site.index + 1])
+            stats = savings[site.pattern]
+            stats[0] += 1
+            stats[1] += len(original_range) - len(fused_range)
+            stats[2] += sum(original_profile[i] for i in original_range) - sum(optimized_profile[i] for i in fused_range)
+
+    original_size, optimized_size = len(original.rom), len(fused.rom)
+    print(f"Tetris + OS, cycles counted from boot until {until}")
+    print(f"{'pattern':<24} {'sites':>6} {'instructions saved':>19} {'cycles saved':>13}")
+    for pattern, (count, instructions, cycles) in sorted(savings.items(), key=lambda item: item[1][2], reverse=True):
+        print(f"{pattern:<24} {count:>6} {instructions:>19} {cycles:>13}")
+    total = [sum(stats[i] for stats in savings.values()) for i in range(3)]
+    print(f"{'total':<24} {total[0]:>6} {total[1]:>19} {total[2]:>13}")
+    print(f"ROM words {original_size} -> {optimized_size} ({100 * (optimized_size - original_size) / original_size:+.1f}%), "
+          f"cycles {original.cycles} -> {fused.cycles} ({100 * (fused.cycles - original.cycles) / original.cycles:+.1f}%)")
+
+
+def bench_asm_peephole(until: str, max_cycles: int):
+    """
+    words and cycles (from boot until the given label is reached) saved by the assembler's peephole optimizer on the
+    Tetris build, by rule, with each optimized build checked against the original on the emulator
+    """
+    programs = {path.stem: compile_source(path) for path in tetris_sources()}
+
+    print(f"Tetris + OS, cycles counted from boot until {until}")
+    print(f"{'settings':<22} {' '.join(f'{rule:>16}' for rule in HackOptimizer.rules)} {'ROM words':>16} {'cycles':>20} {'time (ms)':>10}")
+    for name, settings in [('default', Settings()), ('shared runtime', Settings(shared_runtime=True)), ('optimize + cache tos', Settings(optimize=True, cache_tos=True))]:
+        asm_code = link_program(programs, settings)
+        savings = {}
+        start = perf_counter()
+        optimized_code, _ = HackAssembler.optimize_code(asm_code, savings)
+        elapsed = perf_counter() - start
+
+        assert not HackAssembler.verify_optimized(asm_code, until, max_cycles=max_cycles), "optimized build behaves differently"
+        original = run_until(asm_code, until, max_cycles)
+        optimized = run_until(optimized_code, until, max_cycles)
+        words = f'{len(original.rom)} -> {len(optimized.rom)}'
+        cycles = f'{100 * (optimized.cycles - original.cycles) / original.cycles:+.2f}%'
+        print(f"{name:<22} {' '.join(f'{savings.get(rule, 0):>16}' for rule in HackOptimizer.rules)} {words:>16} {cycles:>20} {elapsed * 1000:>10.1f}")
+
+
+def bench_tos(until: str, max_cycles: int, function: str):
+    """cycles (from boot until the given label is reached) with and without top of stack caching, in total and within one function"""
+    programs = {path.stem: compile_source(path) for path in tetris_sources()}
+
+    print(f"Tetris + OS, cycles counted from boot until {until}")
+    print(f"{'build':<24} {'ROM words':>10} {'cycles':>11} {'change':>7} {function + ' cycles':>24} {'change':>7}")
+    for optimize_ in [False, True]:
+        baseline = None
+        for cache_tos in [False, True]:
+            asm_code = link_program(programs, Settings(optimize=optimize_, cache_tos=cache_tos))
+            profile = [0] * len(asm_code)
+            emulator = run_until(asm_code, until, max_cycles, profile)
+            in_function = function_cycles(asm_code, profile).get(function, 0)
+            name = ' + '.join(['optimize'] * optimize_ + ['cache tos'] * cache_tos) or 'baseline'
+            if baseline is None:
+                baseline = (emulator.cycles, in_function, emulator.screen())
+                changes = ['', '']
+            else:
+                assert emulator.screen() == baseline[2], f"screen contents differ with {name}"
+                changes = [f"{100 * (emulator.cycles - baseline[0]) / baseline[0]:+.1f}%", f"{100 * (in_function - baseline[1]) / max(baseline[1], 1):+.1f}%"]
+            print(f"{name:<24} {len(emulator.rom):>10} {emulator.cycles:>11} {changes[0]:>7} {in_function:>24} {changes[1]:>7}")
+
+
+def bench_prologue(until: str, max_cycles: int):
+    """
+    ROM words and cycles (from boot until the given label is reached) of the Tetris build with the function prologue
+    chosen at each optimization level, against the original prologue pushing a constant 0 for each local
+    """
+    programs = {path.stem: compile_source(path) for path in tetris_sources()}
+    local_counts = [command.index for program in programs.values() for command in program if command.op == FUNCTION and command.index > 0]
+
+    print(f"Tetris + OS, {len(local_counts)} functions with locals, cycles counted from boot until {until}")
+    print(f"{'runtime':<8} {'prologue':<10} {'unrolled/loop/shared':>21} {'ROM words':>10} {'bytes saved':>12} {'cycles':>11} {'change':>7}")
+    for shared in [False, True]:
+        asm_code = legacy_prologue_program(programs, Settings(shared_runtime=shared))
+        legacy = run_until(asm_code, until, max_cycles)
+        runtime = 'shared' if shared else 'inline'
+        print(f"{runtime:<8} {'original':<10} {'':>21} {len(legacy.rom):>10} {'':>12} {legacy.cycles:>11} {'':>7}")
+
+        for level in ['speed', 'balanced', 'size']:
+            settings = Settings(shared_runtime=shared, opt_level=level)
+            emulator = run_until(link_program(programs, settings), until, max_cycles)
+            assert emulator.screen() == legacy.screen(), f"screen contents differ at {level}"
+            choices = [VMTranslator.choose_prologue(local_count, settings) for local_count in local_counts]
+            counts = '/'.join(str(choices.count(option)) for option in ['unrolled', 'loop', 'shared'])
+            saved = 2 * (len(legacy.rom) - len(emulator.rom))
+            print(f"{'':<8} {level:<10} {counts:>21} {len(emulator.rom):>10} {saved:>12} {emulator.cycles:>11} "
+                  f"{100 * (emulator.cycles - legacy.cycles) / legacy.cycles:>+6.2f}%")
+
+
+################## Legacy implementations kept as benchmark baselines ##################
+
+@dataclass
+class LegacyToken:
+    type: str
+    value: str
+
+
+def legacy_tokenize(source: str) -> list[LegacyToken]:
+    """the original tokenizer, which re-slices the remaining source after every token"""
+    src = Ref(source)
+    tokens: list[LegacyToken] = []
+
+    while len(src.value) > 0:
+        if src.value.startswith("//"):
+            i = 2
+            while i < len(src.value) and src.value[i] != "\n":
+                i += 1
+            src.value = src.value[i:]
+            continue
+        if src.value.startswith("/*"):
+            i = 2
+            while i < len(src.value) and not src.value[i:].startswith("*/"):
+                i += 1
+            src.value = src.value[i+2:]
+            continue
+        if src.value[0].isspace():
+            i = 1
+            while i < len(src.value) and src.value[i].isspace():
+                i += 1
+            src.value = src.value[i:]
+            continue
+        keyword = next((k for k in keywords if src.value.startswith(k) and (len(src.value) == len(k) or not src.value[len(k)].isalnum())), None)
+        if keyword is not None:
+            tokens.append(LegacyToken("keyword", keyword))
+            src.value = src.value[len(keyword):]
+            continue
+        if src.value[0] in symbols:
+            tokens.append(LegacyToken("symbol", src.value[0]))
+            src.value = src.value[1:]
+            continue
+        if src.value[0].isdigit():
+            i = 1
+            while i < len(src.value) and src.value[i].isdigit():
+                i += 1
+            tokens.append(LegacyToken("integerConstant", src.value[:i]))
+            src.value = src.value[i:]
+            continue
+        if src.value[0] == '"':
+            i = 1
+            while i < len(src.value) and src.value[i] != '"':
+                i += 1
+            tokens.append(LegacyToken("stringConstant", src.value[1:i]))
+            src.value = src.value[i+1:]
+            continue
+        if src.value[0].isalpha() or src.value[0] == "_":
+            i = 1
+            while i < len(src.value) and (src.value[i].isalnum() or src.value[i] == "_"):
+                i += 1
+            tokens.append(LegacyToken("identifier", src.value[:i]))
+            src.value = src.value[i:]
+            continue
+
+        raise Exception(f"Invalid token: '{src.value[:40]}'")
+
+    return tokens
+
+
+
+class LegacyPrologueTranslator(VMTranslator.Translator):
+    """translator with the original function prologue, which pushes a constant 0 for each local"""
+
+    def init_locals(self, local_count: int) -> list[str]:
+        return VMTranslator.push_constant(0) * local_count
+
+
+def legacy_prologue_program(programs: dict[str, list[VMCommand]], settings: Settings = Settings()) -> list[str]:
+    """like link_program, but translated with the original function prologue"""
+    asm_lines = bootstrap_asm(settings)
+    for name, program in programs.items():
+        asm_lines.extend(LegacyPrologueTranslator(name, settings).translate_program(program))
+    asm_lines.extend(VMTranslator.shared_runtime(settings))
+    return HackAssembler.remove_all_whitespace(asm_lines)
+
+def legacy_assemble_code(lines: list[str]) -> list[str]:
+    """the original encoding pass of the assembler, which splits up and formats every instruction again"""
+    symbols = HackAssembler.generate_symbol_table(lines)
+    return [HackAssembler.binarize_line(line, symbols) for line in lines if not line.startswith('(')]
+
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("bench", choices=["tokenizer", "classes", "memory", "lazy", "compile", "jobs", "translate", "stream", "assembler", "batch", "encoder", "rom", "dispatch", "emit", "relink", "runtime", "peephole", "asm-peephole", "tos", "prologue"], help="Which benchmark to run")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per measurement (best time is reported)")
+    parser.add_argument("--until", default="Game.drop_piece", help="Label where emulated runs stop (counted from boot)")
+    parser.add_argument("--max-cycles", type=int, default=200_000_000, help="Cycle limit for emulated runs")
+    parser.add_argument("--function", default="Screen.drawLine", help="Function whose cycles are reported separately by the tos benchmark")
+    args = parser.parse_args()
+
+    if args.bench == "tokenizer":
+        bench_tokenizer(args.repeat)
+    elif args.bench == "classes":
+        bench_token_classes()
+    elif args.bench == "memory":
+        bench_token_memory()
+    elif args.bench == "lazy":
+        bench_lazy()
+    elif args.bench == "compile":
+        bench_compile(args.repeat)
+    elif args.bench == "jobs":
+        bench_jobs(args.repeat)
+    elif args.bench == "translate":
+        bench_translate(args.repeat)
+    elif args.bench == "stream":
+        bench_stream()
+    elif args.bench == "assembler":
+        bench_assembler()
+    elif args.bench == "batch":
+        bench_batch()
+    elif args.bench == "encoder":
+        bench_encoder(args.repeat)
+    elif args.bench == "rom":
+        bench_rom(args.repeat)
+    elif args.bench == "dispatch":
+        bench_dispatch(args.repeat)
+    elif args.bench == "emit":
+        bench_emit(args.repeat)
+    elif args.bench == "relink":
+        bench_relink(args.repeat)
+    elif args.bench == "runtime":
+        bench_runtime(args.until, args.max_cycles)
+    elif args.bench == "peephole":
+        bench_peephole(args.until, args.max_cycles)
+    elif args.bench == "asm-peephole":
+        bench_asm_peephole(args.until, args.max_cycles)
+    elif args.bench == "tos":
+        bench_tos(args.until, args.max_cycles, args.function)
+    elif args.bench == "prologue":
+        bench_prologue(args.until, args.max_cycles)
@@ -1,6 +1,15 @@
 from dataclasses import dataclass
+from pathlib import Path
+import os
 
 
 @dataclass
 class Ref[T]:
     value: T
+
+
+def write_atomic(path: Path, text: str) -> None:
+    """write via a temporary file + rename so that readers never see a partially written file"""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(text)
+    os.replace(tmp_path, path)